@@ -0,0 +1,309 @@
+"""
+Резервные копии vpn.db без остановки бота.
+
+Копия снимается SQLite backup API шагами по step_pages страниц с паузой
+между шагами: блокировка чтения держится только на время шага, записи
+бота проходят между шагами. Если БД изменилась другим соединением,
+SQLite начинает копирование заново - тогда шаг увеличивается
+(step_pages * 4, затем вся БД за один шаг), чтобы копия завершилась
+и на постоянно пишущей БД. В режиме WAL копирование идёт одним шагом:
+чтение там не блокирует записи.
+
+Снятая копия (временный файл рядом с бэкапами) разбирается на страницы:
+    full - вся БД, gzip (gunzip даёт готовый файл SQLite)
+    incr - только страницы, изменившиеся с предыдущего бэкапа цепочки
+           (по хэшам страниц), gzip записей (номер страницы, страница)
+Это аналог доставки WAL для БД в режиме rollback journal: изменения
+между бэкапами хранятся страницами, а не полными копиями. Новая цепочка
+(full) начинается каждые full_every бэкапов или при смене размера страницы.
+
+Файлы бэкапа <name>:
+    <name>.data.gz - страницы
+    <name>.pages   - blake2b по 16 байт на страницу (для следующего incr)
+    <name>.json    - манифест: родитель, размер страницы, число страниц,
+                     sha256 всей БД; пишется последним - бэкап без
+                     манифеста считается незавершённым
+
+restore собирает БД из цепочки full + incr и сверяет sha256, verify
+дополнительно проверяет integrity_check и версию схемы.
+Команды: scripts/backup.py, по расписанию - scripts/backup.sh.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import struct
+import tempfile
+import time
+import zlib
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+PAGE_NUMBER = struct.Struct('>I')
+DIGEST_SIZE = 16
+
+
+class _Restarted(Exception):
+    """Источник изменён во время копирования - SQLite начал заново"""
+
+
+def online_copy(db_file, dest, step_pages=64, step_sleep=0.005):
+    """
+    Согласованная копия db_file в dest через backup API.
+    Возвращает статистику: шаги, перезапуски, итоговый размер шага, секунды
+    """
+    stats = {'steps': 0, 'restarts': 0, 'step_pages': step_pages, 'seconds': 0.0}
+    started = time.perf_counter()
+    src = sqlite3.connect(db_file, timeout=30)
+    try:
+        # В режиме WAL читатель не мешает писателям: вся БД копируется
+        # за один шаг (одна читающая транзакция) и без перезапусков
+        stats['journal_mode'] = src.execute("PRAGMA journal_mode").fetchone()[0]
+        if stats['journal_mode'] == 'wal':
+            stats['step_pages'] = -1
+        while True:
+            if os.path.exists(dest):
+                os.remove(dest)
+            dst = sqlite3.connect(dest)
+            last = [None]
+            pages_total = [0]
+
+            def progress(status, remaining, total):
+                stats['steps'] += 1
+                pages_total[0] = total
+                if last[0] is not None and remaining > last[0]:
+                    raise _Restarted()
+                last[0] = remaining
+                if remaining and step_sleep:
+                    time.sleep(step_sleep)
+
+            try:
+                src.backup(dst, pages=stats['step_pages'], progress=progress)
+                break
+            except _Restarted:
+                stats['restarts'] += 1
+                # -1 - вся БД за один шаг
+                step = stats['step_pages'] * 4
+                stats['step_pages'] = -1 if step >= pages_total[0] else step
+                logger.info(f"Бэкап: БД изменилась во время копирования, шаг {stats['step_pages']} страниц")
+            finally:
+                dst.close()
+    finally:
+        src.close()
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+def _manifest_path(backup_dir, name):
+    return os.path.join(backup_dir, f"{name}.json")
+
+
+def load_manifest(backup_dir, name):
+    with open(_manifest_path(backup_dir, name)) as f:
+        return json.load(f)
+
+
+def list_backups(backup_dir):
+    """Манифесты завершённых бэкапов по времени создания"""
+    if not os.path.isdir(backup_dir):
+        return []
+    manifests = [load_manifest(backup_dir, entry[:-5])
+                 for entry in os.listdir(backup_dir) if entry.endswith('.json')]
+    return sorted(manifests, key=lambda m: m['name'])
+
+
+def _read_hashes(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return [data[i:i + DIGEST_SIZE] for i in range(0, len(data), DIGEST_SIZE)]
+
+
+def _write_atomic(path, write):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def create_backup(db_file, backup_dir, full_every=24, compresslevel=6, step_pages=64, step_sleep=0.005):
+    """Снимает бэкап (incr к последнему, если цепочка не длиннее full_every). Возвращает манифест"""
+    os.makedirs(backup_dir, exist_ok=True)
+    snapshot = os.path.join(backup_dir, '.snapshot.tmp')
+    copy_stats = online_copy(db_file, snapshot, step_pages, step_sleep)
+
+    try:
+        conn = sqlite3.connect(snapshot)
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        conn.close()
+
+        backups = list_backups(backup_dir)
+        parent = backups[-1] if backups else None
+        if parent is not None and (parent['page_size'] != page_size or parent['chain_length'] >= full_every):
+            parent = None
+        parent_hashes = _read_hashes(os.path.join(backup_dir, f"{parent['name']}.pages")) if parent else []
+
+        kind = 'incr' if parent else 'full'
+        base = os.path.splitext(os.path.basename(db_file))[0]
+        name = f"{base}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{kind}"
+        data_path = os.path.join(backup_dir, f"{name}.data.gz")
+        sha256 = hashlib.sha256()
+        hashes = []
+        written = 0
+
+        def write_data(f):
+            nonlocal written
+            with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=compresslevel, mtime=0) as out, \
+                    open(snapshot, 'rb') as src:
+                page_number = 0
+                while True:
+                    page = src.read(page_size)
+                    if not page:
+                        break
+                    page_number += 1
+                    sha256.update(page)
+                    digest = hashlib.blake2b(page, digest_size=DIGEST_SIZE).digest()
+                    hashes.append(digest)
+                    if parent is None:
+                        out.write(page)
+                    elif page_number > len(parent_hashes) or parent_hashes[page_number - 1] != digest:
+                        out.write(PAGE_NUMBER.pack(page_number) + page)
+                    else:
+                        continue
+                    written += 1
+
+        _write_atomic(data_path, write_data)
+        _write_atomic(os.path.join(backup_dir, f"{name}.pages"), lambda f: f.write(b''.join(hashes)))
+
+        manifest = {
+            'name': name,
+            'kind': kind,
+            'parent': parent['name'] if parent else None,
+            'chain_length': parent['chain_length'] + 1 if parent else 1,
+            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'source': os.path.abspath(db_file),
+            'page_size': page_size,
+            'page_count': len(hashes),
+            'pages_written': written,
+            'bytes': os.path.getsize(data_path),
+            'sha256': sha256.hexdigest(),
+            'copy': copy_stats,
+        }
+        _write_atomic(_manifest_path(backup_dir, name),
+                      lambda f: f.write(json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')))
+    finally:
+        if os.path.exists(snapshot):
+            os.remove(snapshot)
+
+    logger.info(f"Бэкап {name}: {written} из {len(hashes)} страниц, {manifest['bytes']} байт, "
+                f"копия {copy_stats['seconds']:.2f}с, перезапусков {copy_stats['restarts']}")
+    return manifest
+
+
+def chain(backup_dir, name):
+    """Манифесты от full до name"""
+    manifests = [load_manifest(backup_dir, name)]
+    while manifests[-1]['parent']:
+        manifests.append(load_manifest(backup_dir, manifests[-1]['parent']))
+    return manifests[::-1]
+
+
+def _assemble(backup_dir, manifests, path):
+    """Страницы цепочки manifests (full, incr...) в файл path"""
+    page_size = manifests[-1]['page_size']
+    with open(path, 'wb') as out:
+        for manifest in manifests:
+            with gzip.open(os.path.join(backup_dir, f"{manifest['name']}.data.gz"), 'rb') as data:
+                if manifest['kind'] == 'full':
+                    while True:
+                        chunk = data.read(1 << 20)
+                        if not chunk:
+                            break
+                        out.write(chunk)
+                    continue
+                while True:
+                    header = data.read(PAGE_NUMBER.size)
+                    if not header:
+                        break
+                    out.seek((PAGE_NUMBER.unpack(header)[0] - 1) * page_size)
+                    out.write(data.read(page_size))
+        out.truncate(manifests[-1]['page_count'] * page_size)
+
+
+def restore(backup_dir, name, dest):
+    """Собирает БД бэкапа name в dest (атомарно). ValueError - файл страниц повреждён или sha256 не совпал"""
+    manifests = chain(backup_dir, name)
+    target = manifests[-1]
+    tmp = dest + '.restore.tmp'
+    try:
+        _assemble(backup_dir, manifests, tmp)
+        sha256 = hashlib.sha256()
+        with open(tmp, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha256.update(chunk)
+        if sha256.hexdigest() != target['sha256']:
+            raise ValueError(f"Бэкап {name}: sha256 восстановленной БД не совпадает с манифестом")
+    except (zlib.error, EOFError) as e:
+        os.remove(tmp)
+        raise ValueError(f"Бэкап {name}: файл страниц повреждён ({e})")
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, dest)
+    return target
+
+
+def verify(backup_dir, name):
+    """
+    Восстанавливает бэкап во временный файл и проверяет его: sha256,
+    PRAGMA integrity_check, версия схемы и число строк основных таблиц
+    """
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(dir=backup_dir) as workdir:
+        dest = os.path.join(workdir, 'verify.db')
+        restore(backup_dir, name, dest)
+        conn = sqlite3.connect(f"file:{dest}?mode=ro", uri=True)
+        try:
+            integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            result = {
+                'name': name,
+                'chain': [m['name'] for m in chain(backup_dir, name)],
+                'integrity': integrity,
+                'schema_version': conn.execute("PRAGMA user_version").fetchone()[0],
+                'rows': {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                         for table in ('users', 'servers', 'subscriptions', 'uuid_pool')
+                         if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                         (table,)).fetchone()},
+            }
+        finally:
+            conn.close()
+    result['ok'] = result['integrity'] == 'ok'
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def prune(backup_dir, keep_full=7):
+    """Удаляет цепочки старше keep_full последних full. Возвращает имена удалённых бэкапов"""
+    backups = list_backups(backup_dir)
+    fulls = [m['name'] for m in backups if m['kind'] == 'full']
+    # Последняя цепочка остаётся всегда
+    keep_full = max(keep_full, 1)
+    if len(fulls) <= keep_full:
+        return []
+    oldest_kept = fulls[-keep_full]
+    removed = []
+    for manifest in backups:
+        if manifest['name'] >= oldest_kept:
+            break
+        # Манифест первым: бэкап без манифеста уже не считается завершённым
+        for suffix in ('.json', '.data.gz', '.pages'):
+            path = os.path.join(backup_dir, manifest['name'] + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+        removed.append(manifest['name'])
+    return removed
@@ -0,0 +1,141 @@
+"""
+Сжатые варианты payload подписок для subscription сервера.
+
+Payload - base64 со ссылками всех серверов, несколько килобайт, и клиенты
+опрашивают его постоянно. Сжимать на каждый запрос дорого, поэтому сжатые
+варианты (br, gzip) хранятся в LRU по токену вместе с версией payload и его
+ETag и считаются заново, только когда payload изменился. Там же - модель
+серверов и тексты подписки в других форматах (api/sub_formats.py).
+
+brotli ставится из requirements.txt; без него отдаётся только gzip
+(в лог - предупреждение, если br указан в SUB_COMPRESSION)
+"""
+import gzip
+import logging
+import threading
+from collections import OrderedDict
+from hashlib import blake2b
+
+from api.sub_formats import BASE64, render
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# В порядке предпочтения сервера при равном q в Accept-Encoding
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(data, encoding):
+    """Максимальная степень сжатия: результат кэшируется, сжатие - раз на версию payload"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11, mode=brotli.MODE_TEXT)
+    if encoding == 'gzip':
+        # mtime=0 - одинаковый результат для одинакового payload
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    raise ValueError(f"Неизвестное сжатие: {encoding}")
+
+
+class _Entry:
+    __slots__ = ('version', 'digest', 'variants', 'servers', 'rendered')
+
+    def __init__(self, version, digest):
+        self.version = version
+        self.digest = digest
+        self.variants = {}
+        self.servers = None
+        self.rendered = {}
+
+
+class CompressedPayloads:
+    """
+    LRU token -> (версия payload, хэш payload, {(формат, encoding): bytes},
+    модель серверов, {формат: текст}). Версия - (длина, hash()) строки
+    payload: прочитанный заново payload сравнивается без хранения его копии
+    """
+
+    def __init__(self, max_size=10000, min_size=512, encodings=ENCODINGS):
+        self.max_size = max_size
+        self.min_size = min_size
+        self.encodings = tuple(e for e in encodings if e in ENCODINGS)
+        unavailable = [e for e in encodings if e not in ENCODINGS]
+        if unavailable:
+            hint = " (brotli - из requirements.txt)" if 'br' in unavailable else ""
+            logger.warning(f"Сжатие {', '.join(unavailable)} недоступно{hint}, "
+                           f"отдаётся: {', '.join(self.encodings) or 'без сжатия'}")
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'compressions': 0, 'renders': 0}
+
+    def _entry(self, token, payload):
+        version = (len(payload), hash(payload))
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end(token)
+                return entry
+
+        entry = _Entry(version, blake2b(payload.encode('utf-8'), digest_size=16).digest())
+        if self.max_size > 0:
+            with self._lock:
+                self._entries[token] = entry
+                self._entries.move_to_end(token)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def _text(self, entry, payload, fmt, load_servers):
+        """(формат, текст): base64 - сам payload; без модели серверов - тоже он"""
+        if fmt == BASE64:
+            return BASE64, payload
+        text = entry.rendered.get(fmt)
+        if text is None:
+            if entry.servers is None:
+                entry.servers = load_servers()
+            if not entry.servers:
+                return BASE64, payload
+            text = entry.rendered[fmt] = render(fmt, entry.servers)
+            self.stats['renders'] += 1
+        return fmt, text
+
+    def get(self, token, payload, encoding, fmt=BASE64, load_servers=None):
+        """
+        (тело ответа, формат, сжатие или None, хэш payload).
+        fmt - формат api/sub_formats.py, load_servers() - модель серверов
+        подписки (вызывается один раз на версию payload). Тело сжато, если
+        encoding задан и текст не меньше min_size
+        """
+        # Параллельные запросы могут отрисовать или сжать одно и то же
+        # дважды - это дешевле блокировки
+        entry = self._entry(token, payload)
+        fmt, text = self._text(entry, payload, fmt, load_servers)
+        if encoding is None or len(text) < self.min_size:
+            return text, fmt, None, entry.digest
+
+        body = entry.variants.get((fmt, encoding))
+        if body is not None:
+            self.stats['hits'] += 1
+            return body, fmt, encoding, entry.digest
+
+        body = entry.variants[(fmt, encoding)] = compress(text.encode('utf-8'), encoding)
+        self.stats['compressions'] += 1
+        return body, fmt, encoding, entry.digest
+
+    def discard(self, token):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def etag(digest, headers, fmt=BASE64):
+    """
+    ETag ответа (слабый - одинаковый для всех сжатий): payload, формат
+    и Subscription-Userinfo (трафик и срок меняются без payload)
+    """
+    tail = f"{fmt}|{headers.get('Subscription-Userinfo', '')}".encode('utf-8')
+    return blake2b(digest + tail, digest_size=12).hexdigest()
@@ -0,0 +1,154 @@
+"""
+Проверка доступности VPN серверов.
+
+Все серверы проверяются параллельно (asyncio): TCP connect на ip:port
+или TLS handshake с SNI маскировки REALITY. Скользящая статистика
+(RTT, доля сбоев, сбои подряд) хранится в памяти и в таблице server_health.
+Серверы с is_healthy = 0 не выдаются в новых подписках и payload'ах.
+Когда доступность сервера меняется, VPNManager рассылает событие
+'servers_changed' с токенами его подписок: снимок, статическая карта
+и шарды пересобирают их payload'ы.
+"""
+import asyncio
+import logging
+import ssl
+import time
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+REALITY_SNI = 'www.microsoft.com'
+
+
+class ServerHealth:
+    """Скользящая статистика одного сервера"""
+
+    def __init__(self, window=20, fail_threshold=3, recover_threshold=2):
+        self.results = deque(maxlen=window)
+        self.fail_threshold = fail_threshold
+        self.recover_threshold = recover_threshold
+        self.rtt_ms = None
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        self.is_healthy = True
+        self.checked_at = None
+
+    def record(self, ok, rtt_ms=None):
+        self.results.append(ok)
+        self.checked_at = datetime.now()
+        if ok:
+            self.consecutive_failures = 0
+            self.consecutive_successes += 1
+            # EWMA, чтобы единичные всплески не дёргали среднее
+            self.rtt_ms = rtt_ms if self.rtt_ms is None else self.rtt_ms * 0.8 + rtt_ms * 0.2
+            if not self.is_healthy and self.consecutive_successes >= self.recover_threshold:
+                self.is_healthy = True
+        else:
+            self.consecutive_successes = 0
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.fail_threshold:
+                self.is_healthy = False
+
+    @property
+    def failure_rate(self):
+        if not self.results:
+            return 0.0
+        return 1.0 - sum(self.results) / len(self.results)
+
+
+class HealthProber:
+    def __init__(self, vpn_manager, mode='tcp', timeout=3.0, window=20, fail_threshold=3):
+        self.vpn_manager = vpn_manager
+        self.mode = mode
+        self.timeout = timeout
+        self.window = window
+        self.fail_threshold = fail_threshold
+        self.stats = {}
+        self._ssl_context = None
+
+    def _tls_context(self):
+        if self._ssl_context is None:
+            # Проверяем только, что узел отвечает TLS handshake, сертификат не валидируем
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            self._ssl_context = context
+        return self._ssl_context
+
+    async def probe(self, server):
+        """Одна проверка сервера: (ok, rtt_ms)"""
+        started = time.perf_counter()
+        try:
+            kwargs = {}
+            if self.mode == 'tls':
+                kwargs = {'ssl': self._tls_context(), 'server_hostname': REALITY_SNI}
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(server['ip'], server['port'], **kwargs),
+                timeout=self.timeout
+            )
+            rtt_ms = (time.perf_counter() - started) * 1000
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, ssl.SSLError):
+                pass
+            return True, rtt_ms
+        except (OSError, asyncio.TimeoutError, ssl.SSLError) as e:
+            logger.debug(f"Сервер {server['name']} недоступен: {e}")
+            return False, None
+
+    async def probe_all(self, servers=None):
+        """Проверяет все серверы параллельно, обновляет статистику и таблицу server_health"""
+        if servers is None:
+            servers = await asyncio.to_thread(self._load_servers)
+
+        results = await asyncio.gather(*(self.probe(server) for server in servers))
+
+        changed = []
+        for server, (ok, rtt_ms) in zip(servers, results):
+            health = self.stats.get(server['id'])
+            if health is None:
+                health = ServerHealth(self.window, self.fail_threshold)
+                self.stats[server['id']] = health
+            was_healthy = health.is_healthy
+            health.record(ok, rtt_ms)
+            if health.is_healthy != was_healthy:
+                changed.append(server)
+                state = "снова доступен" if health.is_healthy else "исключён как недоступный"
+                logger.warning(f"Сервер {server['name']} {state}")
+
+        await asyncio.to_thread(self._save, [server['id'] for server in servers])
+        if changed:
+            # После записи server_health: пересобранные payload'ы уже без/с этими серверами
+            await asyncio.to_thread(self.vpn_manager.notify_servers_changed,
+                                    [server['id'] for server in changed])
+        return changed
+
+    async def run(self, interval):
+        """Бесконечный цикл проверок"""
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error(f"Ошибка проверки серверов: {e}")
+            await asyncio.sleep(interval)
+
+    def _load_servers(self):
+        return [{key: row[key] for key in ('id', 'name', 'ip', 'port')}
+                for row in self.vpn_manager.repository.active_server_rows()]
+
+    def _save(self, server_ids):
+        rows = []
+        for server_id in server_ids:
+            health = self.stats[server_id]
+            rows.append((
+                server_id,
+                int(health.is_healthy),
+                round(health.rtt_ms, 1) if health.rtt_ms is not None else None,
+                round(health.failure_rate, 3),
+                health.consecutive_failures,
+                health.checked_at.strftime('%Y-%m-%d %H:%M:%S')
+            ))
+
+        self.vpn_manager.repository.save_server_health(rows)
@@ -0,0 +1,552 @@
+"""
+Версионные миграции схемы vpn.db.
+
+Версия схемы хранится в PRAGMA user_version. Миграции - упорядоченный
+список шагов (версия, описание, функция); применяются только шаги
+с версией больше текущей, после каждого шага версия фиксируется.
+Шаги идемпотентны (IF NOT EXISTS, проверка колонок), поэтому прерванная
+миграция безопасно перезапускается.
+
+Большие таблицы переписываются пачками с коммитом после каждой пачки
+(batched_update, rebuild_table), чтобы бот и subscription сервер
+продолжали работать во время миграции. Новую миграцию добавлять
+в конец MIGRATIONS.
+"""
+import fcntl
+import logging
+import re
+import sqlite3
+import time
+
+from bot.config import DB_FILE
+from api.uuid_blob import to_db as uuid_to_db
+
+logger = logging.getLogger(__name__)
+
+# UUID4 строкой средствами SQLite (для заполнения токенов пачками без выгрузки строк)
+SQL_UUID4 = (
+    "lower(hex(randomblob(4))) || '-' || lower(hex(randomblob(2))) || '-4' || "
+    "substr(lower(hex(randomblob(2))), 2) || '-' || "
+    "substr('89ab', 1 + (abs(random()) % 4), 1) || substr(lower(hex(randomblob(2))), 2) || '-' || "
+    "lower(hex(randomblob(6)))"
+)
+
+
+class Migrator:
+    """Соединение и параметры пакетной обработки для шагов миграции"""
+
+    def __init__(self, conn, batch_size=5000, pause=0.01, log=logger.info):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.pause = pause
+        self.log = log
+
+    def execute(self, sql, params=()):
+        return self.conn.execute(sql, params)
+
+    def commit(self):
+        self.conn.commit()
+
+    def columns(self, table):
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+
+    def table_exists(self, table):
+        return self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone() is not None
+
+    def add_column(self, table, column, definition):
+        """ALTER TABLE ADD COLUMN, если колонки ещё нет"""
+        if column not in self.columns(table):
+            self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            self.conn.commit()
+
+    def _yield(self):
+        """Коммит пачки и пауза, чтобы другие процессы успели взять блокировку"""
+        self.conn.commit()
+        if self.pause:
+            time.sleep(self.pause)
+
+    def batched_update(self, table, assignments, where):
+        """
+        UPDATE пачками по batch_size строк. Условие where должно перестать
+        выполняться для обновлённых строк, иначе цикл не закончится.
+        Возвращает число обновлённых строк
+        """
+        total = 0
+        while True:
+            cursor = self.conn.execute(f"""
+                UPDATE {table} SET {assignments}
+                WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} LIMIT ?)
+            """, (self.batch_size,))
+            self._yield()
+            if cursor.rowcount <= 0:
+                return total
+            total += cursor.rowcount
+
+    def batched_copy(self, source, insert_sql, select_columns, where='1'):
+        """
+        INSERT ... SELECT пачками по rowid источника.
+        insert_sql - начало запроса до SELECT, например "INSERT OR IGNORE INTO t (a, b)"
+        """
+        last = -1
+        total = 0
+        while True:
+            rows = self.conn.execute(f"""
+                SELECT rowid FROM {source} WHERE rowid > ? AND ({where})
+                ORDER BY rowid LIMIT ?
+            """, (last, self.batch_size)).fetchall()
+            if not rows:
+                return total
+            cursor = self.conn.execute(f"""
+                {insert_sql} SELECT {select_columns} FROM {source}
+                WHERE rowid > ? AND rowid <= ? AND ({where})
+            """, (last, rows[-1][0]))
+            total += max(cursor.rowcount, 0)
+            last = rows[-1][0]
+            self._yield()
+
+    def rebuild_table(self, table, create_sql, columns):
+        """
+        Пересоздаёт таблицу с новой структурой без долгой блокировки:
+        новая таблица заполняется пачками, а изменения, сделанные в это время
+        ботом, переносятся триггерами. В конце - короткая транзакция
+        DROP + RENAME. create_sql содержит {table} вместо имени таблицы,
+        columns - общие колонки старой и новой таблицы (включая INTEGER
+        PRIMARY KEY, по нему триггеры находят строки). Индексы старой
+        таблицы удаляются вместе с ней - создавать их после rebuild_table
+        """
+        new_table = f"{table}_rebuild"
+        cols = ', '.join(columns)
+        new_values = ', '.join(f"NEW.{c}" for c in columns)
+
+        self.conn.execute(f"DROP TABLE IF EXISTS {new_table}")
+        self.conn.execute(create_sql.format(table=new_table))
+        for event in ('INSERT', 'UPDATE'):
+            self.conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {new_table}_{event.lower()}
+                AFTER {event} ON {table} BEGIN
+                    INSERT OR REPLACE INTO {new_table} ({cols}) VALUES ({new_values});
+                END
+            """)
+        self.conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {new_table}_delete
+            AFTER DELETE ON {table} BEGIN
+                DELETE FROM {new_table} WHERE rowid = OLD.rowid;
+            END
+        """)
+        self.conn.commit()
+
+        # Строки, уже перенесённые триггером, свежее - их не перезаписываем
+        copied = self.batched_copy(table, f"INSERT OR IGNORE INTO {new_table} ({cols})", cols)
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for event in ('insert', 'update', 'delete'):
+                self.conn.execute(f"DROP TRIGGER IF EXISTS {new_table}_{event}")
+            self.conn.execute(f"DROP TABLE {table}")
+            self.conn.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return copied
+
+
+# ============== ШАГИ ==============
+
+SUBSCRIPTIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        uuid TEXT NOT NULL,
+        subscription_token TEXT UNIQUE NOT NULL,
+        is_active INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+"""
+
+SUBSCRIPTIONS_COLUMNS = ('id', 'user_id', 'uuid', 'subscription_token', 'is_active', 'created_at', 'expires_at')
+
+
+def _upgrade_single_server_subscriptions(m):
+    """
+    Старая схема: config_link и server_id прямо в subscriptions
+    (бывшие scripts/init_db.sql и scripts/migrate_multiserver.py)
+    """
+    columns = m.columns('subscriptions')
+    if set(columns) == set(SUBSCRIPTIONS_COLUMNS):
+        return
+
+    m.log("Перевожу subscriptions на схему с несколькими серверами...")
+    m.add_column('subscriptions', 'subscription_token', 'TEXT')
+    tokens = m.batched_update('subscriptions', f"subscription_token = {SQL_UUID4}",
+                              "subscription_token IS NULL")
+    m.log(f"  токенов сгенерировано: {tokens}")
+
+    if 'server_id' in columns and 'config_link' in columns:
+        links = m.batched_copy(
+            'subscriptions',
+            "INSERT OR IGNORE INTO subscription_servers (subscription_id, server_id, config_link)",
+            "id, server_id, config_link",
+            "server_id IS NOT NULL AND config_link IS NOT NULL"
+        )
+        m.log(f"  ссылок перенесено в subscription_servers: {links}")
+
+    copied = m.rebuild_table('subscriptions', SUBSCRIPTIONS_DDL,
+                             [c for c in SUBSCRIPTIONS_COLUMNS if c in m.columns('subscriptions')])
+    m.log(f"  subscriptions пересоздана, строк: {copied}")
+
+
+def m001_base_schema(m):
+    m.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            username TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    m.execute("""
+        CREATE TABLE IF NOT EXISTS servers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            ip TEXT NOT NULL,
+            port INTEGER DEFAULT 443,
+            public_key TEXT NOT NULL,
+            ssh_user TEXT DEFAULT 'root',
+            ssh_port INTEGER DEFAULT 22,
+            max_users INTEGER DEFAULT 60,
+            is_active INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    m.execute(SUBSCRIPTIONS_DDL.format(table='subscriptions'))
+
+    # Связь подписок и серверов (many-to-many)
+    m.execute("""
+        CREATE TABLE IF NOT EXISTS subscription_servers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subscription_id INTEGER NOT NULL,
+            server_id INTEGER NOT NULL,
+            config_link TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (subscription_id) REFERENCES subscriptions(id),
+            FOREIGN KEY (server_id) REFERENCES servers(id),
+            UNIQUE(subscription_id, server_id)
+        )
+    """)
+
+    # Пул предгенерированных UUID (уже добавлены в Xray конфиг)
+    m.execute("""
+        CREATE TABLE IF NOT EXISTS uuid_pool (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid TEXT NOT NULL,
+            email TEXT NOT NULL,
+            server_id INTEGER NOT NULL,
+            is_used INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (server_id) REFERENCES servers(id),
+            UNIQUE(uuid, server_id)
+        )
+    """)
+    m.commit()
+
+    _upgrade_single_server_subscriptions(m)
+
+
+def m002_server_health(m):
+    # Результаты проверки доступности серверов (api/health.py)
+    m.execute("""
+        CREATE TABLE IF NOT EXISTS server_health (
+            server_id INTEGER PRIMARY KEY,
+            is_healthy INTEGER DEFAULT 1,
+            rtt_ms REAL,
+            failure_rate REAL DEFAULT 0,
+            consecutive_failures INTEGER DEFAULT 0,
+            checked_at TIMESTAMP,
+            FOREIGN KEY (server_id) REFERENCES servers(id)
+        )
+    """)
+
+
+def m003_traffic_totals(m):
+    # Суммарный трафик подписок (api/traffic.py), временные ряды - в api/usage_store.py
+    m.execute("""
+        CREATE TABLE IF NOT EXISTS traffic_totals (
+            subscription_id INTEGER PRIMARY KEY,
+            upload INTEGER DEFAULT 0,
+            download INTEGER DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (subscription_id) REFERENCES subscriptions(id)
+        )
+    """)
+
+
+def m004_subscriptions_expiry_index(m):
+    # Выборка истекающих подписок (напоминания, статистика, проверка просроченных)
+    m.execute("""
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_active_expires
+        ON subscriptions (is_active, expires_at)
+    """)
+
+
+def m005_reminders_sent(m):
+    # Отправленные напоминания об окончании подписки (bot/reminders.py)
+    m.execute("""
+        CREATE TABLE IF NOT EXISTS reminders_sent (
+            subscription_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (subscription_id, kind),
+            FOREIGN KEY (subscription_id) REFERENCES subscriptions(id)
+        ) WITHOUT ROWID
+    """)
+
+
+def _rename_legacy_payments(m):
+    """
+    payments из бывшего scripts/init_db.sql (user_id, amount REAL,
+    payment_method) не совместима с api/payments.py, а CREATE TABLE
+    IF NOT EXISTS её не заменяет. Старая таблица переименовывается
+    в payments_legacy (данные сохраняются), payments создаётся заново.
+    legacy_alter_table: ссылки payment_outbox на payments не переписываются
+    на payments_legacy
+    """
+    if not m.table_exists('payments') or 'idempotency_key' in m.columns('payments'):
+        return
+    if m.table_exists('payments_legacy'):
+        raise RuntimeError("payments старого формата, а payments_legacy уже существует - перенесите вручную")
+    m.execute("PRAGMA legacy_alter_table = ON")
+    try:
+        m.execute("ALTER TABLE payments RENAME TO payments_legacy")
+        m.commit()
+    finally:
+        m.execute("PRAGMA legacy_alter_table = OFF")
+    m.log("  payments старого формата переименована в payments_legacy")
+
+
+def m006_payments(m):
+    # Платежи (api/payments.py): idempotency_key защищает от повторных нажатий,
+    # provider_payment_id - от повторных webhook'ов провайдера
+    _rename_legacy_payments(m)
+    m.execute("""
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT UNIQUE NOT NULL,
+            telegram_id INTEGER NOT NULL,
+            username TEXT,
+            plan TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            duration_days INTEGER NOT NULL,
+            provider TEXT NOT NULL,
+            provider_payment_id TEXT UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            subscription_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            confirmed_at TIMESTAMP,
+            provisioned_at TIMESTAMP,
+            FOREIGN KEY (subscription_id) REFERENCES subscriptions(id)
+        )
+    """)
+
+    # Outbox: подтверждённые платежи, ожидающие выдачи подписки
+    m.execute("""
+        CREATE TABLE IF NOT EXISTS payment_outbox (
+            payment_id INTEGER PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            available_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (payment_id) REFERENCES payments(id)
+        )
+    """)
+    m.execute("""
+        CREATE INDEX IF NOT EXISTS idx_payment_outbox_pending
+        ON payment_outbox (available_at) WHERE status = 'pending'
+    """)
+
+
+def _uuid_blob(value):
+    """SQL функция миграции 7: 16 байт для канонического UUID, иначе NULL"""
+    value = uuid_to_db(value)
+    return value if isinstance(value, bytes) else None
+
+
+def m007_uuid_blobs(m):
+    """
+    UUID и токены подписок - 16 байт вместо 36 символов (api/uuid_blob.py).
+    Значения меняются на месте пачками, объявленный тип колонок остаётся TEXT:
+    SQLite хранит BLOB в колонке любого типа, а пересоздавать таблицы ради
+    объявления не нужно. Значения не в каноническом виде UUID остаются TEXT.
+    Освободившиеся страницы переиспользуются; вернуть место файлу - VACUUM
+    """
+    m.conn.create_function('uuid_blob', 1, _uuid_blob, deterministic=True)
+    for table, column in (('subscriptions', 'subscription_token'),
+                          ('subscriptions', 'uuid'),
+                          ('uuid_pool', 'uuid')):
+        count = m.batched_update(table, f"{column} = uuid_blob({column})",
+                                 f"typeof({column}) = 'text' AND uuid_blob({column}) IS NOT NULL")
+        m.log(f"  {table}.{column}: переведено {count}")
+
+
+# UUID клиента в config_link
+UUID_IN_LINK = re.compile(r'^vless://([0-9a-fA-F-]{36})@')
+
+
+def _link_uuid(config_link):
+    """SQL функция миграции 8: UUID из ссылки в формате колонки (api/uuid_blob.py) или NULL"""
+    match = UUID_IN_LINK.match(config_link or '')
+    return uuid_to_db(match.group(1).lower()) if match else None
+
+
+def m008_subscription_servers_uuid(m):
+    """
+    subscription_servers.uuid - UUID клиента на сервере. Форматы подписки
+    (api/sub_formats.py) собираются из него и строки servers, без разбора
+    config_link на каждый запрос; ссылки разбираются один раз здесь
+    """
+    m.add_column('subscription_servers', 'uuid', 'TEXT')
+    m.conn.create_function('link_uuid', 1, _link_uuid, deterministic=True)
+    count = m.batched_update('subscription_servers', "uuid = link_uuid(config_link)",
+                             "uuid IS NULL AND link_uuid(config_link) IS NOT NULL")
+    m.log(f"  subscription_servers.uuid: заполнено {count}")
+
+
+def m009_catalog_version(m):
+    """
+    Версия таблицы servers для каталога серверов в памяти процессов
+    (api/server_catalog.py): триггеры увеличивают её при любом изменении
+    servers, процессы перечитывают серверы, только когда она сменилась.
+    Индексы - для агрегатов нагрузки и пула по серверам
+    """
+    m.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    m.execute("INSERT OR IGNORE INTO catalog_version (name, version) VALUES ('servers', 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        m.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS servers_version_{event.lower()}
+            AFTER {event} ON servers
+            BEGIN
+                UPDATE catalog_version SET version = version + 1 WHERE name = 'servers';
+            END
+        """)
+    m.execute("""
+        CREATE INDEX IF NOT EXISTS idx_subscription_servers_server
+        ON subscription_servers (server_id)
+    """)
+    m.execute("""
+        CREATE INDEX IF NOT EXISTS idx_uuid_pool_server_used
+        ON uuid_pool (server_id, is_used)
+    """)
+
+
+def m010_subscriptions_user_index(m):
+    # Подписки пользователя: активная подписка в боте, проверка пачки импорта (scripts/bulk_provision.py)
+    m.execute("""
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_user
+        ON subscriptions (user_id)
+    """)
+
+
+def _uuid_unique_constraint(m):
+    """Есть ли у subscriptions ограничение UNIQUE(uuid) из старой схемы"""
+    for _, name, unique, origin, _ in m.execute("PRAGMA index_list(subscriptions)").fetchall():
+        if unique and origin == 'u':
+            columns = [row[2] for row in m.execute(f"PRAGMA index_info({name})")]
+            if columns == ['uuid']:
+                return True
+    return False
+
+
+def m011_subscriptions_active_uuid(m):
+    """
+    UUID основного сервера уникален только среди активных подписок.
+    При деактивации UUID возвращается в пул и выдаётся следующей подписке,
+    а старая строка сохраняет его в subscriptions.uuid - с UNIQUE по всей
+    таблице создание следующей подписки падало. Таблица пересоздаётся без
+    ограничения (rebuild_table), индексы подписок создаются заново
+    """
+    if _uuid_unique_constraint(m):
+        copied = m.rebuild_table('subscriptions', SUBSCRIPTIONS_DDL, list(SUBSCRIPTIONS_COLUMNS))
+        m.log(f"  subscriptions пересоздана без UNIQUE(uuid), строк: {copied}")
+        m004_subscriptions_expiry_index(m)
+        m010_subscriptions_user_index(m)
+    m.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_subscriptions_active_uuid
+        ON subscriptions (uuid) WHERE is_active = 1
+    """)
+
+
+def m012_legacy_payments(m):
+    # БД, где миграция 6 уже прошла поверх payments старого формата
+    m006_payments(m)
+
+
+MIGRATIONS = [
+    (1, "Базовая схема (и перевод старой схемы на несколько серверов)", m001_base_schema),
+    (2, "Таблица server_health", m002_server_health),
+    (3, "Таблица traffic_totals", m003_traffic_totals),
+    (4, "Индекс subscriptions (is_active, expires_at)", m004_subscriptions_expiry_index),
+    (5, "Таблица reminders_sent", m005_reminders_sent),
+    (6, "Платежи и outbox выдачи подписок", m006_payments),
+    (7, "UUID и токены подписок в 16-байтных BLOB", m007_uuid_blobs),
+    (8, "UUID клиента в subscription_servers", m008_subscription_servers_uuid),
+    (9, "Версия каталога серверов и индексы нагрузки по серверам", m009_catalog_version),
+    (10, "Индекс subscriptions (user_id)", m010_subscriptions_user_index),
+    (11, "UUID подписки уникален среди активных подписок", m011_subscriptions_active_uuid),
+    (12, "payments старого формата - в payments_legacy", m012_legacy_payments),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+# ============== ДВИЖОК ==============
+
+def schema_version(conn):
+    """Версия схемы БД (0 - не инициализирована)"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def pending_migrations(conn, target=None):
+    current = schema_version(conn)
+    target = SCHEMA_VERSION if target is None else target
+    return [step for step in MIGRATIONS if current < step[0] <= target]
+
+
+def migrate(db_file=None, target=None, batch_size=5000, pause=0.01, log=logger.info):
+    """
+    Применяет недостающие миграции. Возвращает [(версия, описание, секунды)].
+    Параллельный запуск (бот и subscription сервер стартуют вместе)
+    сериализуется файловой блокировкой, второй процесс увидит уже
+    обновлённую версию и ничего не сделает
+    """
+    db_file = db_file or DB_FILE
+    applied = []
+    with open(db_file + '.migrate.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        conn = sqlite3.connect(db_file, timeout=30)
+        try:
+            m = Migrator(conn, batch_size, pause, log)
+            for version, description, step in pending_migrations(conn, target):
+                log(f"Миграция {version}: {description}...")
+                started = time.perf_counter()
+                step(m)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+                seconds = time.perf_counter() - started
+                log(f"Миграция {version} применена за {seconds:.2f}с")
+                applied.append((version, description, seconds))
+        finally:
+            conn.close()
+    return applied
@@ -0,0 +1,63 @@
+"""
+Негативный кэш токенов подписок: помнит токены, которых нет в БД
+или чьи подписки деактивированы, чтобы не делать SQL запрос на каждый опрос.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = 'missing'
+INACTIVE = 'inactive'
+
+
+class NegativeCache:
+    """Ограниченный по размеру LRU с TTL на запись"""
+
+    def __init__(self, max_size=100000, ttl=600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token, now=None):
+        """Возвращает MISSING / INACTIVE или None если токен неизвестен кэшу"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            status, expires = entry
+            if expires < now:
+                del self._entries[token]
+                return None
+            return status
+
+    def add(self, token, status, now=None):
+        """Запоминает токен как отсутствующий или неактивный"""
+        if self.max_size <= 0:
+            return
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._entries[token] = (status, now + self.ttl)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, token):
+        """Инвалидирует запись (например, подписка с этим токеном создана)"""
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def on_subscription_event(self, event, data):
+        """Обработчик событий VPNManager"""
+        if event in ('created', 'extended'):
+            self.discard(data['subscription_token'])
+        elif event == 'deactivated':
+            self.add(data['subscription_token'], INACTIVE)
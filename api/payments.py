@@ -0,0 +1,237 @@
+"""
+Платежи и выдача подписок по подтверждённым платежам.
+
+Поток:
+    1. Нажатие кнопки тарифа создаёт платёж с idempotency_key
+       (повторное нажатие/повторная доставка callback возвращает тот же платёж).
+    2. Провайдер подтверждает оплату (webhook или сразу для PAYMENT_PROVIDER=none).
+       Переход pending -> confirmed и запись в outbox - одна транзакция;
+       повторные webhook'и ничего не меняют.
+    3. ProvisioningWorker забирает outbox пачками и выдаёт подписки.
+       Подписка создаётся в одной транзакции с переходом платежа
+       confirmed -> provisioned, поэтому даже после падения воркера
+       между шагами подписка по платежу не выдаётся дважды.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = 'X-Payment-Signature'
+
+PENDING = 'pending'
+CONFIRMED = 'confirmed'
+PROVISIONED = 'provisioned'
+FAILED = 'failed'
+
+
+def sign(secret, body):
+    """HMAC-SHA256 тела webhook'а"""
+    return hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+class PaymentLedger:
+    """Журнал платежей поверх хранилища (api/repository.py), используют бот и subscription сервер"""
+
+    def __init__(self, repository):
+        self.repository = repository
+
+    def create(self, idempotency_key, telegram_id, username, plan, amount, duration_days, provider):
+        """Создаёт платёж или возвращает уже существующий с тем же ключом"""
+        return self.repository.create_payment(idempotency_key, telegram_id, username, plan,
+                                              amount, duration_days, provider)
+
+    def get(self, payment_id):
+        return self.repository.get_payment(payment_id)
+
+    def attach_provider_id(self, payment_id, provider_payment_id):
+        self.repository.attach_provider_payment_id(payment_id, provider_payment_id)
+
+    def confirm(self, payment_id=None, provider_payment_id=None, amount=None):
+        """
+        pending -> confirmed + запись в outbox одной транзакцией.
+        Webhook может прийти раньше, чем бот сохранил provider_payment_id,
+        поэтому платёж ищется по своему id (order_id провайдера), а id провайдера
+        сверяется или запоминается. Возвращает True, если платёж подтверждён
+        этим вызовом, False - повтор или несовпадение, None - платёж неизвестен
+        """
+        repo = self.repository
+
+        def run(conn):
+            row = repo.lock_payment(conn, payment_id, provider_payment_id)
+            if row is None:
+                logger.warning(f"Подтверждение неизвестного платежа {payment_id or provider_payment_id}")
+                return None
+            if provider_payment_id and row['provider_payment_id'] not in (None, provider_payment_id):
+                logger.error(f"Платёж {row['id']}: чужой id провайдера {provider_payment_id}")
+                return False
+            if amount is not None and int(amount) != row['amount']:
+                logger.error(f"Сумма платежа {row['id']} не совпадает: {amount} != {row['amount']}")
+                return False
+            # Повтор webhook'а (платёж уже не pending) ничего не меняет
+            return repo.confirm_payment(conn, row['id'], provider_payment_id)
+
+        return repo.transaction(run)
+
+    def claim(self, limit):
+        """Пачка платежей из outbox, готовых к выдаче"""
+        return self.repository.claim_payments(time.time(), limit)
+
+    def finish(self, done, retry, failed):
+        """
+        Итог пачки одной транзакцией.
+        done: [payment_id], retry: [(payment_id, available_at, error)], failed: [(payment_id, error)]
+        """
+        self.repository.finish_payments(done, retry, failed)
+
+
+class ProvisioningWorker:
+    """Выдаёт подписки по подтверждённым платежам из outbox"""
+
+    def __init__(self, ledger, vpn_manager, batch_size=100, max_attempts=5, retry_delay=30, concurrency=32):
+        self.ledger = ledger
+        self.vpn_manager = vpn_manager
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.concurrency = concurrency
+
+    def _provision(self, payment):
+        """Продлевает активную подписку пользователя на месте или создаёт новую"""
+        active = self.vpn_manager.get_active_subscription(payment['telegram_id'])
+        if active:
+            return self.vpn_manager.extend_subscription(
+                active['id'], payment['duration_days'], payment_id=payment['id']
+            )
+        return self.vpn_manager.create_subscription(
+            payment['telegram_id'], payment['username'], payment['duration_days'],
+            payment_id=payment['id']
+        )
+
+    def _provision_safe(self, payment):
+        """(result, error) без исключений"""
+        try:
+            return self._provision(payment), "Нет доступных серверов"
+        except Exception as e:
+            return None, str(e)
+
+    def _provision_all(self, batch):
+        """
+        Выдача по пачке. Если параллельные записи дают выигрыш (очередь
+        с групповым коммитом или PostgreSQL, vpn_manager.concurrent_writes),
+        платежи выдаются параллельно; платежи одного пользователя -
+        последовательно (продление после создания)
+        """
+        if not getattr(self.vpn_manager, 'concurrent_writes', False) or len(batch) < 2:
+            return [self._provision_safe(payment) for payment in batch]
+
+        by_user = {}
+        for index, payment in enumerate(batch):
+            by_user.setdefault(payment['telegram_id'], []).append(index)
+
+        outcomes = [None] * len(batch)
+
+        def run_user(indexes):
+            for index in indexes:
+                outcomes[index] = self._provision_safe(batch[index])
+
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(by_user))) as pool:
+            list(pool.map(run_user, by_user.values()))
+        return outcomes
+
+    def process(self, batch):
+        """
+        Обрабатывает пачку из outbox. Возвращает [(payment, result)]:
+        выданные подписки и платежи, по которым выдача окончательно не удалась (result None)
+        """
+        provisioned, done, retry, failed = [], [], [], []
+
+        for payment, (result, error) in zip(batch, self._provision_all(batch)):
+            if result:
+                provisioned.append((payment, result))
+                done.append(payment['id'])
+                continue
+
+            # Подписка могла быть выдана раньше (падение до отметки outbox)
+            current = self.ledger.get(payment['id'])
+            if current and current['status'] == PROVISIONED:
+                done.append(payment['id'])
+            elif payment['attempts'] + 1 >= self.max_attempts:
+                logger.error(f"Платёж {payment['id']}: подписка не выдана после {self.max_attempts} попыток")
+                failed.append((payment['id'], error))
+                provisioned.append((payment, None))
+            else:
+                delay = self.retry_delay * 2 ** payment['attempts']
+                retry.append((payment['id'], time.time() + delay, error))
+
+        if batch:
+            self.ledger.finish(done, retry, failed)
+            logger.info(f"Outbox: выдано {len(done)}, повтор {len(retry)}, ошибок {len(failed)}")
+        return provisioned
+
+    def run_once(self):
+        """Пачки, пока в outbox есть готовые к выдаче платежи"""
+        provisioned = []
+        while True:
+            batch = self.ledger.claim(self.batch_size)
+            if not batch:
+                return provisioned
+            provisioned.extend(self.process(batch))
+
+
+# ============== ПРОВАЙДЕРЫ ==============
+
+class InstantProvider:
+    """Без оплаты: платёж подтверждается сразу (поведение до появления платежей)"""
+    name = 'none'
+
+    def create_checkout(self, payment):
+        return None, None
+
+
+class FakeProvider:
+    """
+    Локальный фейковый провайдер (scripts/fake_payment_provider.py)
+    для разработки и нагрузочных прогонов
+    """
+    name = 'fake'
+
+    def __init__(self, base_url, secret, timeout=5):
+        self.base_url = base_url.rstrip('/')
+        self.secret = secret
+        self.timeout = timeout
+
+    def create_checkout(self, payment):
+        """(provider_payment_id, url оплаты)"""
+        body = json.dumps({
+            'order_id': payment['id'],
+            'amount': payment['amount'],
+            'idempotency_key': payment['idempotency_key']
+        }).encode('utf-8')
+        request = urllib.request.Request(
+            f"{self.base_url}/payments", data=body, method='POST',
+            headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            data = json.loads(response.read())
+        return data['id'], data['url']
+
+    def parse_webhook(self, body, headers):
+        """Проверяет подпись и возвращает событие или None"""
+        if not hmac.compare_digest(headers.get(SIGNATURE_HEADER, ''), sign(self.secret, body)):
+            return None
+        return json.loads(body)
+
+
+def get_payment_provider(name, base_url=None, secret=None):
+    """Провайдер по имени из настроек (PAYMENT_PROVIDER)"""
+    if name == InstantProvider.name:
+        return InstantProvider()
+    if name == FakeProvider.name:
+        return FakeProvider(base_url, secret)
+    raise ValueError(f"Неизвестный платёжный провайдер: {name}")
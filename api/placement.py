@@ -0,0 +1,126 @@
+"""
+Выбор серверов для новой подписки.
+
+Стратегия получает кандидатов (активные серверы с нагрузкой и остатком пула)
+и возвращает упорядоченный список серверов подписки. Первый сервер
+в списке - основной (его UUID записывается в subscriptions.uuid).
+
+Поля кандидата:
+    id, name, max_users, current_users, pool_total, pool_free
+    failure_rate   - доля неудачных проверок доступности (0..1), если известна
+    bandwidth_util - загрузка канала (0..1), если известна: трафик сервера
+                     за последние минуты относительно самого загруженного
+                     (BandwidthMeter, ряды KIND_SERVER из api/usage_store.py)
+"""
+import random
+import threading
+import time
+
+
+class PlacementStrategy:
+    name = None
+
+    def select(self, candidates):
+        """Возвращает упорядоченный список серверов для подписки"""
+        raise NotImplementedError
+
+
+class AllServersPlacement(PlacementStrategy):
+    """Все серверы со свободными местами, сначала наименее загруженные (исходное поведение)"""
+    name = 'all'
+
+    def select(self, candidates):
+        servers = [s for s in candidates if s['current_users'] < s['max_users']]
+        return sorted(servers, key=lambda s: s['current_users'])
+
+
+class LoadAwarePlacement(PlacementStrategy):
+    """
+    Учитывает заполненность по max_users, остаток пула, здоровье и канал.
+    Берёт servers_per_subscription лучших серверов (0 = все подходящие),
+    при равенстве очков выбирает случайно, чтобы разносить пики покупок.
+    """
+    name = 'load_aware'
+
+    def __init__(self, servers_per_subscription=0, max_failure_rate=0.5,
+                 weights=None, rng=None):
+        self.servers_per_subscription = servers_per_subscription
+        self.max_failure_rate = max_failure_rate
+        self.weights = weights or {'users': 1.0, 'pool': 0.5, 'health': 1.0, 'bandwidth': 0.7}
+        self.rng = rng or random.Random()
+
+    def score(self, server):
+        """Чем меньше, тем лучше"""
+        w = self.weights
+        users = server['current_users'] / server['max_users'] if server['max_users'] else 1.0
+        pool = 1.0 - server['pool_free'] / server['pool_total'] if server['pool_total'] else 1.0
+        return (
+            w['users'] * users
+            + w['pool'] * pool
+            + w['health'] * server.get('failure_rate', 0.0)
+            + w['bandwidth'] * server.get('bandwidth_util', 0.0)
+        )
+
+    def select(self, candidates):
+        servers = [
+            s for s in candidates
+            if s['current_users'] < s['max_users']
+            and s['pool_free'] > 0
+            and s.get('failure_rate', 0.0) <= self.max_failure_rate
+        ]
+        ranked = sorted(servers, key=lambda s: (round(self.score(s), 3), self.rng.random()))
+        if self.servers_per_subscription > 0:
+            ranked = ranked[:self.servers_per_subscription]
+        return ranked
+
+
+STRATEGIES = {
+    AllServersPlacement.name: AllServersPlacement,
+    LoadAwarePlacement.name: LoadAwarePlacement,
+}
+
+
+def get_placement_strategy(name, servers_per_subscription=0):
+    """Стратегия по имени из настроек (PLACEMENT_STRATEGY)"""
+    if name == LoadAwarePlacement.name:
+        return LoadAwarePlacement(servers_per_subscription)
+    if name not in STRATEGIES:
+        raise ValueError(f"Неизвестная стратегия размещения: {name}")
+    return STRATEGIES[name]()
+
+
+class BandwidthMeter:
+    """
+    Загрузка канала серверов по поминутным рядам трафика (TrafficCollector):
+    байты за window секунд, делённые на максимум среди серверов. Ёмкость
+    канала узлов неизвестна, поэтому загрузка относительная - 1.0 у самого
+    загруженного сервера. Ряды пишутся раз в минуту, поэтому результат
+    держится ttl секунд и покупки не читают usage.db каждый раз
+    """
+
+    def __init__(self, get_usage_store, window=900, ttl=60):
+        self.get_usage_store = get_usage_store
+        self.window = window
+        self.ttl = ttl
+        self._cached = ({}, frozenset(), 0.0)
+        self._lock = threading.Lock()
+
+    def utilization(self, server_ids):
+        """{server_id: 0..1}"""
+        server_ids = frozenset(server_ids)
+        now = time.time()
+        with self._lock:
+            util, cached_ids, measured_at = self._cached
+            if cached_ids == server_ids and now - measured_at < self.ttl:
+                return util
+
+        from api.usage_store import KIND_SERVER
+
+        usage_store = self.get_usage_store()
+        traffic = {server_id: sum(usage_store.total(KIND_SERVER, server_id, now - self.window, now))
+                   for server_id in server_ids}
+        peak = max(traffic.values(), default=0)
+        util = {server_id: value / peak if peak else 0.0 for server_id, value in traffic.items()}
+        with self._lock:
+            self._cached = (util, server_ids, now)
+        return util
@@ -0,0 +1,223 @@
+"""
+Сэмплирующий профайлер, включаемый на N секунд без перезапуска процесса.
+
+Пока профайлер выключен, в процессе нет ни потока, ни хуков: вызов
+profile(seconds) сам становится потоком-сэмплером. Раз в interval секунд
+он снимает стеки всех потоков (sys._current_frames) и считает одинаковые
+стеки. Время SQL: на время профилирования sqlite3.connect подменяется -
+соединения, открытые в этом окне, меряют connect, execute/executemany,
+fetch* и commit по тексту запроса, а стек потока, который сейчас ждёт
+SQLite, получает лист "SQL <запрос>". Соединения, открытые до включения
+(очередь записи бота), видны только в стеках.
+
+Результат - файл <name>-<время>.folded в output_dir в формате collapsed
+stacks ("поток;файл:функция;... число"): flamegraph.pl, speedscope,
+inferno. Стеки простаивающих потоков (ожидание очереди, select, accept)
+в файл и сводку не попадают, только в счётчик idle.
+
+Включение: кнопка "Профилирование" в админ панели бота,
+POST /internal/profile на subscription сервере (заголовок X-Profile-Secret).
+"""
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Profile-Secret'
+
+# Листья стеков потоков, которые ничего не делают, а ждут
+IDLE_FRAMES = {
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'),
+    ('selectors.py', 'select'),
+    ('socket.py', 'accept'),
+    ('socketserver.py', 'serve_forever'),
+    ('thread.py', '_worker'),
+}
+
+# Идёт ли профилирование: соединения, открытые в его окне, после него не меряют ничего
+_enabled = False
+# Поток -> текст выполняемого сейчас запроса (пишут соединения, читает сэмплер)
+_current_sql = {}
+_sql_stats = defaultdict(lambda: [0, 0.0])
+_sql_lock = threading.Lock()
+
+
+def _statement(sql):
+    """Текст запроса одной строкой: ключ статистики и кадр стека"""
+    return ' '.join(sql.split())[:120].replace(';', ',')
+
+
+def _timed(sql, fn, *args):
+    if not _enabled:
+        return fn(*args)
+    statement = _statement(sql)
+    ident = threading.get_ident()
+    _current_sql[ident] = statement
+    started = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        elapsed = time.perf_counter() - started
+        _current_sql.pop(ident, None)
+        with _sql_lock:
+            stats = _sql_stats[statement]
+            stats[0] += 1
+            stats[1] += elapsed
+
+
+class _ProfiledCursor(sqlite3.Cursor):
+    _sql = ''
+
+    def execute(self, sql, *args):
+        self._sql = sql
+        return _timed(sql, super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        self._sql = sql
+        return _timed(sql, super().executemany, sql, *args)
+
+    def fetchone(self):
+        return _timed(self._sql, super().fetchone)
+
+    def fetchmany(self, *args):
+        return _timed(self._sql, super().fetchmany, *args)
+
+    def fetchall(self):
+        return _timed(self._sql, super().fetchall)
+
+
+class _ProfiledConnection(sqlite3.Connection):
+    def cursor(self, factory=_ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def commit(self):
+        return _timed('COMMIT', super().commit)
+
+
+class SamplingProfiler:
+    def __init__(self, name, output_dir, interval=0.005):
+        self.name = name
+        self.output_dir = output_dir
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._lock.locked()
+
+    def profile(self, seconds):
+        """
+        Сэмплирует процесс seconds секунд в вызывающем потоке.
+        Возвращает сводку (см. summary) или None, если профилирование уже идёт
+        """
+        global _enabled
+        if not self._lock.acquire(blocking=False):
+            return None
+        connect = sqlite3.connect
+        _sql_stats.clear()
+
+        def profiled_connect(*args, **kwargs):
+            kwargs.setdefault('factory', _ProfiledConnection)
+            # Открытие файла БД и чтение схемы - тоже время SQLite
+            return _timed('CONNECT', lambda: connect(*args, **kwargs))
+
+        stacks = Counter()
+        idle = samples = 0
+        own = threading.get_ident()
+        started = time.perf_counter()
+        sqlite3.connect = profiled_connect
+        _enabled = True
+        try:
+            deadline = started + seconds
+            while time.perf_counter() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+                    while frame is not None:
+                        code = frame.f_code
+                        name = getattr(code, 'co_qualname', code.co_name)
+                        stack.append(f"{os.path.basename(code.co_filename)}:{name}")
+                        frame = frame.f_back
+                    samples += 1
+                    sql = _current_sql.get(ident)
+                    if sql is None and leaf in IDLE_FRAMES:
+                        idle += 1
+                        continue
+                    stack.append(names.get(ident, str(ident)))
+                    stack.reverse()
+                    if sql is not None:
+                        stack.append(f"SQL {sql}")
+                    stacks[';'.join(stack)] += 1
+                time.sleep(self.interval)
+        finally:
+            sqlite3.connect = connect
+            _enabled = False
+            elapsed = time.perf_counter() - started
+            with _sql_lock:
+                sql_stats = dict(_sql_stats)
+            self._lock.release()
+
+        path = self._write(stacks)
+        result = summary(stacks, sql_stats)
+        result.update({'file': path, 'seconds': round(elapsed, 1), 'samples': samples, 'idle': idle})
+        logger.info(f"Профилирование {self.name}: {elapsed:.1f}с, {samples} сэмплов, файл {path}")
+        return result
+
+    def _write(self, stacks):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"{self.name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded")
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+def summary(stacks, sql_stats, top=10):
+    """
+    Горячие точки: функции по собственным сэмплам (лист стека) и по
+    сэмплам со вложенными вызовами, запросы SQL по суммарному времени
+    """
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')[1:]
+        if frames and frames[-1].startswith('SQL '):
+            frames = frames[:-1]
+            own['SQL'] += count
+        elif frames:
+            own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return {
+        'own': own.most_common(top),
+        'total': total.most_common(top),
+        'sql': sorted(([sql, calls, round(seconds * 1e3, 1)] for sql, (calls, seconds) in sql_stats.items()),
+                      key=lambda item: -item[2])[:top],
+    }
+
+
+def format_summary(result, top=5):
+    """Сводка текстом (сообщение админу)"""
+    active = result['samples'] - result['idle'] or 1
+    lines = [f"{result['seconds']}с, сэмплов {result['samples']} (простой {result['idle']})", "",
+             "Собственное время:"]
+    lines += [f"  {count * 100 // active}% {name}" for name, count in result['own'][:top]]
+    lines += ["", "SQL (мс / вызовов):"]
+    lines += [f"  {ms} / {calls}: {sql[:60]}" for sql, calls, ms in result['sql'][:top]] or ["  нет"]
+    return '\n'.join(lines)
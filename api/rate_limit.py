@@ -0,0 +1,75 @@
+"""
+Ограничение частоты запросов (token bucket) для subscription сервера.
+Всё хранится в памяти процесса, к БД не обращается.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше burst"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic() if now is None else now
+
+    def consume(self, amount=1, now=None):
+        """Списывает amount токенов, возвращает False если их не хватает"""
+        now = time.monotonic() if now is None else now
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def wait_time(self, amount=1):
+        """Сколько секунд ждать до появления amount токенов"""
+        if self.tokens >= amount or self.rate <= 0:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Набор token bucket'ов по ключу (IP, токен подписки).
+    Количество ключей ограничено: самые давние вытесняются.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key, now=None):
+        """True если запрос по ключу можно обслужить"""
+        if self.rate <= 0:
+            return True
+
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst, now)
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.consume(now=now)
+
+    def retry_after(self, key):
+        """Рекомендуемое значение заголовка Retry-After (секунды)"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return 0
+            return max(1, int(bucket.wait_time() + 0.999))
@@ -0,0 +1,605 @@
+"""
+Хранилище данных VPNManager, api/database.py и subscription сервера, а также
+статистики, проверки серверов, трафика, напоминаний и платежей (через
+vpn_manager.repository). Адрес - DATABASE_URL (get_repository).
+
+Repository содержит весь SQL один раз, в подмножестве, которое одинаково
+понимают SQLite и PostgreSQL: ON CONFLICT DO NOTHING вместо INSERT OR IGNORE,
+текущее время параметром вместо datetime('now'), CASE вместо SUM(условие),
+новый срок подписки считается в Python, а не strftime(). Подклассы дают
+соединения, транзакции, блокировки строк и получение id вставленной строки:
+
+    SQLiteRepository   - vpn.db, схема из api/migrations.py; записи через
+                         очередь с групповым коммитом (api/write_queue.py), если она задана
+    PostgresRepository - api/repository_pg.py, пул соединений; psycopg
+                         импортируется только при использовании
+
+Операции записи (ensure_user, take_free_uuid, ...) принимают соединение
+транзакции: их объединяет в транзакцию вызывающий через transaction(fn).
+Строки - sqlite3.Row или совместимые с ним (доступ по индексу и по имени).
+UUID и токены подписок принимаются и возвращаются строками; в vpn.db они
+хранятся 16-байтными BLOB (api/uuid_blob.py), в PostgreSQL - текстом.
+
+Проверка совместимости и бенчмарк обеих реализаций: scripts/bench_storage.py
+"""
+import sqlite3
+from contextlib import contextmanager
+
+from api.migrations import SCHEMA_VERSION, migrate, schema_version
+from api.sub_snapshot import connect_readonly, load_servers, load_subscription
+from api.uuid_blob import decode_row, to_db
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Значений в одном IN (...) - с запасом до лимита параметров SQLite
+IN_BATCH = 500
+
+class Repository:
+    # Блокировки строк в транзакции записи (в SQLite транзакция и так одна на БД)
+    LOCK_ROW = ''
+    LOCK_SKIP_LOCKED = ''
+
+    # Можно ли выполнять записи из нескольких потоков параллельно с пользой
+    concurrent_writes = False
+
+    @staticmethod
+    def encode_uuid(value):
+        """UUID/токен -> значение параметра запроса (чтение обратно - decode_row)"""
+        return value
+
+    # ---------- соединения и транзакции (подклассы) ----------
+
+    def connect(self):
+        raise NotImplementedError
+
+    def release(self, conn):
+        conn.close()
+
+    def transaction(self, fn):
+        """fn(conn) в одной транзакции, результат fn"""
+        raise NotImplementedError
+
+    def init_schema(self, log=print):
+        """Создаёт/обновляет схему. True, если что-то менялось"""
+        raise NotImplementedError
+
+    def _insert(self, conn, sql, params):
+        """INSERT и id новой строки"""
+        return conn.execute(sql, params).lastrowid
+
+    @contextmanager
+    def _reading(self):
+        conn = self.connect()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def _all(self, sql, params=()):
+        with self._reading() as conn:
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+    def _one(self, sql, params=()):
+        with self._reading() as conn:
+            row = conn.execute(sql, params).fetchone()
+            return dict(row) if row else None
+
+    # ---------- серверы и пул ----------
+
+    def add_server(self, name, ip, port, public_key, ssh_user='root', max_users=60):
+        return self.transaction(lambda conn: self._insert(conn, """
+            INSERT INTO servers (name, ip, port, public_key, ssh_user, max_users)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (name, ip, port, public_key, ssh_user, max_users)))
+
+    def import_uuid_pool(self, uuids, server_id):
+        """Добавляет UUID в пул сервера, уже существующие пропускает. Возвращает число добавленных"""
+        def run(conn):
+            count = 0
+            for item in uuids:
+                cursor = conn.execute("""
+                    INSERT INTO uuid_pool (uuid, email, server_id) VALUES (?, ?, ?)
+                    ON CONFLICT DO NOTHING
+                """, (self.encode_uuid(item['uuid']), item['email'], server_id))
+                count += max(cursor.rowcount, 0)
+            return count
+        return self.transaction(run)
+
+    def get_server(self, server_id):
+        return self._one("SELECT * FROM servers WHERE id = ?", (server_id,))
+
+    def servers_version(self):
+        """Версия таблицы servers (меняется триггерами при любом изменении, api/server_catalog.py)"""
+        row = self._one("SELECT version FROM catalog_version WHERE name = 'servers'")
+        return row['version'] if row else None
+
+    def server_rows(self):
+        return self._all("SELECT * FROM servers ORDER BY id")
+
+    def server_loads(self):
+        """server_id -> число активных подписок (пара подписка-сервер уникальна)"""
+        with self._reading() as conn:
+            return dict(conn.execute("""
+                SELECT ss.server_id, COUNT(*)
+                FROM subscription_servers ss
+                JOIN subscriptions sub ON ss.subscription_id = sub.id
+                WHERE sub.is_active = 1
+                GROUP BY ss.server_id
+            """).fetchall())
+
+    def pool_counts(self):
+        """server_id -> (всего UUID в пуле, свободных)"""
+        with self._reading() as conn:
+            return {row[0]: (row[1], row[2]) for row in conn.execute("""
+                SELECT server_id, COUNT(*), SUM(CASE WHEN is_used = 0 THEN 1 ELSE 0 END)
+                FROM uuid_pool
+                GROUP BY server_id
+            """).fetchall()}
+
+    def server_health(self):
+        """server_id -> строка server_health"""
+        return {row['server_id']: row for row in self._all(
+            "SELECT server_id, is_healthy, rtt_ms, failure_rate FROM server_health"
+        )}
+
+    def stats(self):
+        return self._one("""
+            SELECT
+                (SELECT COUNT(*) FROM users) as total_users,
+                (SELECT COUNT(*) FROM subscriptions WHERE is_active = 1) as active_subscriptions,
+                (SELECT COUNT(*) FROM servers WHERE is_active = 1) as active_servers,
+                (SELECT COUNT(*) FROM uuid_pool WHERE is_used = 0) as free_uuids
+        """)
+
+    def active_server_rows(self):
+        return self._all("SELECT * FROM servers WHERE is_active = 1 ORDER BY id")
+
+    def save_server_health(self, rows):
+        """rows: [(server_id, is_healthy, rtt_ms, failure_rate, consecutive_failures, checked_at)]"""
+        self.transaction(lambda conn: conn.executemany("""
+            INSERT INTO server_health
+            (server_id, is_healthy, rtt_ms, failure_rate, consecutive_failures, checked_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (server_id) DO UPDATE SET
+                is_healthy = excluded.is_healthy, rtt_ms = excluded.rtt_ms,
+                failure_rate = excluded.failure_rate,
+                consecutive_failures = excluded.consecutive_failures,
+                checked_at = excluded.checked_at
+        """, rows))
+
+    def expiring_counts(self, day_limit, week_limit):
+        """Активные подписки: всего и истекающие до day_limit / week_limit (строки DATE_FORMAT)"""
+        return self._one("""
+            SELECT
+                COUNT(*) as active_subscriptions,
+                COALESCE(SUM(CASE WHEN expires_at < ? THEN 1 ELSE 0 END), 0) as expiring_24h,
+                COALESCE(SUM(CASE WHEN expires_at < ? THEN 1 ELSE 0 END), 0) as expiring_7d
+            FROM subscriptions
+            WHERE is_active = 1
+        """, (day_limit, week_limit))
+
+    # ---------- подписки: чтение ----------
+
+    def active_subscription(self, telegram_id):
+        """Последняя по сроку активная подписка пользователя (строка subscriptions) или None"""
+        return self._one_subscription("""
+            SELECT sub.*
+            FROM subscriptions sub
+            JOIN users u ON sub.user_id = u.id
+            WHERE u.telegram_id = ? AND sub.is_active = 1
+            ORDER BY sub.expires_at DESC LIMIT 1
+        """, (telegram_id,))
+
+    def get_subscription(self, subscription_id):
+        return self._one_subscription("SELECT * FROM subscriptions WHERE id = ?", (subscription_id,))
+
+    def _one_subscription(self, sql, params):
+        row = self._one(sql, params)
+        return decode_row(row) if row else None
+
+    def subscription_servers(self, subscription_id):
+        """Серверы подписки по имени: server_id, config_link, server_name, ip"""
+        return self._all("""
+            SELECT ss.server_id, ss.config_link, srv.name as server_name, srv.ip
+            FROM subscription_servers ss
+            JOIN servers srv ON ss.server_id = srv.id
+            WHERE ss.subscription_id = ?
+            ORDER BY srv.name
+        """, (subscription_id,))
+
+    def expired_subscription_ids(self, now):
+        """id активных подписок с expires_at < now (строка DATE_FORMAT)"""
+        with self._reading() as conn:
+            return [row[0] for row in conn.execute("""
+                SELECT id FROM subscriptions
+                WHERE is_active = 1 AND expires_at < ?
+            """, (now,)).fetchall()]
+
+    def load_subscription(self, token):
+        """dict(is_active, expires_at, payload, servers) или None (для /sub/<token>)"""
+        with self._reading() as conn:
+            return load_subscription(conn, token, self.encode_uuid)
+
+    def load_servers(self, token):
+        """Модель серверов активной подписки для форматов Clash/sing-box (sub_snapshot.load_servers)"""
+        with self._reading() as conn:
+            return load_servers(conn, token, self.encode_uuid)
+
+    def active_tokens(self, telegram_ids):
+        """telegram_id -> (токен, expires_at) активной подписки, для пачки пользователей"""
+        found = {}
+        telegram_ids = list(telegram_ids)
+        with self._reading() as conn:
+            for start in range(0, len(telegram_ids), IN_BATCH):
+                part = telegram_ids[start:start + IN_BATCH]
+                # +is_active: без ANALYZE SQLite при длинном IN выбирает индекс
+                # (is_active, expires_at) и перебирает все активные подписки
+                for row in conn.execute(f"""
+                    SELECT u.telegram_id, s.subscription_token, s.expires_at
+                    FROM subscriptions s
+                    JOIN users u ON s.user_id = u.id
+                    WHERE +s.is_active = 1 AND u.telegram_id IN ({', '.join('?' * len(part))})
+                """, part).fetchall():
+                    row = decode_row(row)
+                    found[row['telegram_id']] = (row['subscription_token'], row['expires_at'])
+        return found
+
+    def server_subscription_tokens(self, server_ids):
+        """Токены активных подписок, в которые входит хотя бы один из серверов"""
+        server_ids = list(server_ids)
+        tokens = set()
+        with self._reading() as conn:
+            for start in range(0, len(server_ids), IN_BATCH):
+                part = server_ids[start:start + IN_BATCH]
+                for row in conn.execute(f"""
+                    SELECT sub.subscription_token
+                    FROM subscription_servers ss
+                    JOIN subscriptions sub ON sub.id = ss.subscription_id
+                    WHERE sub.is_active = 1 AND ss.server_id IN ({', '.join('?' * len(part))})
+                """, part).fetchall():
+                    tokens.add(decode_row(row)['subscription_token'])
+        return sorted(tokens)
+
+    # ---------- трафик ----------
+
+    def traffic_emails(self):
+        """(server_id, email клиента в Xray) -> subscription_id для активных подписок"""
+        with self._reading() as conn:
+            return {(row[0], row[1]): row[2] for row in conn.execute("""
+                SELECT ss.server_id, p.email, ss.subscription_id
+                FROM subscription_servers ss
+                JOIN subscriptions sub ON ss.subscription_id = sub.id
+                JOIN uuid_pool p ON p.server_id = ss.server_id AND p.uuid = ss.uuid
+                WHERE sub.is_active = 1
+            """).fetchall()}
+
+    def add_traffic(self, totals):
+        """Добавляет приращения к суммам трафика. totals: {subscription_id: (upload, download)}"""
+        self.transaction(lambda conn: conn.executemany("""
+            INSERT INTO traffic_totals (subscription_id, upload, download)
+            VALUES (?, ?, ?)
+            ON CONFLICT (subscription_id) DO UPDATE SET
+                upload = traffic_totals.upload + excluded.upload,
+                download = traffic_totals.download + excluded.download,
+                updated_at = CURRENT_TIMESTAMP
+        """, [(sid, up, down) for sid, (up, down) in totals.items()]))
+
+    def traffic_by_token(self):
+        """токен -> (upload, download) активных подписок"""
+        with self._reading() as conn:
+            rows = [decode_row(row) for row in conn.execute("""
+                SELECT sub.subscription_token, t.upload, t.download
+                FROM traffic_totals t
+                JOIN subscriptions sub ON t.subscription_id = sub.id
+                WHERE sub.is_active = 1
+            """).fetchall()]
+        return {row['subscription_token']: (row['upload'], row['download']) for row in rows}
+
+    # ---------- напоминания ----------
+
+    def due_reminders(self, kind, expires_from, expires_to, limit):
+        """Активные подписки с expires_at в (expires_from, expires_to], ещё не получившие напоминание kind"""
+        return self._all("""
+            SELECT sub.id, sub.expires_at, u.telegram_id
+            FROM subscriptions sub
+            JOIN users u ON sub.user_id = u.id
+            WHERE sub.is_active = 1
+            AND sub.expires_at > ? AND sub.expires_at <= ?
+            AND NOT EXISTS (
+                SELECT 1 FROM reminders_sent r
+                WHERE r.subscription_id = sub.id AND r.kind = ?
+            )
+            ORDER BY sub.expires_at
+            LIMIT ?
+        """, (expires_from, expires_to, kind, limit))
+
+    def mark_reminder(self, subscription_id, kind, status):
+        self.transaction(lambda conn: conn.execute("""
+            INSERT INTO reminders_sent (subscription_id, kind, status, sent_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (subscription_id, kind) DO UPDATE SET
+                status = excluded.status, sent_at = excluded.sent_at
+        """, (subscription_id, kind, status)))
+
+    # ---------- платежи (api/payments.py) ----------
+
+    def create_payment(self, idempotency_key, telegram_id, username, plan, amount, duration_days, provider):
+        """Новый платёж или уже существующий с тем же idempotency_key"""
+        def run(conn):
+            conn.execute("""
+                INSERT INTO payments
+                (idempotency_key, telegram_id, username, plan, amount, duration_days, provider)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT DO NOTHING
+            """, (idempotency_key, telegram_id, username, plan, amount, duration_days, provider))
+            return dict(conn.execute("SELECT * FROM payments WHERE idempotency_key = ?",
+                                     (idempotency_key,)).fetchone())
+        return self.transaction(run)
+
+    def get_payment(self, payment_id):
+        return self._one("SELECT * FROM payments WHERE id = ?", (payment_id,))
+
+    def attach_provider_payment_id(self, payment_id, provider_payment_id):
+        self.transaction(lambda conn: conn.execute("""
+            UPDATE payments SET provider_payment_id = ?
+            WHERE id = ? AND provider_payment_id IS NULL
+        """, (provider_payment_id, payment_id)))
+
+    def lock_payment(self, conn, payment_id=None, provider_payment_id=None):
+        """Платёж по своему id или по id провайдера (строка блокируется до конца транзакции)"""
+        if payment_id is None:
+            return conn.execute(f"SELECT * FROM payments WHERE provider_payment_id = ?{self.LOCK_ROW}",
+                                (provider_payment_id,)).fetchone()
+        return conn.execute(f"SELECT * FROM payments WHERE id = ?{self.LOCK_ROW}", (payment_id,)).fetchone()
+
+    def confirm_payment(self, conn, payment_id, provider_payment_id):
+        """pending -> confirmed и запись в outbox. False, если платёж уже не pending"""
+        cursor = conn.execute("""
+            UPDATE payments SET status = 'confirmed', confirmed_at = CURRENT_TIMESTAMP,
+                provider_payment_id = COALESCE(provider_payment_id, ?)
+            WHERE id = ? AND status = 'pending'
+        """, (provider_payment_id, payment_id))
+        if cursor.rowcount != 1:
+            return False
+        conn.execute("INSERT INTO payment_outbox (payment_id) VALUES (?) ON CONFLICT DO NOTHING", (payment_id,))
+        return True
+
+    def claim_payments(self, now, limit):
+        """Платежи из outbox, готовые к выдаче (available_at <= now), с числом попыток"""
+        return self._all("""
+            SELECT p.*, o.attempts
+            FROM payment_outbox o
+            JOIN payments p ON p.id = o.payment_id
+            WHERE o.status = 'pending' AND o.available_at <= ?
+            ORDER BY o.available_at, o.payment_id
+            LIMIT ?
+        """, (now, limit))
+
+    def finish_payments(self, done, retry, failed):
+        """
+        Итог пачки outbox одной транзакцией.
+        done: [payment_id], retry: [(payment_id, available_at, error)], failed: [(payment_id, error)]
+        """
+        def run(conn):
+            if done:
+                conn.executemany("UPDATE payment_outbox SET status = 'done' WHERE payment_id = ?",
+                                 [(pid,) for pid in done])
+            if retry:
+                conn.executemany("""
+                    UPDATE payment_outbox SET attempts = attempts + 1, available_at = ?, last_error = ?
+                    WHERE payment_id = ?
+                """, [(available_at, error, pid) for pid, available_at, error in retry])
+            if failed:
+                conn.executemany("""
+                    UPDATE payment_outbox SET status = 'failed', attempts = attempts + 1, last_error = ?
+                    WHERE payment_id = ?
+                """, [(error, pid) for pid, error in failed])
+                conn.executemany("UPDATE payments SET status = 'failed' WHERE id = ? AND status = 'confirmed'",
+                                 [(pid,) for pid, _ in failed])
+        self.transaction(run)
+
+    # ---------- подписки: записи в транзакции conn ----------
+
+    def ensure_user(self, conn, telegram_id, username):
+        """(user_id, создан ли пользователь этим вызовом)"""
+        row = conn.execute("SELECT id FROM users WHERE telegram_id = ?", (telegram_id,)).fetchone()
+        if row:
+            return row[0], False
+        cursor = conn.execute("""
+            INSERT INTO users (telegram_id, username) VALUES (?, ?)
+            ON CONFLICT DO NOTHING
+        """, (telegram_id, username))
+        row = conn.execute("SELECT id FROM users WHERE telegram_id = ?", (telegram_id,)).fetchone()
+        return row[0], cursor.rowcount == 1
+
+    def take_free_uuid(self, conn, server_id):
+        """
+        Свободный UUID пула сервера (id, uuid, email) или None.
+        Строка блокируется до конца транзакции; параллельные транзакции
+        берут другие свободные строки
+        """
+        row = conn.execute(f"""
+            SELECT id, uuid, email FROM uuid_pool
+            WHERE server_id = ? AND is_used = 0
+            LIMIT 1{self.LOCK_SKIP_LOCKED}
+        """, (server_id,)).fetchone()
+        return decode_row(row) if row else None
+
+    def take_free_uuids(self, conn, server_id, count):
+        """До count свободных UUID пула сервера (id, uuid) одним запросом, строки блокируются"""
+        rows = conn.execute(f"""
+            SELECT id, uuid FROM uuid_pool
+            WHERE server_id = ? AND is_used = 0
+            LIMIT ?{self.LOCK_SKIP_LOCKED}
+        """, (server_id, count)).fetchall()
+        return [decode_row(row) for row in rows]
+
+    def ensure_users(self, conn, users):
+        """
+        Пачка (telegram_id, username) -> ({telegram_id: user_id}, множество
+        telegram_id, созданных этим вызовом)
+        """
+        def lookup(telegram_ids):
+            found = {}
+            for start in range(0, len(telegram_ids), IN_BATCH):
+                part = telegram_ids[start:start + IN_BATCH]
+                found.update(conn.execute(
+                    f"SELECT telegram_id, id FROM users WHERE telegram_id IN ({', '.join('?' * len(part))})",
+                    part
+                ).fetchall())
+            return found
+
+        user_ids = lookup(list({telegram_id for telegram_id, _ in users}))
+        missing = {telegram_id: username for telegram_id, username in users if telegram_id not in user_ids}
+        if not missing:
+            return user_ids, set()
+        conn.executemany("""
+            INSERT INTO users (telegram_id, username) VALUES (?, ?)
+            ON CONFLICT DO NOTHING
+        """, list(missing.items()))
+        created = lookup(list(missing))
+        user_ids.update(created)
+        return user_ids, set(created)
+
+    def mark_uuids_used(self, conn, pool_ids):
+        conn.executemany("UPDATE uuid_pool SET is_used = 1 WHERE id = ?", [(pool_id,) for pool_id in pool_ids])
+
+    def add_subscription_servers(self, conn, rows):
+        """Пачка (subscription_id, server_id, config_link, uuid)"""
+        conn.executemany("""
+            INSERT INTO subscription_servers (subscription_id, server_id, config_link, uuid)
+            VALUES (?, ?, ?, ?)
+        """, [(subscription_id, server_id, config_link, self.encode_uuid(uuid_value))
+              for subscription_id, server_id, config_link, uuid_value in rows])
+
+    def mark_uuid_used(self, conn, pool_id):
+        conn.execute("UPDATE uuid_pool SET is_used = 1 WHERE id = ?", (pool_id,))
+
+    def release_uuid(self, conn, uuid_value, server_id):
+        """Возвращает UUID в пул сервера. True, если занятый UUID действительно освобождён"""
+        cursor = conn.execute("""
+            UPDATE uuid_pool SET is_used = 0
+            WHERE uuid = ? AND server_id = ? AND is_used = 1
+        """, (self.encode_uuid(uuid_value), server_id))
+        return cursor.rowcount > 0
+
+    def insert_subscription(self, conn, user_id, uuid_value, token, expires_at):
+        return self._insert(conn, """
+            INSERT INTO subscriptions (user_id, uuid, subscription_token, expires_at)
+            VALUES (?, ?, ?, ?)
+        """, (user_id, self.encode_uuid(uuid_value), self.encode_uuid(token), expires_at))
+
+    def add_subscription_server(self, conn, subscription_id, server_id, config_link, uuid_value):
+        conn.execute("""
+            INSERT INTO subscription_servers (subscription_id, server_id, config_link, uuid)
+            VALUES (?, ?, ?, ?)
+        """, (subscription_id, server_id, config_link, self.encode_uuid(uuid_value)))
+
+    def lock_subscription(self, conn, subscription_id):
+        """Строка подписки, заблокированная до конца транзакции, или None"""
+        row = conn.execute(f"""
+            SELECT id, uuid, subscription_token, is_active, expires_at
+            FROM subscriptions WHERE id = ?{self.LOCK_ROW}
+        """, (subscription_id,)).fetchone()
+        return decode_row(row) if row else None
+
+    def set_expires_at(self, conn, subscription_id, expires_at):
+        conn.execute("UPDATE subscriptions SET expires_at = ? WHERE id = ?", (expires_at, subscription_id))
+
+    def clear_reminders(self, conn, subscription_id):
+        conn.execute("DELETE FROM reminders_sent WHERE subscription_id = ?", (subscription_id,))
+
+    def subscription_server_uuids(self, conn, subscription_id):
+        """(server_id, UUID клиента на сервере) подписки; UUID None - ссылка, которую не разобрала миграция 8"""
+        return [(row['server_id'], row['uuid']) for row in (decode_row(row) for row in conn.execute(
+            "SELECT server_id, uuid FROM subscription_servers WHERE subscription_id = ?",
+            (subscription_id,)
+        ).fetchall())]
+
+    def set_inactive(self, conn, subscription_id):
+        conn.execute("UPDATE subscriptions SET is_active = 0 WHERE id = ?", (subscription_id,))
+
+    def mark_payment_provisioned(self, conn, payment_id, subscription_id):
+        """confirmed -> provisioned. False, если платёж уже обработан"""
+        cursor = conn.execute("""
+            UPDATE payments SET status = 'provisioned', subscription_id = ?,
+                provisioned_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'confirmed'
+        """, (subscription_id, payment_id))
+        return cursor.rowcount == 1
+
+
+class SQLiteRepository(Repository):
+    """vpn.db. readonly - только чтение (subscription сервер в режиме ro)"""
+
+    encode_uuid = staticmethod(to_db)
+
+    def __init__(self, db_file, write_queue=None, readonly=False):
+        self.db_file = db_file
+        self.write_queue = write_queue
+        self.readonly = readonly
+
+    @property
+    def concurrent_writes(self):
+        # Без очереди параллельные записи только ждут блокировку БД
+        return self.write_queue is not None
+
+    def connect(self):
+        if self.readonly:
+            return connect_readonly(self.db_file)
+        conn = sqlite3.connect(self.db_file)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def transaction(self, fn):
+        """
+        С очередью записи операция попадает в групповой коммит вместе
+        с параллельными, иначе - своя транзакция и свой коммит
+        """
+        if self.write_queue is not None:
+            return self.write_queue.execute(fn)
+
+        conn = self.connect()
+        try:
+            result = fn(conn)
+            conn.commit()
+            return result
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def init_schema(self, log=print):
+        """Миграции api/migrations.py; если схема актуальна - один PRAGMA без DDL и блокировок"""
+        conn = sqlite3.connect(self.db_file)
+        try:
+            if schema_version(conn) >= SCHEMA_VERSION:
+                return False
+        finally:
+            conn.close()
+
+        migrate(self.db_file, log=log)
+        return True
+
+
+def sqlite_path(url):
+    """Путь к файлу SQLite для адреса хранилища (путь или sqlite:///path), None - PostgreSQL"""
+    if url.startswith(('postgresql://', 'postgres://')):
+        return None
+    if url.startswith('sqlite:///'):
+        return url[len('sqlite:///'):]
+    return url
+
+
+def get_repository(url, write_queue=None, readonly=False, **kwargs):
+    """
+    Хранилище по адресу (DATABASE_URL): путь к файлу или sqlite:///path - SQLite,
+    postgresql://... - PostgreSQL (нужен пакет psycopg). write_queue и readonly
+    есть только у SQLite, для PostgreSQL не используются
+    """
+    path = sqlite_path(url)
+    if path is None:
+        from api.repository_pg import PostgresRepository
+        return PostgresRepository(url, **kwargs)
+    return SQLiteRepository(path, write_queue, readonly, **kwargs)
@@ -0,0 +1,367 @@
+"""
+PostgreSQL реализация хранилища (api/repository.py).
+
+Несколько писателей одновременно: транзакции выдачи подписок блокируют
+только свои строки (UUID пула берутся через FOR UPDATE SKIP LOCKED),
+а не всю БД, как в SQLite. Соединения берутся из пула.
+
+psycopg (3.x) импортируется при создании репозитория - остальной код
+и SQLite реализация работают без него:
+    pip install "psycopg[binary]"
+
+Соединения принимают SQL с плейсхолдерами "?" и отдают строки,
+совместимые с sqlite3.Row, поэтому SQL из Repository и функции вроде
+sub_snapshot.load_subscription работают без изменений.
+
+expires_at хранится текстом в формате SQLite ('%Y-%m-%d %H:%M:%S'):
+его сравнивают со строками и разбирают strptime по всему коду.
+"""
+import queue
+import threading
+
+from api.repository import Repository
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        telegram_id BIGINT UNIQUE NOT NULL,
+        username TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS servers (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        name TEXT NOT NULL,
+        ip TEXT NOT NULL,
+        port INTEGER DEFAULT 443,
+        public_key TEXT NOT NULL,
+        ssh_user TEXT DEFAULT 'root',
+        ssh_port INTEGER DEFAULT 22,
+        max_users INTEGER DEFAULT 60,
+        is_active INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id BIGINT NOT NULL REFERENCES users(id),
+        uuid TEXT NOT NULL,
+        subscription_token TEXT UNIQUE NOT NULL,
+        is_active INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expires_at TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS subscription_servers (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        subscription_id BIGINT NOT NULL REFERENCES subscriptions(id),
+        server_id BIGINT NOT NULL REFERENCES servers(id),
+        config_link TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(subscription_id, server_id)
+    )
+    """,
+    """
+    ALTER TABLE subscription_servers ADD COLUMN IF NOT EXISTS uuid TEXT
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS uuid_pool (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        uuid TEXT NOT NULL,
+        email TEXT NOT NULL,
+        server_id BIGINT NOT NULL REFERENCES servers(id),
+        is_used INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(uuid, server_id)
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_uuid_pool_free
+    ON uuid_pool (server_id) WHERE is_used = 0
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS server_health (
+        server_id BIGINT PRIMARY KEY REFERENCES servers(id),
+        is_healthy INTEGER DEFAULT 1,
+        rtt_ms REAL,
+        failure_rate REAL DEFAULT 0,
+        consecutive_failures INTEGER DEFAULT 0,
+        checked_at TIMESTAMP
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_subscriptions_active_expires
+    ON subscriptions (is_active, expires_at)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_subscriptions_user
+    ON subscriptions (user_id)
+    """,
+    # UUID уникален среди активных подписок (как миграция 11 SQLite)
+    """
+    ALTER TABLE subscriptions DROP CONSTRAINT IF EXISTS subscriptions_uuid_key
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_subscriptions_active_uuid
+    ON subscriptions (uuid) WHERE is_active = 1
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_subscription_servers_server
+    ON subscription_servers (server_id)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_uuid_pool_server_used
+    ON uuid_pool (server_id, is_used)
+    """,
+    # Версия servers для api/server_catalog.py (как миграция 9 SQLite)
+    """
+    CREATE TABLE IF NOT EXISTS catalog_version (
+        name TEXT PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    INSERT INTO catalog_version (name, version) VALUES ('servers', 0)
+    ON CONFLICT DO NOTHING
+    """,
+    """
+    CREATE OR REPLACE FUNCTION bump_servers_version() RETURNS trigger AS $$
+    BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE name = 'servers';
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE TRIGGER servers_version
+    AFTER INSERT OR UPDATE OR DELETE ON servers
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_servers_version()
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS reminders_sent (
+        subscription_id BIGINT NOT NULL REFERENCES subscriptions(id),
+        kind TEXT NOT NULL,
+        status TEXT NOT NULL,
+        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (subscription_id, kind)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS payments (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        idempotency_key TEXT UNIQUE NOT NULL,
+        telegram_id BIGINT NOT NULL,
+        username TEXT,
+        plan TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        duration_days INTEGER NOT NULL,
+        provider TEXT NOT NULL,
+        provider_payment_id TEXT UNIQUE,
+        status TEXT NOT NULL DEFAULT 'pending',
+        subscription_id BIGINT REFERENCES subscriptions(id),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        confirmed_at TIMESTAMP,
+        provisioned_at TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS payment_outbox (
+        payment_id BIGINT PRIMARY KEY REFERENCES payments(id),
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        available_at DOUBLE PRECISION NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_payment_outbox_pending
+    ON payment_outbox (available_at) WHERE status = 'pending'
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS traffic_totals (
+        subscription_id BIGINT PRIMARY KEY REFERENCES subscriptions(id),
+        upload BIGINT DEFAULT 0,
+        download BIGINT DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+
+class Row(tuple):
+    """Строка как sqlite3.Row: row[0], row['name'], dict(row)"""
+
+    def __new__(cls, index, values):
+        row = super().__new__(cls, values)
+        row._index = index
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._index[key]
+        return super().__getitem__(key)
+
+    def keys(self):
+        return list(self._index)
+
+
+def _row_factory(cursor):
+    index = {column.name: i for i, column in enumerate(cursor.description or ())}
+    return lambda values: Row(index, values)
+
+
+def _qmark(sql):
+    """Плейсхолдеры "?" -> "%s" (литеральный % экранируется)"""
+    return sql.replace('%', '%%').replace('?', '%s')
+
+
+class _Cursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(_qmark(sql), params)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        raise NotImplementedError("PostgreSQL: id вставленной строки - через RETURNING id")
+
+
+class _Connection:
+    """Соединение psycopg с интерфейсом sqlite3.Connection, который использует код"""
+
+    def __init__(self, conn):
+        self.raw = conn
+
+    def cursor(self):
+        return _Cursor(self.raw.cursor(row_factory=_row_factory))
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        cursor = self.raw.cursor()
+        cursor.executemany(_qmark(sql), seq_of_params)
+        return cursor
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        self.raw.close()
+
+
+class PostgresRepository(Repository):
+    LOCK_ROW = ' FOR UPDATE'
+    LOCK_SKIP_LOCKED = ' FOR UPDATE SKIP LOCKED'
+    concurrent_writes = True
+
+    def __init__(self, dsn, pool_size=10, schema=None, connect_timeout=10):
+        import psycopg
+        self._psycopg = psycopg
+        self.dsn = dsn
+        self.pool_size = pool_size
+        self.schema = schema
+        self.connect_timeout = connect_timeout
+        self._pool = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        options = f"-c search_path={self.schema}" if self.schema else None
+        conn = self._psycopg.connect(self.dsn, connect_timeout=self.connect_timeout, options=options,
+                                     client_encoding='utf8')
+        return _Connection(conn)
+
+    def connect(self):
+        """Соединение из пула (новое, пока пул не заполнен, иначе ждёт освободившееся)"""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.pool_size:
+                self._opened += 1
+                try:
+                    return self._open()
+                except Exception:
+                    self._opened -= 1
+                    raise
+        return self._pool.get()
+
+    def release(self, conn):
+        """Возвращает соединение в пул (незавершённая транзакция откатывается)"""
+        if conn.raw.closed:
+            with self._lock:
+                self._opened -= 1
+            return
+        try:
+            conn.rollback()
+        except Exception:
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+            return
+        self._pool.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+    def transaction(self, fn):
+        conn = self.connect()
+        try:
+            result = fn(conn)
+            conn.commit()
+            return result
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def _insert(self, conn, sql, params):
+        return conn.execute(f"{sql.rstrip()} RETURNING id", params).fetchone()[0]
+
+    def init_schema(self, log=print):
+        """CREATE ... IF NOT EXISTS для всех таблиц. True, если схемы ещё не было"""
+        def run(conn):
+            if self.schema:
+                conn.execute(f"CREATE SCHEMA IF NOT EXISTS {self.schema}")
+            exists = conn.execute("SELECT to_regclass('subscriptions') IS NOT NULL").fetchone()[0]
+            for statement in SCHEMA:
+                conn.execute(statement)
+            return not exists
+
+        created = self.transaction(run)
+        if created:
+            log("Схема PostgreSQL создана")
+        return created
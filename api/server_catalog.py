@@ -0,0 +1,69 @@
+"""
+Каталог серверов в памяти процесса.
+
+Строки servers меняются редко (scripts/add_server.py, ручные правки), а
+читаются на каждую выдачу подписки и в меню администратора. Каталог
+держит их в памяти и перечитывает, только когда сменилась версия
+catalog_version.servers - её увеличивают триггеры на servers (миграция 9
+для SQLite, SCHEMA в api/repository_pg.py), так что изменение из любого
+процесса видно остальным. Версия проверяется лениво, не чаще раза
+в check_interval секунд (SERVER_CATALOG_INTERVAL) - без опроса БД на
+каждый вызов и без фоновых потоков.
+
+Нагрузка, остаток пула и здоровье меняются с каждой подпиской и проверкой,
+их VPNManager читает агрегатами (Repository.server_loads, pool_counts,
+server_health) и соединяет со строками каталога.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ServerCatalog:
+    def __init__(self, repository, check_interval=2.0):
+        self.repository = repository
+        self.check_interval = check_interval
+        self._servers = None
+        self._by_id = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'checks': 0, 'reloads': 0}
+
+    def _current(self):
+        now = time.monotonic()
+        if self._servers is not None and now - self._checked_at < self.check_interval:
+            return self._servers
+
+        with self._lock:
+            if self._servers is not None and now - self._checked_at < self.check_interval:
+                return self._servers
+            version = self.repository.servers_version()
+            self.stats['checks'] += 1
+            # None - таблицы версий нет (схема старше миграции 9): читаем каждый раз
+            if self._servers is None or version is None or version != self._version:
+                servers = self.repository.server_rows()
+                self._by_id = {server['id']: server for server in servers}
+                self._servers = servers
+                if version is not None and self._version is not None:
+                    logger.info(f"Каталог серверов обновлён: версия {version}, серверов {len(servers)}")
+                self._version = version
+                self.stats['reloads'] += 1
+            self._checked_at = now
+            return self._servers
+
+    def all(self):
+        """Копии строк всех серверов по возрастанию id"""
+        return [dict(server) for server in self._current()]
+
+    def get(self, server_id):
+        """Копия строки сервера или None"""
+        self._current()
+        server = self._by_id.get(server_id)
+        return dict(server) if server is not None else None
+
+    def invalidate(self):
+        """Перечитать при следующем обращении (после своей записи в servers)"""
+        self._checked_at = 0.0
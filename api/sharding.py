@@ -0,0 +1,287 @@
+"""
+Шардирование подписок по токену (consistent hashing).
+
+Каждый шард - отдельный SQLite файл token -> payload, которым владеет
+один экземпляр subscription сервера. Бот остаётся источником истины (vpn.db)
+и отправляет каждую подписку владельцу по HTTP. Сервер отдаёт токены своих
+шардов сам, а чужие запрашивает у владельца.
+
+Конфигурация:
+    SHARDS="a=http://10.0.0.1:8080,b=http://10.0.0.2:8080"  - кольцо и адреса владельцев
+    SHARD_LOCAL="a=/var/lib/vpn/shard_a.db"                 - шарды этого экземпляра
+    SHARD_SECRET="..."                                      - секрет внутренних запросов
+"""
+import bisect
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from api.sub_snapshot import connect_readonly, iter_subscriptions, load_subscription
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Shard-Secret'
+FIELDS = ('is_active', 'expires_at', 'servers', 'payload')
+
+
+def parse_shards(spec):
+    """'a=x,b=y' -> {'a': 'x', 'b': 'y'} (порядок сохраняется)"""
+    shards = {}
+    for item in (spec or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, value = item.partition('=')
+        shards[name.strip()] = value.strip()
+    return shards
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Кольцо consistent hashing с виртуальными узлами"""
+
+    def __init__(self, nodes=(), vnodes=100):
+        self.vnodes = vnodes
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            pos = bisect.bisect(self._points, point)
+            self._points.insert(pos, point)
+            self._owners.insert(pos, node)
+
+    def remove(self, node):
+        keep = [(p, o) for p, o in zip(self._points, self._owners) if o != node]
+        self._points = [p for p, _ in keep]
+        self._owners = [o for _, o in keep]
+
+    def owner(self, key):
+        if not self._points:
+            raise ValueError("Кольцо шардов пустое")
+        pos = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[pos]
+
+
+class ShardStore:
+    """Локальное хранилище шарда"""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS subs (
+                token TEXT PRIMARY KEY,
+                is_active INTEGER NOT NULL,
+                expires_at TEXT,
+                servers INTEGER NOT NULL,
+                payload TEXT
+            ) WITHOUT ROWID
+        """)
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=10)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def get(self, token):
+        row = self._connection().execute(
+            "SELECT is_active, expires_at, servers, payload FROM subs WHERE token = ?", (token,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def put_many(self, records):
+        """records: [(token, dict)]"""
+        conn = self._connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO subs (token, is_active, expires_at, servers, payload) VALUES (?, ?, ?, ?, ?)",
+            [(token, *(record[f] for f in FIELDS)) for token, record in records]
+        )
+        conn.commit()
+
+    def delete_many(self, tokens):
+        conn = self._connection()
+        conn.executemany("DELETE FROM subs WHERE token = ?", [(t,) for t in tokens])
+        conn.commit()
+
+    def export(self, after='', limit=1000):
+        """Страница записей с токеном больше after (для перебалансировки)"""
+        rows = self._connection().execute(
+            "SELECT token, is_active, expires_at, servers, payload FROM subs WHERE token > ? ORDER BY token LIMIT ?",
+            (after, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+class ShardClient:
+    """HTTP клиент к владельцам шардов (используют бот, серверы и скрипты)"""
+
+    def __init__(self, shards, secret, timeout=5, db_file=None):
+        self.shards = shards
+        self.db_file = db_file
+        self.secret = secret
+        self.timeout = timeout
+        self.ring = HashRing(shards)
+
+    def owner(self, token):
+        return self.ring.owner(token)
+
+    def _request(self, method, shard, path='', body=None, query=None):
+        url = f"{self.shards[shard].rstrip('/')}/internal/shards/{shard}{path}"
+        if query:
+            url += '?' + urllib.parse.urlencode(query)
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(url, data=data, method=method)
+        request.add_header(SECRET_HEADER, self.secret)
+        if data is not None:
+            request.add_header('Content-Type', 'application/json')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read() or b'null')
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def fetch(self, token):
+        """Запись подписки у владельца или None"""
+        return self._request('GET', self.owner(token), f"/{urllib.parse.quote(token)}")
+
+    def push(self, records):
+        """Отправляет записи [(token, dict)] владельцам, группируя по шардам"""
+        by_shard = {}
+        for token, record in records:
+            by_shard.setdefault(self.owner(token), []).append(
+                dict({f: record[f] for f in FIELDS}, token=token)
+            )
+        for shard, items in by_shard.items():
+            self._request('PUT', shard, body=items)
+        return len(records)
+
+    def delete(self, shard, tokens):
+        self._request('DELETE', shard, body=list(tokens))
+
+    def export(self, shard, after='', limit=1000):
+        return self._request('GET', shard, query={'after': after, 'limit': limit}) or []
+
+    def sync_from_db(self, db_file, batch_size=1000):
+        """Полная выгрузка vpn.db по владельцам (первичное заполнение и перебалансировка)"""
+        conn = connect_readonly(db_file)
+        count = 0
+        batch = []
+        try:
+            for token, is_active, expires_at, servers, payload in iter_subscriptions(conn):
+                batch.append((token, {
+                    'is_active': is_active,
+                    'expires_at': expires_at,
+                    'servers': servers,
+                    'payload': payload
+                }))
+                if len(batch) >= batch_size:
+                    count += self.push(batch)
+                    batch = []
+            if batch:
+                count += self.push(batch)
+        finally:
+            conn.close()
+        return count
+
+    def prune(self, batch_size=1000):
+        """Удаляет из шардов токены, которые по текущему кольцу принадлежат другим"""
+        removed = 0
+        for shard in self.shards:
+            after = ''
+            while True:
+                page = self.export(shard, after, batch_size)
+                if not page:
+                    break
+                after = page[-1]['token']
+                foreign = [r['token'] for r in page if self.owner(r['token']) != shard]
+                if foreign:
+                    self.delete(shard, foreign)
+                    removed += len(foreign)
+        return removed
+
+
+class ShardOutbox:
+    """
+    Подписки, которые бот ещё не доставил владельцам шардов.
+    Событие кладёт токен; flush() читает актуальную запись из vpn.db и
+    отправляет её владельцу. Если владелец недоступен, токены его шарда
+    остаются в очереди и повторяются с экспоненциальной паузой
+    (base_delay * 2^попытка, не больше max_delay); каждая неудача пишется в лог.
+    Очередь в памяти: после перезапуска бота недоставленное досылает
+    scripts/shards.py sync
+    """
+
+    def __init__(self, client, base_delay=1.0, max_delay=300.0):
+        self.client = client
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # token -> (неудачных попыток, когда повторить по time.monotonic())
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, token):
+        with self._lock:
+            self._pending[token] = (0, 0.0)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Отправляет подошедшие токены. Возвращает секунды до следующего повтора или None"""
+        now = time.monotonic()
+        with self._lock:
+            due = {token: attempts for token, (attempts, retry_at) in self._pending.items() if retry_at <= now}
+            for token in due:
+                del self._pending[token]
+
+        by_shard = {}
+        for token in due:
+            by_shard.setdefault(self.client.owner(token), []).append(token)
+
+        for shard, tokens in by_shard.items():
+            try:
+                conn = connect_readonly(self.client.db_file)
+                try:
+                    records = [(token, subscription) for token, subscription in
+                               ((token, load_subscription(conn, token)) for token in tokens)
+                               if subscription is not None]
+                finally:
+                    conn.close()
+                if records:
+                    self.client.push(records)
+            except Exception as e:
+                attempts = max(due[token] for token in tokens) + 1
+                delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+                logger.warning(f"Шард {shard}: не удалось отправить {len(tokens)} подписок ({e}), "
+                               f"попытка {attempts}, повтор через {delay:.1f}с")
+                retry_at = time.monotonic() + delay
+                with self._lock:
+                    for token in tokens:
+                        # Новое событие за время отправки уже поставило токен заново
+                        self._pending.setdefault(token, (due[token] + 1, retry_at))
+
+        with self._lock:
+            if not self._pending:
+                return None
+            return max(min(retry_at for _, retry_at in self._pending.values()) - time.monotonic(), 0.0)
@@ -0,0 +1,340 @@
+"""
+Статическая карта token -> (заголовки, payload) в memory-mapped файлах.
+
+Формат:
+    <base>.idx          - заголовок + отсортированные записи фиксированной ширины
+    <base>.<gen>.dat    - данные: записи добавляются в конец
+
+Запись индекса (32 байта): ключ токена (16 байт), смещение (8), длина (4), флаги (4).
+Флаги: бит 0 - подписка активна, старшие биты - число серверов.
+Запись данных: длина заголовков (2 байта), заголовки HTTP (строки через \\r\\n), payload.
+
+Индекс подменяется атомарно через rename, поэтому читатель всегда видит
+согласованную пару индекс/данные. Поиск - бинарный по mmap, результат -
+memoryview на mmap без копирования.
+
+Писатель один - бот (события подписок VPNManager), читателей сколько
+угодно: scripts/serve_static_map.py и воркеры subscription сервера
+(SUB_READ_MODE=static_map). Файлы лежат в page cache, поэтому все процессы
+читают одну и ту же копию payload в памяти.
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+from hashlib import blake2b
+
+from api.sub_snapshot import connect_readonly, iter_subscriptions, load_subscription, response_headers
+from api.uuid_blob import to_db as uuid_to_db
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'VSM1'
+HEADER = struct.Struct('<4sIQQ')       # magic, count, generation, garbage
+RECORD = struct.Struct('<16sQII')      # key, offset, length, flags
+LENGTH = struct.Struct('<H')
+
+FLAG_ACTIVE = 1
+SERVERS_SHIFT = 8
+
+# Сжатие данных, когда мусор превышает эту долю файла
+COMPACT_RATIO = 0.5
+
+
+def token_key(token):
+    """
+    16-байтный ключ токена: байты канонического UUID (нижний регистр, с дефисами,
+    как api/uuid_blob.py) или хэш для остальных строк. Другие записи того же UUID
+    (верхний регистр, без дефисов, в скобках) - разные токены и не должны
+    совпадать по ключу с каноническим
+    """
+    key = uuid_to_db(token)
+    if isinstance(key, bytes):
+        return key
+    return blake2b(token.encode('utf-8'), digest_size=16).digest()
+
+
+def encode_entry(subscription):
+    """Запись данных для подписки (заголовки + payload)"""
+    if not subscription['is_active'] or not subscription['payload']:
+        return b''
+    headers = response_headers(subscription)
+    headers['Content-Type'] = 'text/plain; charset=utf-8'
+    header_bytes = '\r\n'.join(f"{k}: {v}" for k, v in headers.items()).encode('utf-8')
+    return LENGTH.pack(len(header_bytes)) + header_bytes + subscription['payload'].encode('utf-8')
+
+
+def _data_file(base, generation):
+    return f"{base}.{generation}.dat"
+
+
+class StaticMapWriter:
+    """
+    Писатель карты. Держит индекс в памяти, новые записи дописывает
+    в конец файла данных, при commit() атомарно переписывает индекс.
+    """
+
+    def __init__(self, base, fresh=False, db_file=None):
+        self.base = base
+        self.db_file = db_file
+        self.index_file = f"{base}.idx"
+        self._entries = {}
+        self._generation = 0
+        self._garbage = 0
+        self._data = None
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stale_generations = []
+        self._load(fresh)
+
+    def _load(self, fresh):
+        if not os.path.exists(self.index_file):
+            self._open_data(1, truncate=True)
+            return
+
+        with open(self.index_file, 'rb') as f:
+            raw = f.read()
+        magic, count, generation, garbage = HEADER.unpack_from(raw, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Неверный формат индекса: {self.index_file}")
+
+        if fresh:
+            # Полная перевыгрузка: новое поколение, старое удаляется после публикации индекса
+            self._stale_generations.append(generation)
+            self._open_data(generation + 1, truncate=True)
+            return
+
+        for i in range(count):
+            key, offset, length, flags = RECORD.unpack_from(raw, HEADER.size + i * RECORD.size)
+            self._entries[key] = (offset, length, flags)
+        self._garbage = garbage
+        self._open_data(generation)
+
+    def _open_data(self, generation, truncate=False):
+        if self._data is not None:
+            self._data.close()
+        self._generation = generation
+        self._data = open(_data_file(self.base, generation), 'wb' if truncate else 'ab')
+        self._size = self._data.tell()
+
+    def put(self, token, subscription):
+        """Добавляет/обновляет подписку (subscription - dict из load_subscription)"""
+        key = token_key(token)
+        entry = encode_entry(subscription)
+        flags = FLAG_ACTIVE | subscription['servers'] << SERVERS_SHIFT if entry else 0
+
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                self._garbage += old[1]
+            offset = self._size
+            if entry:
+                self._data.write(entry)
+                self._size += len(entry)
+            self._entries[key] = (offset, len(entry), flags)
+
+    def delete(self, token):
+        """Удаляет токен из карты"""
+        with self._lock:
+            old = self._entries.pop(token_key(token), None)
+            if old is not None:
+                self._garbage += old[1]
+
+    def commit(self):
+        """Сбрасывает данные на диск и атомарно публикует новый индекс"""
+        with self._lock:
+            if self._size and self._garbage > self._size * COMPACT_RATIO:
+                self._compact()
+
+            self._data.flush()
+            os.fsync(self._data.fileno())
+
+            records = [
+                RECORD.pack(key, offset, length, flags)
+                for key, (offset, length, flags) in sorted(self._entries.items())
+            ]
+            tmp_file = f"{self.index_file}.tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, len(records), self._generation, self._garbage))
+                f.write(b''.join(records))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.index_file)
+
+            for generation in self._stale_generations:
+                self._remove_data(generation)
+            self._stale_generations = []
+
+    def _remove_data(self, generation):
+        # Читатели со старым mmap продолжают работать: файл удаляется, но не исчезает до munmap
+        try:
+            os.remove(_data_file(self.base, generation))
+        except FileNotFoundError:
+            pass
+
+    def _compact(self):
+        """Переписывает данные без мусора в файл нового поколения"""
+        old_generation = self._generation
+        self._data.flush()
+
+        with open(_data_file(self.base, old_generation), 'rb') as f:
+            old_data = f.read()
+
+        self._open_data(old_generation + 1, truncate=True)
+        entries = {}
+        for key, (offset, length, flags) in self._entries.items():
+            new_offset = self._size
+            if length:
+                self._data.write(old_data[offset:offset + length])
+                self._size += length
+            entries[key] = (new_offset, length, flags)
+        self._entries = entries
+        self._garbage = 0
+        self._stale_generations.append(old_generation)
+        logger.info(f"Статическая карта сжата: поколение {self._generation}")
+
+    def close(self):
+        with self._lock:
+            if self._data is not None:
+                self._data.close()
+                self._data = None
+
+    def on_subscription_event(self, event, data):
+        """Инкрементальное обновление по событиям VPNManager (servers_changed - пачка токенов, один commit)"""
+        tokens = data['subscription_tokens'] if event == 'servers_changed' else [data['subscription_token']]
+        conn = connect_readonly(self.db_file)
+        try:
+            for token in tokens:
+                subscription = load_subscription(conn, token)
+                if subscription is None:
+                    self.delete(token)
+                else:
+                    self.put(token, subscription)
+        finally:
+            conn.close()
+        self.commit()
+
+
+def export_static_map(db_file, base):
+    """Полная выгрузка всех подписок в статическую карту. Возвращает писатель для дальнейших обновлений"""
+    started = time.time()
+
+    writer = StaticMapWriter(base, fresh=True, db_file=db_file)
+
+    conn = connect_readonly(db_file)
+    count = 0
+    try:
+        for token, is_active, expires_at, servers, payload in iter_subscriptions(conn):
+            writer.put(token, {
+                'is_active': is_active,
+                'expires_at': expires_at,
+                'servers': servers,
+                'payload': payload
+            })
+            count += 1
+        writer.commit()
+    finally:
+        conn.close()
+
+    logger.info(f"Статическая карта выгружена: {count} записей за {time.time() - started:.2f}с")
+    return writer
+
+
+class StaticMapReader:
+    """Читатель карты: бинарный поиск по mmap индекса, ответ - memoryview без копирования"""
+
+    def __init__(self, base, check_interval=1.0):
+        self.base = base
+        self.index_file = f"{base}.idx"
+        self.check_interval = check_interval
+        self._checked_at = 0.0
+        self._stat = None
+        self._maps = None
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        now = time.monotonic()
+        if self._maps is not None and now - self._checked_at < self.check_interval:
+            return self._maps
+
+        with self._lock:
+            self._checked_at = now
+            st = os.stat(self.index_file)
+            stat = (st.st_ino, st.st_mtime_ns)
+            if stat == self._stat and self._maps is not None:
+                return self._maps
+
+            with open(self.index_file, 'rb') as f:
+                index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, count, generation, _ = HEADER.unpack_from(index, 0)
+            if magic != MAGIC:
+                raise ValueError(f"Неверный формат индекса: {self.index_file}")
+
+            with open(_data_file(self.base, generation), 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+            # Старые mmap не закрываем явно: на них могут ссылаться выданные memoryview
+            self._maps = (index, count, memoryview(data))
+            self._stat = stat
+            return self._maps
+
+    def _find(self, token):
+        """(data, offset, length, flags) записи токена или None"""
+        index, count, data = self._reload()
+        key = token_key(token)
+
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = HEADER.size + mid * RECORD.size
+            mid_key = index[pos:pos + 16]
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                _, offset, length, flags = RECORD.unpack_from(index, pos)
+                return data, offset, length, flags
+        return None
+
+    def lookup(self, token):
+        """
+        Возвращает (is_active, headers, payload) как memoryview или None.
+        Для неактивной подписки headers и payload пустые.
+        """
+        found = self._find(token)
+        if found is None:
+            return None
+        data, offset, length, flags = found
+        if not flags & FLAG_ACTIVE:
+            return False, data[0:0], data[0:0]
+        header_len = LENGTH.unpack_from(data, offset)[0]
+        start = offset + LENGTH.size
+        return True, data[start:start + header_len], data[start + header_len:offset + length]
+
+    def get(self, token):
+        """
+        dict(is_active, expires_at, payload, servers) или None - как
+        load_subscription, для subscription сервера. expires_at
+        восстанавливается из Subscription-Userinfo записи
+        """
+        found = self._find(token)
+        if found is None:
+            return None
+        data, offset, length, flags = found
+        if not flags & FLAG_ACTIVE:
+            return {'is_active': 0, 'expires_at': None, 'payload': None, 'servers': 0}
+        header_len = LENGTH.unpack_from(data, offset)[0]
+        start = offset + LENGTH.size
+        headers = bytes(data[start:start + header_len])
+        expire = int(headers.rsplit(b'expire=', 1)[1].split(b'\r\n', 1)[0])
+        return {
+            'is_active': 1,
+            'expires_at': datetime.fromtimestamp(expire).strftime('%Y-%m-%d %H:%M:%S') if expire else None,
+            'payload': bytes(data[start + header_len:offset + length]).decode('utf-8'),
+            'servers': flags >> SERVERS_SHIFT
+        }
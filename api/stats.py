@@ -0,0 +1,121 @@
+"""
+Предрасчитанный снимок статистики для админ панели.
+Полный пересчёт делается периодически, между пересчётами снимок
+обновляется инкрементально по событиям VPNManager.
+"""
+import copy
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class StatsSnapshot:
+    def __init__(self, vpn_manager, max_age=300):
+        self.vpn_manager = vpn_manager
+        self.max_age = max_age
+        self._snapshot = None
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Полный пересчёт снимка (несколько агрегирующих запросов вместо COUNT на каждый показ)"""
+        repo = self.vpn_manager.repository
+        now = datetime.now()
+
+        totals = repo.expiring_counts((now + timedelta(days=1)).strftime(DATE_FORMAT),
+                                      (now + timedelta(days=7)).strftime(DATE_FORMAT))
+        overall = repo.stats()
+        totals['total_users'] = overall['total_users']
+        totals['free_uuids'] = overall['free_uuids']
+
+        servers = {
+            row['id']: {'id': row['id'], 'name': row['name'], 'max_users': row['max_users'],
+                        'is_active': row['is_active'], 'current_users': 0, 'pool_total': 0, 'pool_free': 0}
+            for row in repo.server_rows()
+        }
+        for server_id, current_users in repo.server_loads().items():
+            if server_id in servers:
+                servers[server_id]['current_users'] = current_users
+        for server_id, (total, free) in repo.pool_counts().items():
+            if server_id in servers:
+                servers[server_id]['pool_total'] = total
+                servers[server_id]['pool_free'] = free
+
+        totals['active_servers'] = sum(1 for s in servers.values() if s['is_active'])
+        totals['servers'] = list(servers.values())
+
+        with self._lock:
+            self._snapshot = totals
+            self._refreshed_at = time.time()
+
+        return self.get()
+
+    def get(self):
+        """Текущий снимок; пересчитывается только если ещё не строился или устарел"""
+        with self._lock:
+            snapshot = self._snapshot
+            stale = time.time() - self._refreshed_at > self.max_age
+
+        if snapshot is None or stale:
+            try:
+                return self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка пересчёта статистики: {e}")
+                if snapshot is None:
+                    raise
+
+        with self._lock:
+            result = copy.deepcopy(self._snapshot)
+        result['updated_at'] = datetime.fromtimestamp(self._refreshed_at).strftime(DATE_FORMAT)
+        return result
+
+    @staticmethod
+    def _count_expiring(snapshot, expires_at, sign):
+        left = datetime.strptime(expires_at, DATE_FORMAT) - datetime.now()
+        if left < timedelta(days=1):
+            snapshot['expiring_24h'] += sign
+        if left < timedelta(days=7):
+            snapshot['expiring_7d'] += sign
+
+    def on_subscription_event(self, event, data):
+        """Инкрементальное обновление снимка по событиям VPNManager"""
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None:
+                return
+
+            if event == 'extended':
+                # Меняется только срок: переносим подписку между счётчиками истекающих
+                self._count_expiring(snapshot, data['old_expires_at'], -1)
+                self._count_expiring(snapshot, data['expires_at'], 1)
+                return
+
+            if event == 'created':
+                sign = 1
+                if data.get('is_new_user'):
+                    snapshot['total_users'] += 1
+            elif event == 'deactivated' and data.get('was_active'):
+                sign = -1
+            else:
+                return
+
+            snapshot['active_subscriptions'] += sign
+            # Пул меняется на столько UUID, сколько взяла/вернула транзакция:
+            # при создании - по одному на сервер, при деактивации - released_server_ids
+            pool_ids = data.get('released_server_ids', data['server_ids'])
+            snapshot['free_uuids'] -= sign * len(pool_ids)
+
+            self._count_expiring(snapshot, data['expires_at'], sign)
+
+            server_ids = set(data['server_ids'])
+            pool_ids = set(pool_ids)
+            for server in snapshot['servers']:
+                if server['id'] in server_ids:
+                    server['current_users'] += sign
+                if server['id'] in pool_ids:
+                    server['pool_free'] -= sign
@@ -0,0 +1,141 @@
+"""
+Форматы ответа /sub/<token>: base64 VLESS ссылок (как раньше),
+Clash (Clash.Meta / mihomo) YAML и sing-box JSON.
+
+Формат выбирается параметром ?format= или по User-Agent клиента.
+Clash и sing-box собираются из модели серверов подписки
+(sub_snapshot.load_servers: UUID клиента, адрес и ключ REALITY каждого
+сервера), а не разбором config_link. Модель и готовые тексты кэшируются
+по версии подписки вместе со сжатыми вариантами (api/compression.py).
+"""
+import json
+
+# Параметры REALITY, общие для всех серверов (те же, что в config_link)
+FLOW = 'xtls-rprx-vision'
+SNI = 'www.microsoft.com'
+FINGERPRINT = 'chrome'
+
+BASE64 = 'base64'
+CLASH = 'clash'
+SINGBOX = 'singbox'
+
+# Значения ?format=
+FORMAT_ALIASES = {
+    'base64': BASE64, 'v2ray': BASE64,
+    'clash': CLASH, 'mihomo': CLASH, 'meta': CLASH,
+    'singbox': SINGBOX, 'sing-box': SINGBOX,
+}
+
+# Подстроки User-Agent клиентов (в нижнем регистре), проверяются по порядку
+USER_AGENTS = (
+    ('clash', CLASH), ('mihomo', CLASH), ('stash', CLASH),
+    ('sing-box', SINGBOX), ('sfa/', SINGBOX), ('sfi/', SINGBOX), ('sfm/', SINGBOX), ('sft/', SINGBOX),
+)
+
+# Content-Type и имя файла ответа
+CONTENT = {
+    BASE64: ('text/plain', 'subscription.txt'),
+    CLASH: ('text/yaml', 'subscription.yaml'),
+    SINGBOX: ('application/json', 'subscription.json'),
+}
+
+# Проверка задержки для автоматического выбора сервера
+TEST_URL = 'https://www.gstatic.com/generate_204'
+SELECT_GROUP = 'VPN'
+AUTO_GROUP = 'Авто'
+
+
+def detect_format(requested, user_agent):
+    """Формат ответа: ?format=, иначе по User-Agent, иначе base64. None - неизвестный ?format="""
+    if requested:
+        return FORMAT_ALIASES.get(requested.lower())
+    agent = (user_agent or '').lower()
+    for marker, fmt in USER_AGENTS:
+        if marker in agent:
+            return fmt
+    return BASE64
+
+
+def _unique_names(servers):
+    """Имена прокси в Clash/sing-box должны быть уникальны"""
+    names = []
+    seen = {}
+    for server in servers:
+        name = server['name']
+        seen[name] = seen.get(name, 0) + 1
+        names.append(name if seen[name] == 1 else f"{name} {seen[name]}")
+    return names
+
+
+def render_clash(servers):
+    """Конфиг Clash.Meta / mihomo. YAML собирается из JSON значений - JSON является подмножеством YAML"""
+    names = _unique_names(servers)
+    lines = ['mixed-port: 7890', 'allow-lan: false', 'mode: rule', 'log-level: warning', 'proxies:']
+    for name, server in zip(names, servers):
+        lines.append('  - ' + json.dumps({
+            'name': name,
+            'type': 'vless',
+            'server': server['ip'],
+            'port': server['port'],
+            'uuid': server['uuid'],
+            'network': 'tcp',
+            'tls': True,
+            'udp': True,
+            'flow': FLOW,
+            'servername': SNI,
+            'client-fingerprint': FINGERPRINT,
+            'reality-opts': {'public-key': server['public_key']},
+        }, ensure_ascii=False))
+    lines.append('proxy-groups:')
+    lines.append('  - ' + json.dumps({'name': SELECT_GROUP, 'type': 'select', 'proxies': [AUTO_GROUP] + names},
+                                     ensure_ascii=False))
+    lines.append('  - ' + json.dumps({'name': AUTO_GROUP, 'type': 'url-test', 'proxies': names,
+                                      'url': TEST_URL, 'interval': 300}, ensure_ascii=False))
+    lines.append('rules:')
+    lines.append(f'  - MATCH,{SELECT_GROUP}')
+    return '\n'.join(lines) + '\n'
+
+
+def render_singbox(servers):
+    """Конфиг sing-box (1.10+): TUN, выбор сервера вручную или по задержке"""
+    names = _unique_names(servers)
+    outbounds = [
+        {'type': 'selector', 'tag': SELECT_GROUP, 'outbounds': [AUTO_GROUP] + names, 'default': AUTO_GROUP},
+        {'type': 'urltest', 'tag': AUTO_GROUP, 'outbounds': names, 'url': TEST_URL, 'interval': '5m'},
+    ]
+    for name, server in zip(names, servers):
+        outbounds.append({
+            'type': 'vless',
+            'tag': name,
+            'server': server['ip'],
+            'server_port': server['port'],
+            'uuid': server['uuid'],
+            'flow': FLOW,
+            'tls': {
+                'enabled': True,
+                'server_name': SNI,
+                'utls': {'enabled': True, 'fingerprint': FINGERPRINT},
+                'reality': {'enabled': True, 'public_key': server['public_key']},
+            },
+        })
+    outbounds.append({'type': 'direct', 'tag': 'direct'})
+    return json.dumps({
+        'log': {'level': 'warn'},
+        'inbounds': [{
+            'type': 'tun',
+            'tag': 'tun-in',
+            'address': ['172.19.0.1/30'],
+            'auto_route': True,
+            'strict_route': True,
+        }],
+        'outbounds': outbounds,
+        'route': {'auto_detect_interface': True, 'final': SELECT_GROUP},
+    }, ensure_ascii=False, indent=2)
+
+
+RENDERERS = {CLASH: render_clash, SINGBOX: render_singbox}
+
+
+def render(fmt, servers):
+    """Текст подписки в формате fmt (кроме base64 - это payload) из модели серверов"""
+    return RENDERERS[fmt](servers)
@@ -0,0 +1,270 @@
+"""
+Снимок token -> payload для subscription сервера (read/write split).
+
+Бот (единственный писатель) периодически выгружает компактный снимок
+в отдельный SQLite файл и атомарно подменяет его. Subscription сервер
+читает снимок через read-only соединение и не конкурирует с ботом
+за блокировки vpn.db.
+"""
+import base64
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from api.uuid_blob import from_db, to_db
+
+logger = logging.getLogger(__name__)
+
+
+def encode_payload(config_links):
+    """Subscription в формате base64: каждая VLESS ссылка на новой строке"""
+    content = '\n'.join(config_links)
+    return base64.b64encode(content.encode('utf-8')).decode('utf-8')
+
+
+def connect_readonly(db_file, immutable=False):
+    """
+    Read-only соединение с БД.
+    immutable=1 допустим только для файлов, которые никто не меняет на месте
+    (снимок подменяется через rename, поэтому открытый файл не меняется).
+    """
+    uri = f"file:{db_file}?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def load_subscription(conn, token, encode=to_db):
+    """
+    Загружает подписку из основной БД.
+    Возвращает dict(is_active, expires_at, payload, servers) или None.
+    payload = None если у подписки нет серверов.
+    encode - представление токена в БД (в vpn.db - 16 байт, api/uuid_blob.py).
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT sub.id, sub.is_active, sub.expires_at
+        FROM subscriptions sub
+        WHERE sub.subscription_token = ?
+    """, (encode(token),))
+
+    row = cursor.fetchone()
+    if not row:
+        return None
+
+    subscription = {
+        'is_active': row['is_active'],
+        'expires_at': row['expires_at'],
+        'payload': None,
+        'servers': 0
+    }
+    if not row['is_active']:
+        return subscription
+
+    cursor.execute("""
+        SELECT ss.config_link, COALESCE(h.is_healthy, 1) as is_healthy
+        FROM subscription_servers ss
+        JOIN servers srv ON ss.server_id = srv.id
+        LEFT JOIN server_health h ON h.server_id = srv.id
+        WHERE ss.subscription_id = ?
+        ORDER BY srv.name
+    """, (row['id'],))
+
+    links = healthy_links(cursor.fetchall())
+    if links:
+        subscription['payload'] = encode_payload(links)
+        subscription['servers'] = len(links)
+    return subscription
+
+
+def load_servers(conn, token, encode=to_db):
+    """
+    Модель серверов активной подписки для форматов api/sub_formats.py:
+    [dict(uuid, name, ip, port, public_key)] в том же порядке и с тем же
+    исключением недоступных серверов, что и ссылки payload.
+    Серверы без subscription_servers.uuid пропускаются
+    """
+    rows = conn.execute("""
+        SELECT ss.uuid, srv.name, srv.ip, srv.port, srv.public_key, COALESCE(h.is_healthy, 1) as is_healthy
+        FROM subscriptions sub
+        JOIN subscription_servers ss ON ss.subscription_id = sub.id
+        JOIN servers srv ON ss.server_id = srv.id
+        LEFT JOIN server_health h ON h.server_id = srv.id
+        WHERE sub.subscription_token = ? AND sub.is_active = 1 AND ss.uuid IS NOT NULL
+        ORDER BY srv.name
+    """, (encode(token),)).fetchall()
+    servers = [
+        ({'uuid': from_db(row[0]), 'name': row[1], 'ip': row[2], 'port': row[3], 'public_key': row[4]}, row[5])
+        for row in rows
+    ]
+    return healthy_links(servers)
+
+
+def healthy_links(rows):
+    """
+    Ссылки без недоступных серверов (rows: config_link, is_healthy).
+    Если недоступны все, отдаём все: пустая подписка хуже.
+    """
+    healthy = [r[0] for r in rows if r[1]]
+    return healthy or [r[0] for r in rows]
+
+
+def iter_subscriptions(conn):
+    """
+    Все подписки одним проходом: (token, is_active, expires_at, servers, payload).
+    Для неактивных подписок payload = None.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT sub.subscription_token, sub.is_active, sub.expires_at,
+            ss.config_link, COALESCE(h.is_healthy, 1)
+        FROM subscriptions sub
+        LEFT JOIN subscription_servers ss ON ss.subscription_id = sub.id AND sub.is_active = 1
+        LEFT JOIN servers srv ON ss.server_id = srv.id
+        LEFT JOIN server_health h ON h.server_id = srv.id
+        WHERE sub.subscription_token IS NOT NULL
+        ORDER BY sub.id, srv.name
+    """)
+
+    def finish(current, rows):
+        links = healthy_links(rows)
+        return current + (len(links), encode_payload(links) if links else None)
+
+    current = None
+    rows = []
+    for token, is_active, expires_at, config_link, is_healthy in cursor:
+        token = from_db(token)
+        if current is None or current[0] != token:
+            if current is not None:
+                yield finish(current, rows)
+            current = (token, is_active, expires_at)
+            rows = []
+        if config_link:
+            rows.append((config_link, is_healthy))
+    if current is not None:
+        yield finish(current, rows)
+
+
+def expire_timestamp(expires_at):
+    """expires_at из БД -> Unix timestamp для Subscription-Userinfo"""
+    try:
+        return int(datetime.strptime(expires_at, '%Y-%m-%d %H:%M:%S').timestamp())
+    except (TypeError, ValueError):
+        return 0
+
+
+def response_headers(subscription, usage=(0, 0)):
+    """HTTP заголовки ответа /sub/<token> (usage - (upload, download) в байтах)"""
+    upload, download = usage
+    return {
+        'Content-Disposition': 'inline; filename="subscription.txt"',
+        # Кэшировать можно, но только с проверкой (ETag -> 304 Not Modified)
+        'Cache-Control': 'private, no-cache',
+        'Subscription-Userinfo': (
+            f'upload={upload}; download={download}; total=0; '
+            f'expire={expire_timestamp(subscription["expires_at"])}'
+        )
+    }
+
+
+def export_snapshot(db_file, snapshot_file):
+    """Выгружает снимок token -> payload и атомарно подменяет файл. Возвращает число записей"""
+    started = time.time()
+    tmp_file = f"{snapshot_file}.tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+
+    src = connect_readonly(db_file)
+    dst = sqlite3.connect(tmp_file)
+
+    try:
+        dst.execute("PRAGMA journal_mode = OFF")
+        dst.execute("PRAGMA synchronous = OFF")
+        dst.execute("""
+            CREATE TABLE subs (
+                token TEXT PRIMARY KEY,
+                is_active INTEGER NOT NULL,
+                expires_at TEXT,
+                servers INTEGER NOT NULL,
+                payload TEXT
+            ) WITHOUT ROWID
+        """)
+
+        count = 0
+        batch = []
+        for row in iter_subscriptions(src):
+            batch.append(row)
+            count += 1
+            if len(batch) >= 1000:
+                dst.executemany("INSERT OR REPLACE INTO subs VALUES (?, ?, ?, ?, ?)", batch)
+                batch = []
+        if batch:
+            dst.executemany("INSERT OR REPLACE INTO subs VALUES (?, ?, ?, ?, ?)", batch)
+
+        dst.commit()
+    finally:
+        src.close()
+        dst.close()
+
+    os.replace(tmp_file, snapshot_file)
+    logger.info(f"Снимок подписок выгружен: {count} записей за {time.time() - started:.2f}с")
+    return count
+
+
+class SnapshotReader:
+    """
+    Читатель снимка. Файл переоткрывается, когда бот его подменил
+    (проверка stat не чаще раза в check_interval секунд).
+    """
+
+    def __init__(self, snapshot_file, max_staleness=120, check_interval=1.0):
+        self.snapshot_file = snapshot_file
+        self.max_staleness = max_staleness
+        self.check_interval = check_interval
+        self._local = threading.local()
+        self._stat = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _check(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                st = os.stat(self.snapshot_file)
+                self._stat = (st.st_ino, st.st_mtime)
+            except FileNotFoundError:
+                self._stat = None
+
+    def is_fresh(self):
+        """Снимок существует и не старше max_staleness"""
+        self._check()
+        stat = self._stat
+        return stat is not None and time.time() - stat[1] <= self.max_staleness
+
+    def _connection(self):
+        # SQLite соединения не разделяем между потоками Flask
+        stat = self._stat
+        local = self._local
+        if getattr(local, 'stat', None) != stat:
+            if getattr(local, 'conn', None) is not None:
+                local.conn.close()
+            local.conn = connect_readonly(self.snapshot_file, immutable=True)
+            local.stat = stat
+        return local.conn
+
+    def lookup(self, token):
+        """dict(is_active, expires_at, payload, servers) или None"""
+        self._check()
+        row = self._connection().execute(
+            "SELECT is_active, expires_at, servers, payload FROM subs WHERE token = ?",
+            (token,)
+        ).fetchone()
+        return dict(row) if row else None
@@ -5,14 +5,31 @@
 """
 import os
 import sys
-import base64
 import logging
-from flask import Flask, Response, abort
+import hmac
+from flask import Flask, Response, abort, request, jsonify
+from werkzeug.exceptions import HTTPException
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from api.vpn_manager import VPNManager
-from api.database import init_database
+from bot.config import (
+    DATABASE_URL, NEGATIVE_CACHE_SIZE, NEGATIVE_CACHE_TTL,
+    RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST,
+    RATE_LIMIT_TOKEN_RATE, RATE_LIMIT_TOKEN_BURST,
+    RATE_LIMIT_TRUST_PROXY,
+    SUB_READ_MODE, SUB_SNAPSHOT_FILE, SUB_SNAPSHOT_MAX_STALENESS,
+    SUB_COMPRESSION, SUB_COMPRESSION_CACHE_SIZE, SUB_COMPRESSION_MIN_SIZE,
+    SUB_HTTP_SERVER, SUB_HTTP_WORKERS, SUB_HTTP_THREADS, SUB_KEEPALIVE_TIMEOUT, STATIC_MAP_BASE,
+    SHARDS, SHARD_LOCAL, SHARD_SECRET, TRAFFIC_CACHE_INTERVAL,
+    PAYMENT_PROVIDER, PAYMENT_PROVIDER_URL, PAYMENT_WEBHOOK_SECRET,
+    PROFILE_DIR, PROFILE_SECONDS, PROFILE_MAX_SECONDS, PROFILE_INTERVAL, PROFILE_SECRET
+)
+from api.compression import CompressedPayloads, etag
+from api.negative_cache import NegativeCache, MISSING, INACTIVE
+from api.rate_limit import RateLimiter
+from api.repository import get_repository
+from api.sub_formats import BASE64, CONTENT, detect_format
+from api.sub_snapshot import response_headers
 
 # Настройка логирования
 logging.basicConfig(
@@ -22,83 +39,282 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-vpn_manager = VPNManager()
+
+# Защита от опроса несуществующих/просроченных токенов без обращения к БД.
+# Сервер только читает БД (VPNManager с SSH и размещением ему не нужен),
+# записи кэша устаревают по TTL
+negative_cache = NegativeCache(NEGATIVE_CACHE_SIZE, NEGATIVE_CACHE_TTL)
+ip_limiter = RateLimiter(RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST)
+token_limiter = RateLimiter(RATE_LIMIT_TOKEN_RATE, RATE_LIMIT_TOKEN_BURST)
+
+# Сжатые варианты payload (br/gzip) считаются один раз на версию подписки
+compressed_payloads = CompressedPayloads(
+    SUB_COMPRESSION_CACHE_SIZE, SUB_COMPRESSION_MIN_SIZE,
+    [e.strip() for e in SUB_COMPRESSION.split(',') if e.strip()]
+)
+
+
+# Режим чтения: rw - общее соединение с vpn.db (как у бота),
+# ro - read-only соединение с vpn.db, snapshot - снимок, выгружаемый ботом,
+# sharded - свои шарды из локальных файлов, чужие у владельца (api/sharding.py),
+# static_map - mmap карта, которую ведёт бот: одна копия payload на все воркеры.
+# Модули режимов импортируются только когда режим включён - меньше холодный старт
+snapshot_reader = None
+if SUB_READ_MODE == 'snapshot':
+    from api.sub_snapshot import SnapshotReader
+    snapshot_reader = SnapshotReader(SUB_SNAPSHOT_FILE, SUB_SNAPSHOT_MAX_STALENESS)
+
+static_map_reader = None
+if SUB_READ_MODE == 'static_map':
+    from api.static_map import StaticMapReader
+    static_map_reader = StaticMapReader(STATIC_MAP_BASE)
+
+shard_client = None
+shard_stores = {}
+if SUB_READ_MODE == 'sharded':
+    from api.sharding import ShardClient, ShardStore, parse_shards, SECRET_HEADER, FIELDS
+    shard_client = ShardClient(parse_shards(SHARDS), SHARD_SECRET)
+    shard_stores = {name: ShardStore(path) for name, path in parse_shards(SHARD_LOCAL).items()}
+
+
+# Чтение основной БД (когда нет снимка/шардов) - через хранилище api/repository.py
+repository = get_repository(DATABASE_URL, readonly=SUB_READ_MODE != 'rw')
+
+
+# Webhook платёжного провайдера: только подтверждение платежа в основной БД,
+# подписку выдаёт воркер бота (api/payments.py). Запись - не через read-only хранилище
+payment_ledger = None
+if PAYMENT_PROVIDER != 'none' and PAYMENT_WEBHOOK_SECRET:
+    from api.payments import PaymentLedger, get_payment_provider
+    payment_ledger = PaymentLedger(get_repository(DATABASE_URL))
+    payment_provider = get_payment_provider(PAYMENT_PROVIDER, PAYMENT_PROVIDER_URL, PAYMENT_WEBHOOK_SECRET)
+
+# Трафик для Subscription-Userinfo: суммы в памяти, обновляются фоном
+traffic_cache = None
+if TRAFFIC_CACHE_INTERVAL > 0 and SUB_READ_MODE != 'sharded':
+    from api.traffic import TrafficCache
+    traffic_cache = TrafficCache(repository, TRAFFIC_CACHE_INTERVAL)
+
+
+def _lookup_subscription(token):
+    """
+    dict(is_active, expires_at, payload, servers) или None.
+    Промах снимка или карты перепроверяется по vpn.db: подписка могла
+    появиться после выгрузки, а None уходит в негативный кэш
+    """
+    if shard_client is not None:
+        owner = shard_client.owner(token)
+        if owner in shard_stores:
+            return shard_stores[owner].get(token)
+        return shard_client.fetch(token)
+
+    if snapshot_reader is not None:
+        if snapshot_reader.is_fresh():
+            subscription = snapshot_reader.lookup(token)
+            if subscription is not None:
+                return subscription
+        else:
+            logger.warning("Снимок подписок устарел, читаю из БД")
+
+    if static_map_reader is not None:
+        try:
+            subscription = static_map_reader.get(token)
+            if subscription is not None:
+                return subscription
+        except FileNotFoundError:
+            logger.warning("Статической карты ещё нет (бот не выгрузил), читаю из БД")
+
+    return repository.load_subscription(token)
+
+
+def _client_ip():
+    """IP клиента (с учётом прокси, если ему доверяем)"""
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded = request.headers.get('X-Real-IP') or request.headers.get('X-Forwarded-For')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.remote_addr
+
+
+def _too_many_requests(limiter, key):
+    """Дешёвый ответ 429 без обращения к БД"""
+    return Response(
+        'Too many requests',
+        status=429,
+        mimetype='text/plain',
+        headers={'Retry-After': str(limiter.retry_after(key))}
+    )
 
 
 @app.route('/sub/<token>')
 def get_subscription(token):
     """
     Возвращает subscription в формате base64
-    Формат: каждая VLESS ссылка на новой строке, закодировано в base64
+    Формат: каждая VLESS ссылка на новой строке, закодировано в base64.
+    Clash / sing-box - по ?format=clash|singbox или User-Agent клиента
+    (api/sub_formats.py)
     """
-    try:
-        # Получаем подписку по токену
-        conn = vpn_manager._get_connection()
-        cursor = conn.cursor()
+    ip = _client_ip()
+    if not ip_limiter.allow(ip):
+        return _too_many_requests(ip_limiter, ip)
+    if not token_limiter.allow(token):
+        return _too_many_requests(token_limiter, token)
 
-        cursor.execute("""
-            SELECT sub.id, sub.is_active, sub.expires_at
-            FROM subscriptions sub
-            WHERE sub.subscription_token = ?
-        """, (token,))
+    # Известные отсутствующие/просроченные токены отвечаем из кэша
+    status = negative_cache.get(token)
+    if status == MISSING:
+        abort(404, description="Subscription not found")
+    if status == INACTIVE:
+        abort(403, description="Subscription expired")
 
-        result = cursor.fetchone()
+    # Шарды хранят только payload - модели серверов для других форматов там нет
+    fmt = detect_format(request.args.get('format'), request.user_agent.string) if shard_client is None else BASE64
+    if fmt is None:
+        abort(400, description="Unknown format")
 
-        if not result:
+    try:
+        # Получаем подписку по токену (из снимка или из БД)
+        subscription = _lookup_subscription(token)
+
+        if not subscription:
             logger.warning(f"Subscription not found: {token}")
+            # Промах шарда не окончательный: запись могла ещё не дойти до владельца
+            if shard_client is None:
+                negative_cache.add(token, MISSING)
             abort(404, description="Subscription not found")
 
-        subscription = dict(result)
-
         if not subscription['is_active']:
             logger.warning(f"Subscription expired: {token}")
+            negative_cache.add(token, INACTIVE)
             abort(403, description="Subscription expired")
 
-        # Получаем все config_links для этой подписки
-        cursor.execute("""
-            SELECT ss.config_link, srv.name
-            FROM subscription_servers ss
-            JOIN servers srv ON ss.server_id = srv.id
-            WHERE ss.subscription_id = ?
-            ORDER BY srv.name
-        """, (subscription['id'],))
-
-        servers = cursor.fetchall()
-        conn.close()
-
-        if not servers:
+        if not subscription['payload']:
             logger.warning(f"No servers found for subscription: {token}")
             abort(404, description="No servers configured")
 
-        # Формируем список VLESS ссылок
-        vless_links = [dict(s)['config_link'] for s in servers]
-
-        # Объединяем все ссылки через новую строку
-        subscription_content = '\n'.join(vless_links)
-
-        # Кодируем в base64
-        encoded_content = base64.b64encode(subscription_content.encode('utf-8')).decode('utf-8')
-
-        logger.info(f"Subscription served: {token}, servers: {len(vless_links)}")
+        logger.info(f"Subscription served: {token}, servers: {subscription['servers']}")
 
-        # Возвращаем с правильными заголовками
-        return Response(
-            encoded_content,
-            mimetype='text/plain',
-            headers={
-                'Content-Disposition': 'inline; filename="subscription.txt"',
-                'Cache-Control': 'no-cache, no-store, must-revalidate',
-                'Pragma': 'no-cache',
-                'Expires': '0',
-                'Subscription-Userinfo': f'upload=0; download=0; total=0; expire={subscription["expires_at"]}'
-            }
+        headers = response_headers(subscription, traffic_cache.get(token) if traffic_cache else (0, 0))
+        headers['Vary'] = 'Accept-Encoding, User-Agent'
+        encoding = request.accept_encodings.best_match(compressed_payloads.encodings)
+        body, fmt, encoding, digest = compressed_payloads.get(
+            token, subscription['payload'], encoding, fmt, lambda: repository.load_servers(token)
         )
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        mimetype, filename = CONTENT[fmt]
+        headers['Content-Disposition'] = f'inline; filename="{filename}"'
 
+        # Клиент с актуальной копией получает 304 без тела
+        response = Response(body, mimetype=mimetype, headers=headers)
+        response.set_etag(etag(digest, headers, fmt), weak=True)
+        return response.make_conditional(request)
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error serving subscription {token}: {e}")
         abort(500, description="Internal server error")
 
 
+# ============== ВНУТРЕННИЕ ЗАПРОСЫ ШАРДОВ ==============
+
+def _local_shard(name):
+    """Проверяет секрет и возвращает локальный шард"""
+    if shard_client is None:
+        abort(404)
+    if not SHARD_SECRET or not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), SHARD_SECRET):
+        abort(403)
+    store = shard_stores.get(name)
+    if store is None:
+        abort(404, description="Shard is not served here")
+    return store
+
+
+@app.route('/internal/shards/<name>/<token>')
+def shard_get(name, token):
+    """Запись подписки из локального шарда (для проксирования)"""
+    record = _local_shard(name).get(token)
+    if record is None:
+        abort(404)
+    return jsonify(record)
+
+
+@app.route('/internal/shards/<name>', methods=['GET', 'PUT', 'DELETE'])
+def shard_records(name):
+    """Экспорт страницы записей / запись пачки / удаление пачки токенов"""
+    store = _local_shard(name)
+
+    if request.method == 'GET':
+        after = request.args.get('after', '')
+        limit = min(int(request.args.get('limit', 1000)), 10000)
+        return jsonify(store.export(after, limit))
+
+    items = request.get_json(force=True) or []
+    if request.method == 'PUT':
+        store.put_many([(item['token'], {f: item.get(f) for f in FIELDS}) for item in items])
+        for item in items:
+            negative_cache.discard(item['token'])
+    else:
+        store.delete_many(items)
+    return jsonify({'count': len(items)})
+
+
+# ============== ПРОФИЛИРОВАНИЕ ==============
+
+# Маршрут есть только с секретом; пока профилирование не запущено, потоков и хуков нет
+profiler = None
+if PROFILE_SECRET:
+    from api.profiler import SamplingProfiler, SECRET_HEADER as PROFILE_SECRET_HEADER
+    profiler = SamplingProfiler('sub', PROFILE_DIR, PROFILE_INTERVAL)
+
+
+@app.route('/internal/profile', methods=['POST'])
+def profile():
+    """
+    Профилирует процесс ?seconds= секунд (ответ приходит по окончании):
+    сводка горячих точек и SQL в JSON или файл collapsed stacks (?format=folded)
+    """
+    if profiler is None:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get(PROFILE_SECRET_HEADER, ''), PROFILE_SECRET):
+        abort(403)
+    try:
+        seconds = min(float(request.args.get('seconds', PROFILE_SECONDS)), PROFILE_MAX_SECONDS)
+    except ValueError:
+        abort(400, description="Bad seconds")
+    result = profiler.profile(seconds)
+    if result is None:
+        abort(409, description="Profiling is already running")
+    if request.args.get('format') == 'folded':
+        with open(result['file'], encoding='utf-8') as f:
+            return Response(f.read(), mimetype='text/plain')
+    return jsonify(result)
+
+
+# ============== ПЛАТЕЖИ ==============
+
+@app.route('/payments/webhook', methods=['POST'])
+def payment_webhook():
+    """
+    Уведомление провайдера об оплате. Повторные уведомления безопасны:
+    подтверждение идемпотентно, на них тоже отвечаем 200, чтобы провайдер
+    перестал повторять
+    """
+    if payment_ledger is None:
+        abort(404)
+    event = payment_provider.parse_webhook(request.get_data(), request.headers)
+    if event is None:
+        abort(403)
+    if event.get('status') == 'succeeded':
+        confirmed = payment_ledger.confirm(event.get('order_id'), event['id'], event.get('amount'))
+        if confirmed is None:
+            # Неизвестный платёж - пусть провайдер повторит позже
+            abort(404)
+        logger.info(f"Payment {event['id']}: {'confirmed' if confirmed else 'duplicate'}")
+    return {'ok': True}
+
+
 @app.route('/health')
 def health_check():
     """Health check endpoint"""
@@ -115,19 +331,69 @@ def index():
     }
 
 
+def serve_gunicorn(host, port):
+    """
+    gunicorn с gthread воркером: HTTP/1.1 keep-alive (сервер разработки
+    werkzeug закрывает соединение после каждого ответа). Клиенты опрашивают
+    подписку регулярно - повторные запросы идут по тому же соединению без
+    нового TCP рукопожатия; простаивающие соединения ждут в selector'е,
+    не занимая потоки. Кэши процесса (негативный, сжатых payload, трафика)
+    общие для потоков воркера; воркеров больше одного (SUB_HTTP_WORKERS) имеет
+    смысл держать с SUB_READ_MODE=static_map - подписки все читают из одной
+    карты в памяти, а не каждый из SQLite
+    """
+    from gunicorn.app.base import BaseApplication
+
+    def post_worker_init(worker):
+        # Фоновые потоки запускаются в воркере: после fork их бы не было
+        if traffic_cache is not None:
+            traffic_cache.start()
+
+    class SubscriptionApplication(BaseApplication):
+        def load_config(self):
+            for key, value in {
+                'bind': f"{host}:{port}",
+                'workers': SUB_HTTP_WORKERS,
+                'worker_class': 'gthread',
+                'threads': SUB_HTTP_THREADS,
+                'keepalive': SUB_KEEPALIVE_TIMEOUT,
+                'post_worker_init': post_worker_init,
+            }.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    SubscriptionApplication().run()
+
+
 def main():
     """Запуск сервера"""
-    # Инициализируем БД если не существует
-    init_database()
+    # Инициализируем БД если не существует. В режимах sharded и static_map
+    # сервер читает шарды / карту, а схему vpn.db ведёт бот (промах карты
+    # читается из vpn.db только на чтение) - миграции при старте не нужны
+    if SUB_READ_MODE not in ('sharded', 'static_map'):
+        from api.database import init_database
+        init_database()
 
     # Получаем настройки из переменных окружения
     host = os.getenv('SUBSCRIPTION_HOST', '0.0.0.0')
     port = int(os.getenv('SUBSCRIPTION_PORT', 8080))
 
-    logger.info(f"Starting subscription server on {host}:{port}")
+    logger.info(f"Starting subscription server on {host}:{port} ({SUB_HTTP_SERVER})")
+
+    if SUB_HTTP_SERVER == 'gunicorn':
+        try:
+            serve_gunicorn(host, port)
+            return
+        except ImportError:
+            logger.warning("gunicorn не установлен (pip install -r requirements.txt) - сервер werkzeug без keep-alive")
+
+    if traffic_cache is not None:
+        traffic_cache.start()
 
     # Запускаем сервер
-    app.run(host=host, port=port, debug=False)
+    app.run(host=host, port=port, debug=False, threaded=True)
 
 
 if __name__ == '__main__':
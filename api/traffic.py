@@ -0,0 +1,130 @@
+"""
+Учёт трафика клиентов для заголовка Subscription-Userinfo.
+
+Сборщик раз в интервал одним SSH вызовом на узел забирает счётчики
+Xray stats API (user>>>pool_XXXX>>>traffic>>>uplink/downlink, со сбросом),
+опрашивая все узлы параллельно, и одной транзакцией добавляет
+приращения к суммам подписок в traffic_totals. Временные ряды по подпискам
+и серверам пишутся в отдельное хранилище (api/usage_store.py).
+
+Subscription сервер держит суммы по токенам в памяти (TrafficCache)
+и обновляет их фоном одним агрегирующим запросом - на запрос /sub/
+работы с БД не добавляется.
+
+На узлах в конфиге Xray должны быть включены stats, api (dokodemo-door
+на 127.0.0.1:10085) и policy statsUserUplink/statsUserDownlink.
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api.usage_store import KIND_SERVER, KIND_SUBSCRIPTION
+
+logger = logging.getLogger(__name__)
+
+STATS_COMMAND = "xray api statsquery --server=127.0.0.1:10085 -pattern 'user>>>' -reset"
+
+def parse_stats(output):
+    """Вывод statsquery -> {email: [uplink, downlink]}"""
+    usage = {}
+    if not output:
+        return usage
+    for stat in json.loads(output).get('stat', []):
+        parts = stat.get('name', '').split('>>>')
+        if len(parts) != 4 or parts[0] != 'user' or parts[2] != 'traffic':
+            continue
+        value = int(stat.get('value', 0) or 0)
+        if not value:
+            continue
+        counters = usage.setdefault(parts[1], [0, 0])
+        counters[0 if parts[3] == 'uplink' else 1] += value
+    return usage
+
+
+class TrafficCollector:
+    def __init__(self, vpn_manager, command=STATS_COMMAND, workers=16, usage_store=None):
+        self.vpn_manager = vpn_manager
+        self.usage_store = usage_store
+        self.command = command
+        self.workers = workers
+
+    def _query_node(self, server):
+        output, ok = self.vpn_manager._ssh_command(server, self.command)
+        if not ok:
+            logger.warning(f"Не удалось получить статистику с {server['name']}")
+            return {}
+        try:
+            return parse_stats(output)
+        except ValueError as e:
+            logger.error(f"Некорректный ответ статистики {server['name']}: {e}")
+            return {}
+
+    def collect(self, servers=None):
+        """Один проход по всем узлам. Возвращает число обновлённых подписок"""
+        repo = self.vpn_manager.repository
+        if servers is None:
+            servers = repo.active_server_rows()
+        if not servers:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(servers))) as pool:
+            results = list(pool.map(self._query_node, servers))
+
+        # (server_id, email) -> subscription_id для активных подписок
+        mapping = repo.traffic_emails()
+        now = time.time()
+        totals = {}
+        for server, usage in zip(servers, results):
+            server_upload = server_download = 0
+            for email, (upload, download) in usage.items():
+                server_upload += upload
+                server_download += download
+                subscription_id = mapping.get((server['id'], email))
+                if subscription_id is None:
+                    continue
+                counters = totals.setdefault(subscription_id, [0, 0])
+                counters[0] += upload
+                counters[1] += download
+            if self.usage_store is not None and (server_upload or server_download):
+                self.usage_store.add(KIND_SERVER, server['id'], now, server_upload, server_download)
+
+        repo.add_traffic(totals)
+
+        if self.usage_store is not None:
+            for subscription_id, (upload, download) in totals.items():
+                self.usage_store.add(KIND_SUBSCRIPTION, subscription_id, now, upload, download)
+            self.usage_store.flush()
+        return len(totals)
+
+
+class TrafficCache:
+    """Суммарный трафик по токенам в памяти процесса, обновляется фоновым потоком"""
+
+    def __init__(self, repository, interval=60):
+        self.repository = repository
+        self.interval = interval
+        self._usage = {}
+        self._thread = None
+
+    def refresh(self):
+        # Словарь подменяется целиком, читатели не блокируются
+        self._usage = self.repository.traffic_by_token()
+
+    def get(self, token):
+        """(upload, download) в байтах"""
+        return self._usage.get(token, (0, 0))
+
+    def _loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка обновления кэша трафика: {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='traffic-cache', daemon=True)
+            self._thread.start()
@@ -0,0 +1,211 @@
+"""
+Хранилище временных рядов трафика (подписки и серверы).
+
+Отдельный SQLite файл (USAGE_DB_FILE), чтобы ряды не раздували vpn.db.
+Ряд = (kind, key), данные лежат чанками: один BLOB на отрезок времени,
+внутри - отсортированные записи фиксированной ширины (ts, upload, download)
+в array('Q'). Запись принимается поминутно и сразу сворачивается
+в часовые и дневные ряды; у каждого разрешения свой срок хранения.
+Запрос по диапазону читает только пересекающиеся чанки и режет их bisect'ом.
+"""
+import bisect
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+
+KIND_SUBSCRIPTION = 1
+KIND_SERVER = 2
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+
+# разрешение -> (длина чанка, срок хранения) в секундах
+RESOLUTIONS = {
+    MINUTE: (6 * HOUR, 2 * DAY),
+    HOUR: (7 * DAY, 90 * DAY),
+    DAY: (366 * DAY, 3 * 366 * DAY),
+}
+
+RECORD_WIDTH = 3  # ts, upload, download
+
+SCHEMA_VERSION = 1
+
+
+def _unpack(blob):
+    data = array('Q')
+    data.frombytes(blob)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data
+
+
+def _pack(data):
+    if sys.byteorder != 'little':
+        data = array('Q', data)
+        data.byteswap()
+    return data.tobytes()
+
+
+def _merge(data, points):
+    """Добавляет точки {ts: [up, down]} в отсортированный массив записей"""
+    timestamps = data[0::RECORD_WIDTH]
+    if timestamps and min(points) > timestamps[-1]:
+        # Обычный случай: новые точки позже всех существующих
+        for ts in sorted(points):
+            data.extend((ts, points[ts][0], points[ts][1]))
+        return data
+
+    merged = {timestamps[i]: [data[i * RECORD_WIDTH + 1], data[i * RECORD_WIDTH + 2]]
+              for i in range(len(timestamps))}
+    for ts, (upload, download) in points.items():
+        counters = merged.setdefault(ts, [0, 0])
+        counters[0] += upload
+        counters[1] += download
+    result = array('Q')
+    for ts in sorted(merged):
+        result.extend((ts, merged[ts][0], merged[ts][1]))
+    return result
+
+
+class UsageStore:
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._pending = {}
+        self._lock = threading.Lock()
+        conn = self._connect()
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+                return
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS usage_chunks (
+                    kind INTEGER NOT NULL,
+                    key INTEGER NOT NULL,
+                    resolution INTEGER NOT NULL,
+                    chunk_start INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+                    PRIMARY KEY (kind, key, resolution, chunk_start)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_usage_chunks_retention
+                ON usage_chunks (resolution, chunk_start)
+            """)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def add(self, kind, key, ts, upload, download):
+        """Буферизует отсчёт; на диск попадает при flush()"""
+        minute = int(ts) // MINUTE * MINUTE
+        with self._lock:
+            counters = self._pending.setdefault((kind, key, minute), [0, 0])
+            counters[0] += upload
+            counters[1] += download
+
+    def flush(self):
+        """Записывает буфер во все разрешения одной транзакцией. Возвращает число отсчётов"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        # (kind, key, resolution, chunk_start) -> {ts: [up, down]}
+        chunks = {}
+        for (kind, key, minute), (upload, download) in pending.items():
+            for resolution, (span, _) in RESOLUTIONS.items():
+                ts = minute // resolution * resolution
+                points = chunks.setdefault((kind, key, resolution, ts // span * span), {})
+                counters = points.setdefault(ts, [0, 0])
+                counters[0] += upload
+                counters[1] += download
+
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            rows = []
+            for chunk_key, points in chunks.items():
+                cursor.execute("""
+                    SELECT data FROM usage_chunks
+                    WHERE kind = ? AND key = ? AND resolution = ? AND chunk_start = ?
+                """, chunk_key)
+                row = cursor.fetchone()
+                data = _merge(_unpack(row[0]) if row else array('Q'), points)
+                rows.append(chunk_key + (_pack(data),))
+            cursor.executemany("INSERT OR REPLACE INTO usage_chunks VALUES (?, ?, ?, ?, ?)", rows)
+            conn.commit()
+        finally:
+            conn.close()
+        return len(pending)
+
+    def apply_retention(self, now=None):
+        """Удаляет чанки старше срока хранения своего разрешения. Возвращает число чанков"""
+        now = int(now or time.time())
+        removed = 0
+        conn = self._connect()
+        try:
+            for resolution, (span, retention) in RESOLUTIONS.items():
+                cursor = conn.execute("""
+                    DELETE FROM usage_chunks WHERE resolution = ? AND chunk_start < ?
+                """, (resolution, now - retention - span))
+                removed += cursor.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return removed
+
+    @staticmethod
+    def pick_resolution(start, end, now=None):
+        """Самое подробное разрешение, которое ещё хранится и даёт разумное число точек"""
+        now = now or time.time()
+        length = end - start
+        for resolution in (MINUTE, HOUR, DAY):
+            _, retention = RESOLUTIONS[resolution]
+            if start >= now - retention and length / resolution <= 1500:
+                return resolution
+        return DAY
+
+    def query(self, kind, key, start, end, resolution=None):
+        """Точки [(ts, upload, download)] в диапазоне [start, end)"""
+        start, end = int(start), int(end)
+        resolution = resolution or self.pick_resolution(start, end)
+        span = RESOLUTIONS[resolution][0]
+
+        conn = self._connect()
+        try:
+            rows = conn.execute("""
+                SELECT data FROM usage_chunks
+                WHERE kind = ? AND key = ? AND resolution = ?
+                AND chunk_start >= ? AND chunk_start < ?
+                ORDER BY chunk_start
+            """, (kind, key, resolution, start // span * span, end)).fetchall()
+        finally:
+            conn.close()
+
+        points = []
+        for (blob,) in rows:
+            data = _unpack(blob)
+            timestamps = data[0::RECORD_WIDTH]
+            lo = bisect.bisect_left(timestamps, start)
+            hi = bisect.bisect_left(timestamps, end)
+            for i in range(lo, hi):
+                base = i * RECORD_WIDTH
+                points.append((data[base], data[base + 1], data[base + 2]))
+        return points
+
+    def total(self, kind, key, start, end):
+        """(upload, download) за диапазон"""
+        upload = download = 0
+        for _, up, down in self.query(kind, key, start, end):
+            upload += up
+            download += down
+        return upload, download
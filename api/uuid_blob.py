@@ -0,0 +1,49 @@
+"""
+Компактное хранение UUID и токенов подписок в vpn.db.
+
+Канонический UUID ('xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx', нижний регистр)
+хранится 16-байтным BLOB вместо 36-символьного TEXT: строки и индексы
+subscriptions / uuid_pool меньше, сравнение в индексе - 16 байт вместо 36.
+Значения другого вида (UUID пула может быть любой строкой, которую
+принимает Xray) остаются TEXT - SQLite хранит в колонке любой тип,
+поиск остаётся точным.
+
+Преобразование только на краях: параметры запросов (to_db) и прочитанные
+строки (from_db) в api/repository.py, sub_snapshot.py и traffic.py.
+Остальной код работает со строками, как раньше.
+"""
+# Колонки, где лежат значения в формате to_db
+COLUMNS = ('uuid', 'subscription_token')
+
+
+def to_db(value):
+    """Строка -> значение колонки: 16 байт для канонического UUID, иначе сама строка"""
+    # Без uuid.UUID(): преобразование стоит на пути каждого /sub/<token>
+    if (isinstance(value, str) and len(value) == 36
+            and value[8] == value[13] == value[18] == value[23] == '-'):
+        digits = value.replace('-', '')
+        if len(digits) == 32 and (digits.islower() or digits.isdigit()):
+            try:
+                raw = bytes.fromhex(digits)
+            except ValueError:
+                return value
+            if len(raw) == 16:
+                return raw
+    return value
+
+
+def from_db(value):
+    """Значение колонки -> строка"""
+    if isinstance(value, bytes) and len(value) == 16:
+        h = value.hex()
+        return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+    return value
+
+
+def decode_row(row):
+    """dict из строки БД с UUID колонками в виде строк"""
+    data = dict(row)
+    for column in COLUMNS:
+        if column in data:
+            data[column] = from_db(data[column])
+    return data
@@ -1,28 +1,57 @@
 import subprocess
-import json
-import sqlite3
 import uuid as uuid_lib
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
 import sys
 import logging
-import base64
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from bot.config import DB_FILE, XRAY_CONFIG_PATH
+from bot.config import (DATABASE_URL, PLACEMENT_STRATEGY, PLACEMENT_SERVERS_PER_SUB,
+                        SERVER_CATALOG_INTERVAL)
+from api.placement import get_placement_strategy
+from api.repository import get_repository, DATE_FORMAT
+from api.server_catalog import ServerCatalog
+from api.sub_formats import FLOW, SNI, FINGERPRINT
 
 logger = logging.getLogger(__name__)
 
 
+class WriteAborted(Exception):
+    """Операция записи отменена (причина уже записана в лог), транзакция откатывается"""
+
+
 class VPNManager:
-    def __init__(self):
-        self.db_file = DB_FILE
+    def __init__(self, placement=None, write_queue=None, repository=None):
+        # Все запросы - через хранилище (api/repository.py): DATABASE_URL, по умолчанию SQLite
+        self.repository = repository or get_repository(DATABASE_URL, write_queue)
+        # Строки servers - из памяти, перечитываются при смене версии (api/server_catalog.py)
+        self.servers = ServerCatalog(self.repository, SERVER_CATALOG_INTERVAL)
+        self._listeners = []
+        self.placement = placement or get_placement_strategy(PLACEMENT_STRATEGY, PLACEMENT_SERVERS_PER_SUB)
+        # Загрузка канала кандидатов (api/placement.py BandwidthMeter), None - не учитывается
+        self.bandwidth = None
+
+    @property
+    def concurrent_writes(self):
+        """Дают ли параллельные записи выигрыш (очередь с групповым коммитом или PostgreSQL)"""
+        return self.repository.concurrent_writes
+
+    def add_listener(self, callback):
+        """
+        Подписка на события подписок: callback(event, data).
+        События: 'created', 'extended', 'deactivated' (data['subscription_token']),
+        'servers_changed' - у серверов data['server_ids'] сменилась доступность,
+        payload подписок data['subscription_tokens'] надо пересобрать
+        """
+        self._listeners.append(callback)
 
-    def _get_connection(self):
-        """Получить подключение к БД"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
-        return conn
+    def _notify(self, event, **data):
+        """Оповещает подписчиков о событии (ошибки обработчиков не ломают основной путь)"""
+        for callback in self._listeners:
+            try:
+                callback(event, data)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика события {event}: {e}")
 
     def _ssh_command(self, server, command):
         """Выполняет команду на сервере по SSH"""
@@ -40,384 +69,471 @@ class VPNManager:
         """Генерирует UUID"""
         return str(uuid_lib.uuid4())
 
-    def get_available_servers(self):
-        """Получает все доступные серверы с свободными местами"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
+    def _servers_with_load(self, active_only=False):
+        """Серверы каталога с числом активных подписок (current_users)"""
+        loads = self.repository.server_loads()
+        servers = []
+        for server in self.servers.all():
+            if active_only and server['is_active'] != 1:
+                continue
+            server['current_users'] = loads.get(server['id'], 0)
+            servers.append(server)
+        return servers
 
-        try:
-            cursor.execute("""
-                SELECT s.*,
-                    (SELECT COUNT(DISTINCT ss.subscription_id)
-                     FROM subscription_servers ss
-                     JOIN subscriptions sub ON ss.subscription_id = sub.id
-                     WHERE ss.server_id = s.id AND sub.is_active = 1) as current_users
-                FROM servers s
-                WHERE s.is_active = 1
-                AND (SELECT COUNT(DISTINCT ss.subscription_id)
-                     FROM subscription_servers ss
-                     JOIN subscriptions sub ON ss.subscription_id = sub.id
-                     WHERE ss.server_id = s.id AND sub.is_active = 1) < s.max_users
-                ORDER BY current_users ASC
-            """)
-
-            servers = cursor.fetchall()
-            return [dict(server) for server in servers]
-        finally:
-            conn.close()
+    def get_available_servers(self):
+        """Получает все доступные серверы с свободными местами (здоровые, менее загруженные первыми)"""
+        health = self.repository.server_health()
+        servers = [
+            server for server in self._servers_with_load(active_only=True)
+            if server['current_users'] < server['max_users']
+            and health.get(server['id'], {}).get('is_healthy') != 0
+        ]
+        servers.sort(key=lambda server: (server['current_users'], server['id']))
+        return servers
 
     def get_available_server(self):
         """Находит один сервер с свободными местами (для обратной совместимости)"""
         servers = self.get_available_servers()
         return servers[0] if servers else None
 
+    def notify_servers_changed(self, server_ids):
+        """
+        Доступность серверов изменилась (api/health.py): подписки с ними
+        отдают другой набор ссылок - производные хранилища пересобирают их
+        """
+        tokens = self.repository.server_subscription_tokens(server_ids)
+        logger.info(f"Доступность серверов {list(server_ids)} изменилась, подписок к пересборке: {len(tokens)}")
+        self._notify('servers_changed', server_ids=list(server_ids), subscription_tokens=tokens)
+        return tokens
+
+    def get_placement_candidates(self):
+        """Активные доступные серверы с нагрузкой, остатком пула и здоровьем (для стратегии размещения)"""
+        health = self.repository.server_health()
+        pool = self.repository.pool_counts()
+        candidates = []
+        for server in self._servers_with_load(active_only=True):
+            server_health = health.get(server['id'], {})
+            if server_health.get('is_healthy') == 0:
+                continue
+            server['pool_total'], server['pool_free'] = pool.get(server['id'], (0, 0))
+            server['failure_rate'] = server_health.get('failure_rate') or 0
+            server['rtt_ms'] = server_health.get('rtt_ms')
+            candidates.append(server)
+        if self.bandwidth is not None and candidates:
+            util = self.bandwidth.utilization([server['id'] for server in candidates])
+            for server in candidates:
+                server['bandwidth_util'] = util.get(server['id'], 0.0)
+        return candidates
+
     def get_server_by_id(self, server_id):
         """Получает сервер по ID"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute("SELECT * FROM servers WHERE id = ?", (server_id,))
-            server = cursor.fetchone()
-            return dict(server) if server else None
-        finally:
-            conn.close()
+        return self.servers.get(server_id)
 
     def create_vless_link(self, uuid, server, name="VPN"):
         """Создает VLESS ссылку для клиента"""
         return (
             f"vless://{uuid}@{server['ip']}:{server['port']}"
-            f"?encryption=none&flow=xtls-rprx-vision&security=reality"
-            f"&sni=www.microsoft.com&fp=chrome&pbk={server['public_key']}"
+            f"?encryption=none&flow={FLOW}&security=reality"
+            f"&sni={SNI}&fp={FINGERPRINT}&pbk={server['public_key']}"
             f"&type=tcp&headerType=none#{name}"
         )
 
-    def _get_free_uuid_from_pool(self, server_id):
-        """Берёт свободный UUID из пула для сервера"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute("""
-                SELECT id, uuid, email FROM uuid_pool
-                WHERE server_id = ? AND is_used = 0
-                LIMIT 1
-            """, (server_id,))
-
-            row = cursor.fetchone()
-            if row:
-                return dict(row)
-            return None
-        finally:
-            conn.close()
-
     def _mark_uuid_used(self, pool_id):
         """Помечает UUID из пула как использованный"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute("UPDATE uuid_pool SET is_used = 1 WHERE id = ?", (pool_id,))
-            conn.commit()
-        finally:
-            conn.close()
+        self.repository.transaction(lambda conn: self.repository.mark_uuid_used(conn, pool_id))
 
     def _mark_uuid_free(self, uuid_value, server_id):
         """Возвращает UUID в пул (при деактивации подписки)"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute("""
-                UPDATE uuid_pool SET is_used = 0
-                WHERE uuid = ? AND server_id = ?
-            """, (uuid_value, server_id))
-            conn.commit()
-        finally:
-            conn.close()
+        self.repository.transaction(lambda conn: self.repository.release_uuid(conn, uuid_value, server_id))
 
     def get_pool_stats(self):
         """Статистика по пулу UUID"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute("""
-                SELECT s.name, s.id as server_id,
-                    (SELECT COUNT(*) FROM uuid_pool WHERE server_id = s.id) as total,
-                    (SELECT COUNT(*) FROM uuid_pool WHERE server_id = s.id AND is_used = 0) as free,
-                    (SELECT COUNT(*) FROM uuid_pool WHERE server_id = s.id AND is_used = 1) as used
-                FROM servers s
-                WHERE s.is_active = 1
-            """)
-            return [dict(row) for row in cursor.fetchall()]
-        finally:
-            conn.close()
-
-    def create_subscription(self, telegram_id, username, duration_days=30):
+        pool = self.repository.pool_counts()
+        stats = []
+        for server in self.servers.all():
+            if server['is_active'] != 1:
+                continue
+            total, free = pool.get(server['id'], (0, 0))
+            stats.append({'name': server['name'], 'server_id': server['id'],
+                          'total': total, 'free': free, 'used': total - free})
+        return stats
+
+    def create_subscription(self, telegram_id, username, duration_days=30, payment_id=None):
         """
         Создает подписку БЕЗ SSH и БЕЗ перезапуска Xray.
         Берёт свободный UUID из предгенерированного пула.
+        С payment_id подписка создаётся в одной транзакции с отметкой
+        платежа provisioned - повторная выдача по тому же платежу невозможна.
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
-
         try:
-            # Находим все доступные серверы
-            servers = self.get_available_servers()
+            # Выбираем серверы подписки стратегией размещения
+            servers = self.placement.select(self.get_placement_candidates())
             if not servers:
                 logger.error("Нет доступных серверов")
                 return None
 
-            # Проверяем/создаем пользователя
-            cursor.execute("SELECT id FROM users WHERE telegram_id = ?", (telegram_id,))
-            user = cursor.fetchone()
+            result, event = self.repository.transaction(
+                lambda conn: self._create_subscription_tx(conn, servers, telegram_id, username,
+                                                          duration_days, payment_id)
+            )
+        except WriteAborted:
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка создания подписки: {e}")
+            return None
 
-            if not user:
-                cursor.execute(
-                    "INSERT INTO users (telegram_id, username) VALUES (?, ?)",
-                    (telegram_id, username)
-                )
-                user_id = cursor.lastrowid
-            else:
-                user_id = user[0]
+        logger.info(f"Подписка создана для {telegram_id} без SSH/restart!")
+        self._notify('created', **event)
+        return result
 
-            # Берём свободный UUID из пула для первого сервера
-            first_server = servers[0]
-            pool_entry = self._get_free_uuid_from_pool(first_server['id'])
+    def _create_subscription_tx(self, conn, servers, telegram_id, username, duration_days, payment_id):
+        """Записи создания подписки в транзакции conn. Возвращает (результат, данные события)"""
+        repo = self.repository
 
-            if not pool_entry:
-                logger.error(f"Нет свободных UUID в пуле для сервера {first_server['name']}")
-                return None
+        # Проверяем/создаем пользователя
+        user_id, is_new_user = repo.ensure_user(conn, telegram_id, username)
+
+        # Берём свободный UUID из пула для первого сервера
+        first_server = servers[0]
+        pool_entry = repo.take_free_uuid(conn, first_server['id'])
 
-            client_uuid = pool_entry['uuid']
-            subscription_token = self.generate_uuid()
+        if not pool_entry:
+            logger.error(f"Нет свободных UUID в пуле для сервера {first_server['name']}")
+            raise WriteAborted()
 
-            # Создаем подписку
-            expires_at = datetime.now() + timedelta(days=duration_days)
-            cursor.execute("""
-                INSERT INTO subscriptions (user_id, uuid, subscription_token, expires_at)
-                VALUES (?, ?, ?, ?)
-            """, (user_id, client_uuid, subscription_token, expires_at.strftime('%Y-%m-%d %H:%M:%S')))
+        client_uuid = pool_entry['uuid']
+        subscription_token = self.generate_uuid()
 
-            subscription_id = cursor.lastrowid
+        # Создаем подписку
+        expires_at = (datetime.now() + timedelta(days=duration_days)).strftime(DATE_FORMAT)
+        subscription_id = repo.insert_subscription(conn, user_id, client_uuid, subscription_token, expires_at)
 
-            # Назначаем UUID на серверы
-            config_links = []
-            server_names = []
-            used_pool_ids = []
+        # Назначаем UUID на серверы
+        config_links = []
+        server_names = []
+        used_pool_ids = []
 
+        for server in servers:
+            # Для первого сервера используем уже полученный UUID
+            if server['id'] == first_server['id']:
+                pool = pool_entry
+            else:
+                # Для дополнительных серверов ищем тот же UUID в их пуле
+                # (если пулы генерились с одинаковыми UUID на все серверы)
+                # Или берём отдельный свободный UUID
+                pool = repo.take_free_uuid(conn, server['id'])
+                if not pool:
+                    logger.warning(f"Нет свободных UUID для сервера {server['name']}, пропускаю")
+                    continue
+
+            server_name = server['name']
+            server_uuid = pool['uuid'] if server['id'] != first_server['id'] else client_uuid
+            config_link = self.create_vless_link(server_uuid, server, server_name)
+
+            # Сохраняем связь подписка-сервер
+            repo.add_subscription_server(conn, subscription_id, server['id'], config_link, server_uuid)
+
+            config_links.append(config_link)
+            server_names.append(server_name)
+            used_pool_ids.append((pool['id'], server['id']))
+
+            # Сразу помечаем UUID, чтобы следующий сервер/операция пачки его не взяли
+            repo.mark_uuid_used(conn, pool['id'])
+
+        if not config_links:
+            logger.error("Не удалось назначить UUID ни на один сервер")
+            raise WriteAborted()
+
+        if payment_id is not None and not repo.mark_payment_provisioned(conn, payment_id, subscription_id):
+            logger.warning(f"Платёж {payment_id} уже обработан, подписка не создаётся")
+            raise WriteAborted()
+
+        event = {
+            'subscription_id': subscription_id,
+            'subscription_token': subscription_token,
+            'telegram_id': telegram_id,
+            'is_new_user': is_new_user,
+            'expires_at': expires_at,
+            'server_ids': [server_id for _, server_id in used_pool_ids]
+        }
+        result = {
+            'id': subscription_id,
+            'uuid': client_uuid,
+            'subscription_token': subscription_token,
+            'config_links': config_links,
+            'server_names': server_names,
+            'expires_at': expires_at,
+            'config_link': config_links[0] if config_links else None,
+            'server_name': ', '.join(server_names)
+        }
+        return result, event
+
+    def bulk_create_subscriptions(self, rows, chunk_size=1000, skip_active=True):
+        """
+        Массовое создание подписок (перенос клиентов, scripts/bulk_provision.py).
+        rows - итерируемое dict(telegram_id, username, days), читается потоком.
+        Каждые chunk_size строк - одна транзакция: пользователи и связи
+        вставляются пачками, UUID пула берутся одним запросом на сервер,
+        серверы выбираются стратегией размещения по нагрузке, которая
+        учитывает уже распределённые строки пачки.
+
+        Отдаёт по результату на строку в порядке входа: dict(строка,
+        status='created' | 'exists' | 'error', subscription_token,
+        expires_at, error). skip_active - пользователям с активной подпиской
+        новая не создаётся (status='exists', её токен) - повторный запуск
+        после сбоя продолжает импорт без дублей.
+        """
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield from self._bulk_chunk(chunk, skip_active)
+                chunk = []
+        if chunk:
+            yield from self._bulk_chunk(chunk, skip_active)
+
+    def _bulk_chunk(self, rows, skip_active):
+        results = [dict({'status': None, 'subscription_token': None, 'expires_at': None, 'error': None}, **row)
+                   for row in rows]
+        todo = []
+        existing = {}
+        if skip_active:
+            existing = self.repository.active_tokens(row['telegram_id'] for row in rows if not row.get('error'))
+        seen = set()
+        for result in results:
+            if result.get('error'):
+                result['status'] = 'error'
+            elif result['telegram_id'] in existing:
+                result['status'] = 'exists'
+                result['subscription_token'], result['expires_at'] = existing[result['telegram_id']]
+            elif skip_active and result['telegram_id'] in seen:
+                result['status'], result['error'] = 'error', "Повтор telegram_id во входных данных"
+            else:
+                seen.add(result['telegram_id'])
+                todo.append(result)
+        if not todo:
+            return results
+
+        # Серверы для каждой строки: кандидаты читаются один раз на пачку,
+        # нагрузка и остаток пула обновляются в памяти после каждой строки
+        candidates = self.get_placement_candidates()
+        plans = []
+        for result in todo:
+            servers = self.placement.select(candidates)
             for server in servers:
-                # Для первого сервера используем уже полученный UUID
-                if server['id'] == first_server['id']:
-                    pool = pool_entry
-                else:
-                    # Для дополнительных серверов ищем тот же UUID в их пуле
-                    # (если пулы генерились с одинаковыми UUID на все серверы)
-                    # Или берём отдельный свободный UUID
-                    pool = self._get_free_uuid_from_pool(server['id'])
-                    if not pool:
-                        logger.warning(f"Нет свободных UUID для сервера {server['name']}, пропускаю")
-                        continue
-
-                server_name = server['name']
-                config_link = self.create_vless_link(
-                    pool['uuid'] if server['id'] != first_server['id'] else client_uuid,
-                    server,
-                    server_name
-                )
-
-                # Сохраняем связь подписка-сервер
-                cursor.execute("""
-                    INSERT INTO subscription_servers (subscription_id, server_id, config_link)
-                    VALUES (?, ?, ?)
-                """, (subscription_id, server['id'], config_link))
-
-                config_links.append(config_link)
-                server_names.append(server_name)
-                used_pool_ids.append((pool['id'], server['id']))
-
-            if not config_links:
-                logger.error("Не удалось назначить UUID ни на один сервер")
-                conn.rollback()
-                return None
+                server['current_users'] += 1
+                server['pool_free'] -= 1
+            plans.append(servers)
 
-            # Помечаем UUID как использованные
-            for pool_id, _ in used_pool_ids:
-                cursor.execute("UPDATE uuid_pool SET is_used = 1 WHERE id = ?", (pool_id,))
+        try:
+            events = self.repository.transaction(lambda conn: self._bulk_chunk_tx(conn, todo, plans))
+        except Exception as e:
+            logger.error(f"Ошибка массового создания подписок ({len(todo)} строк): {e}")
+            for result in todo:
+                result['status'], result['error'] = 'error', str(e)
+            return results
+
+        for event in events:
+            self._notify('created', **event)
+        logger.info(f"Пачка импорта: создано {len(events)} подписок из {len(rows)} строк")
+        return results
+
+    def _bulk_chunk_tx(self, conn, todo, plans):
+        """Записи пачки в транзакции conn. Заполняет результаты строк, возвращает данные событий 'created'"""
+        repo = self.repository
+        user_ids, new_users = repo.ensure_users(conn, [(result['telegram_id'], result['username'])
+                                                       for result in todo])
+
+        # UUID пула: по одному запросу на сервер сразу на всю пачку
+        needed = {}
+        for servers in plans:
+            for server in servers:
+                needed[server['id']] = needed.get(server['id'], 0) + 1
+        free = {server_id: repo.take_free_uuids(conn, server_id, count) for server_id, count in needed.items()}
+
+        now = datetime.now()
+        links = []
+        used_pool_ids = []
+        events = []
+        for result, servers in zip(todo, plans):
+            if not servers:
+                result['status'], result['error'] = 'error', "Нет доступных серверов"
+                continue
+            assigned = [(server, free[server['id']].pop()) for server in servers if free[server['id']]]
+            if not assigned:
+                result['status'], result['error'] = 'error', "Нет свободных UUID на серверах"
+                continue
+
+            token = self.generate_uuid()
+            expires_at = (now + timedelta(days=result['days'])).strftime(DATE_FORMAT)
+            client_uuid = assigned[0][1]['uuid']
+            subscription_id = repo.insert_subscription(conn, user_ids[result['telegram_id']], client_uuid,
+                                                       token, expires_at)
+            for server, pool in assigned:
+                links.append((subscription_id, server['id'],
+                              self.create_vless_link(pool['uuid'], server, server['name']), pool['uuid']))
+                used_pool_ids.append(pool['id'])
+
+            result.update(status='created', subscription_token=token, expires_at=expires_at)
+            events.append({
+                'subscription_id': subscription_id,
+                'subscription_token': token,
+                'telegram_id': result['telegram_id'],
+                'is_new_user': result['telegram_id'] in new_users,
+                'expires_at': expires_at,
+                'server_ids': [server['id'] for server, _ in assigned]
+            })
+
+        repo.add_subscription_servers(conn, links)
+        repo.mark_uuids_used(conn, used_pool_ids)
+        return events
+
+    def extend_subscription(self, subscription_id, duration_days, payment_id=None):
+        """
+        Продлевает активную подписку на месте: один UPDATE expires_at,
+        токен, UUID и ссылки не меняются (клиентам ничего перенастраивать
+        не нужно, UUID из пула не расходуются). Срок отсчитывается
+        от текущего окончания, а если оно уже прошло - от текущего момента.
+        С payment_id продление и отметка платежа - одна транзакция.
+        """
+        try:
+            sub, old_expires_at = self.repository.transaction(
+                lambda conn: self._extend_subscription_tx(conn, subscription_id, duration_days, payment_id)
+            )
+            servers = self.repository.subscription_servers(subscription_id)
+        except WriteAborted:
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка продления подписки: {e}")
+            return None
 
-            conn.commit()
+        logger.info(f"Подписка {subscription_id} продлена до {sub['expires_at']}")
 
-            logger.info(f"Подписка создана для {telegram_id} без SSH/restart!")
+        self._notify(
+            'extended',
+            subscription_id=subscription_id,
+            subscription_token=sub['subscription_token'],
+            old_expires_at=old_expires_at,
+            expires_at=sub['expires_at'],
+            server_ids=[row['server_id'] for row in servers]
+        )
 
-            return {
-                'uuid': client_uuid,
-                'subscription_token': subscription_token,
-                'config_links': config_links,
-                'server_names': server_names,
-                'expires_at': expires_at.strftime('%Y-%m-%d %H:%M:%S'),
-                'config_link': config_links[0] if config_links else None,
-                'server_name': ', '.join(server_names)
-            }
-        except Exception as e:
-            logger.error(f"Ошибка создания подписки: {e}")
-            conn.rollback()
-            return None
-        finally:
-            conn.close()
+        config_links = [row['config_link'] for row in servers]
+        server_names = [row['server_name'] for row in servers]
+        return {
+            'id': subscription_id,
+            'uuid': sub['uuid'],
+            'subscription_token': sub['subscription_token'],
+            'config_links': config_links,
+            'server_names': server_names,
+            'expires_at': sub['expires_at'],
+            'config_link': config_links[0] if config_links else None,
+            'server_name': ', '.join(server_names),
+            'extended': True
+        }
+
+    def _extend_subscription_tx(self, conn, subscription_id, duration_days, payment_id):
+        """Записи продления в транзакции conn. Возвращает (подписка с новым сроком, прежний expires_at)"""
+        repo = self.repository
+        sub = repo.lock_subscription(conn, subscription_id)
+        if not sub or not sub['is_active']:
+            raise WriteAborted()
+
+        old_expires_at = sub['expires_at']
+        base = max(datetime.strptime(old_expires_at, DATE_FORMAT), datetime.now().replace(microsecond=0))
+        sub['expires_at'] = (base + timedelta(days=int(duration_days))).strftime(DATE_FORMAT)
+        repo.set_expires_at(conn, subscription_id, sub['expires_at'])
+
+        # Напоминания об окончании - заново для нового срока
+        repo.clear_reminders(conn, subscription_id)
+
+        if payment_id is not None and not repo.mark_payment_provisioned(conn, payment_id, subscription_id):
+            logger.warning(f"Платёж {payment_id} уже обработан, подписка не продлевается")
+            raise WriteAborted()
+
+        return sub, old_expires_at
 
     def get_active_subscription(self, telegram_id):
         """Получает активную подписку пользователя со всеми серверами"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute("""
-                SELECT sub.*
-                FROM subscriptions sub
-                JOIN users u ON sub.user_id = u.id
-                WHERE u.telegram_id = ? AND sub.is_active = 1
-                ORDER BY sub.expires_at DESC LIMIT 1
-            """, (telegram_id,))
-
-            result = cursor.fetchone()
-            if not result:
-                return None
+        subscription = self.repository.active_subscription(telegram_id)
+        if not subscription:
+            return None
 
-            subscription = dict(result)
-
-            # Получаем все сервера для этой подписки
-            cursor.execute("""
-                SELECT ss.config_link, srv.name as server_name, srv.ip
-                FROM subscription_servers ss
-                JOIN servers srv ON ss.server_id = srv.id
-                WHERE ss.subscription_id = ?
-                ORDER BY srv.name
-            """, (subscription['id'],))
-
-            servers_data = cursor.fetchall()
-            if servers_data:
-                subscription['config_links'] = [dict(s)['config_link'] for s in servers_data]
-                subscription['server_names'] = [dict(s)['server_name'] for s in servers_data]
-                subscription['config_link'] = subscription['config_links'][0]
-                subscription['server_name'] = ', '.join(subscription['server_names'])
-            else:
-                subscription['config_links'] = []
-                subscription['server_names'] = []
+        # Получаем все сервера для этой подписки
+        servers_data = self.repository.subscription_servers(subscription['id'])
+        if servers_data:
+            subscription['config_links'] = [s['config_link'] for s in servers_data]
+            subscription['server_names'] = [s['server_name'] for s in servers_data]
+            subscription['config_link'] = subscription['config_links'][0]
+            subscription['server_name'] = ', '.join(subscription['server_names'])
+        else:
+            subscription['config_links'] = []
+            subscription['server_names'] = []
 
-            return subscription
-        finally:
-            conn.close()
+        return subscription
 
     def deactivate_subscription(self, subscription_id):
         """Деактивирует подписку и возвращает UUID в пул"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-
         try:
-            # Получаем подписку
-            cursor.execute("SELECT uuid FROM subscriptions WHERE id = ?", (subscription_id,))
-            sub = cursor.fetchone()
-
-            if not sub:
-                return False
-
-            client_uuid = sub['uuid']
-
-            # Получаем все сервера для этой подписки
-            cursor.execute("""
-                SELECT ss.server_id
-                FROM subscription_servers ss
-                WHERE ss.subscription_id = ?
-            """, (subscription_id,))
-
-            server_ids = cursor.fetchall()
-
-            # Возвращаем UUID в пул для каждого сервера
-            for row in server_ids:
-                cursor.execute("""
-                    UPDATE uuid_pool SET is_used = 0
-                    WHERE uuid = ? AND server_id = ?
-                """, (client_uuid, row['server_id']))
-
-            # Деактивируем подписку
-            cursor.execute("UPDATE subscriptions SET is_active = 0 WHERE id = ?", (subscription_id,))
-            conn.commit()
-
-            logger.info(f"Подписка {subscription_id} деактивирована, UUID возвращён в пул")
-            return True
+            event = self.repository.transaction(
+                lambda conn: self._deactivate_subscription_tx(conn, subscription_id)
+            )
+        except WriteAborted:
+            return False
         except Exception as e:
             logger.error(f"Ошибка деактивации: {e}")
-            conn.rollback()
             return False
-        finally:
-            conn.close()
+
+        logger.info(f"Подписка {subscription_id} деактивирована, UUID возвращён в пул")
+        self._notify('deactivated', **event)
+        return True
+
+    def _deactivate_subscription_tx(self, conn, subscription_id):
+        """Записи деактивации в транзакции conn. Возвращает данные события"""
+        repo = self.repository
+
+        # Получаем подписку
+        sub = repo.lock_subscription(conn, subscription_id)
+        if not sub:
+            raise WriteAborted()
+
+        # Возвращаем в пул UUID клиента каждого сервера подписки
+        # (subscription_servers.uuid; у строк до миграции 8 его может не быть -
+        # тогда UUID основного сервера). subscriptions.uuid уникален только
+        # среди активных подписок (миграция 11), так что UUID основного
+        # сервера можно сразу выдать следующей подписке
+        server_uuids = repo.subscription_server_uuids(conn, subscription_id)
+        released_server_ids = [server_id for server_id, uuid_value in server_uuids
+                               if repo.release_uuid(conn, uuid_value or sub['uuid'], server_id)]
+        server_ids = [server_id for server_id, _ in server_uuids]
+
+        # Деактивируем подписку
+        repo.set_inactive(conn, subscription_id)
+
+        return {
+            'subscription_id': subscription_id,
+            'subscription_token': sub['subscription_token'],
+            'was_active': bool(sub['is_active']),
+            'expires_at': sub['expires_at'],
+            'server_ids': server_ids,
+            # Серверы, где UUID действительно вернулся в пул (счётчики api/stats.py)
+            'released_server_ids': released_server_ids
+        }
 
     def check_expired_subscriptions(self):
         """Проверяет и блокирует просроченные подписки"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute("""
-                SELECT id FROM subscriptions
-                WHERE is_active = 1 AND expires_at < datetime('now')
-            """)
-
-            expired = cursor.fetchall()
-            count = 0
-
-            for row in expired:
-                if self.deactivate_subscription(row['id']):
-                    count += 1
-
-            return count
-        finally:
-            conn.close()
+        # datetime('now') в SQLite - UTC
+        now = datetime.now(timezone.utc).strftime(DATE_FORMAT)
+        count = 0
+        for subscription_id in self.repository.expired_subscription_ids(now):
+            if self.deactivate_subscription(subscription_id):
+                count += 1
+        return count
 
     def get_all_servers(self):
         """Получает список всех серверов со статистикой"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute("""
-                SELECT s.*,
-                    (SELECT COUNT(DISTINCT ss.subscription_id)
-                     FROM subscription_servers ss
-                     JOIN subscriptions sub ON ss.subscription_id = sub.id
-                     WHERE ss.server_id = s.id AND sub.is_active = 1) as current_users
-                FROM servers s
-                ORDER BY s.id
-            """)
-            return [dict(row) for row in cursor.fetchall()]
-        finally:
-            conn.close()
+        return self._servers_with_load()
 
     def get_stats(self):
         """Получает общую статистику"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute("SELECT COUNT(*) FROM users")
-            total_users = cursor.fetchone()[0]
-
-            cursor.execute("SELECT COUNT(*) FROM subscriptions WHERE is_active = 1")
-            active_subs = cursor.fetchone()[0]
-
-            cursor.execute("SELECT COUNT(*) FROM servers WHERE is_active = 1")
-            active_servers = cursor.fetchone()[0]
-
-            # Статистика пула
-            cursor.execute("SELECT COUNT(*) FROM uuid_pool WHERE is_used = 0")
-            free_uuids = cursor.fetchone()[0]
-
-            return {
-                'total_users': total_users,
-                'active_subscriptions': active_subs,
-                'active_servers': active_servers,
-                'free_uuids': free_uuids
-            }
-        finally:
-            conn.close()
\ No newline at end of file
+        return self.repository.stats()
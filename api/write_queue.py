@@ -0,0 +1,113 @@
+"""
+Очередь записи в SQLite с групповым коммитом.
+
+Все записи выполняет один поток со своим соединением. Операции,
+пришедшие от параллельных обработчиков за последние max_delay секунд
+(или до max_batch штук), выполняются в одной транзакции и фиксируются
+одним COMMIT - один fsync на пачку вместо одного на операцию.
+
+Операция - функция fn(conn), которая пишет через переданное соединение
+и не вызывает commit/rollback. Каждая операция выполняется в своём
+SAVEPOINT: исключение откатывает только её, остальные операции пачки
+фиксируются. Результат или исключение получает Future вызывающего.
+"""
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class WriteQueue:
+    def __init__(self, db_file, max_delay=0.005, max_batch=256):
+        self.db_file = db_file
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.stats = {'operations': 0, 'commits': 0}
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn):
+        """Ставит операцию в очередь, возвращает concurrent.futures.Future"""
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def execute(self, fn):
+        """Синхронно: дождаться коммита пачки с этой операцией"""
+        return self.submit(fn).result()
+
+    async def run(self, fn):
+        """Для обработчиков бота: не блокирует event loop"""
+        return await asyncio.wrap_future(self.submit(fn))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _connect(self):
+        # isolation_level=None: транзакциями управляем сами (BEGIN/SAVEPOINT/COMMIT)
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _collect(self, first):
+        """Первая операция + всё, что придёт за max_delay (но не больше max_batch)"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = self._collect(first)
+            results = []
+
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for fn, future in batch:
+                    conn.execute("SAVEPOINT op")
+                    try:
+                        results.append((future, fn(conn), None))
+                        conn.execute("RELEASE op")
+                    except BaseException as e:
+                        conn.execute("ROLLBACK TO op")
+                        conn.execute("RELEASE op")
+                        results.append((future, None, e))
+                conn.execute("COMMIT")
+            except Exception as e:
+                logger.error(f"Ошибка группового коммита ({len(batch)} операций): {e}")
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.stats['operations'] += len(batch)
+            self.stats['commits'] += 1
+            # Результаты отдаём только после COMMIT: вызывающий видит уже зафиксированные данные
+            for future, result, error in results:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+        conn.close()
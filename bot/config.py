@@ -11,7 +11,10 @@ ADMIN_TELEGRAM_ID = int(os.getenv('ADMIN_TELEGRAM_ID', 0))
 XRAY_CONFIG_PATH = '/usr/local/etc/xray/config.json'
 
 # Database
-DB_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'vpn.db')
+DB_FILE = os.getenv('DB_FILE', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'vpn.db'))
+# Хранилище бота и subscription сервера (api/repository.py): путь к SQLite или
+# postgresql://... (нужен pip install "psycopg[binary]"), по умолчанию - DB_FILE
+DATABASE_URL = os.getenv('DATABASE_URL') or DB_FILE
 
 # Pricing
 PRICES = {
@@ -21,8 +24,124 @@ PRICES = {
     '12_months': 2500
 }
 
+PLAN_DAYS = {
+    '1_month': 30,
+    '3_months': 90,
+    '6_months': 180,
+    '12_months': 365
+}
+
 # Server limits
 MAX_USERS_PER_SERVER = 60
 
 # Subscription URL (замените на ваш домен)
-SUBSCRIPTION_URL_BASE = os.getenv('SUBSCRIPTION_URL_BASE', 'https://your-domain.com/sub')
\ No newline at end of file
+SUBSCRIPTION_URL_BASE = os.getenv('SUBSCRIPTION_URL_BASE', 'https://your-domain.com/sub')
+
+# Subscription server: негативный кэш токенов (несуществующие/просроченные)
+NEGATIVE_CACHE_SIZE = int(os.getenv('NEGATIVE_CACHE_SIZE', 100000))
+NEGATIVE_CACHE_TTL = int(os.getenv('NEGATIVE_CACHE_TTL', 600))
+
+# Subscription server: ограничение частоты запросов (запросов в секунду / размер всплеска)
+RATE_LIMIT_IP_RATE = float(os.getenv('RATE_LIMIT_IP_RATE', 2))
+RATE_LIMIT_IP_BURST = int(os.getenv('RATE_LIMIT_IP_BURST', 30))
+RATE_LIMIT_TOKEN_RATE = float(os.getenv('RATE_LIMIT_TOKEN_RATE', 0.2))
+RATE_LIMIT_TOKEN_BURST = int(os.getenv('RATE_LIMIT_TOKEN_BURST', 10))
+# Брать IP клиента из X-Real-IP / X-Forwarded-For (если сервер за nginx)
+RATE_LIMIT_TRUST_PROXY = os.getenv('RATE_LIMIT_TRUST_PROXY', '0') == '1'
+
+# Subscription server: сжатие payload (через запятую в порядке предпочтения, пусто = без сжатия;
+# br - пакет brotli из requirements.txt), сколько подписок держать сжатыми и минимальный размер для сжатия
+SUB_COMPRESSION = os.getenv('SUB_COMPRESSION', 'br,gzip')
+SUB_COMPRESSION_CACHE_SIZE = int(os.getenv('SUB_COMPRESSION_CACHE_SIZE', 10000))
+SUB_COMPRESSION_MIN_SIZE = int(os.getenv('SUB_COMPRESSION_MIN_SIZE', 512))
+# Subscription server: HTTP сервер (gunicorn из requirements.txt - keep-alive;
+# werkzeug - сервер разработки Flask, соединение на запрос), процессы-воркеры gunicorn,
+# потоки обработки в воркере и сколько держать простаивающее keep-alive соединение (секунды)
+SUB_HTTP_SERVER = os.getenv('SUB_HTTP_SERVER', 'gunicorn')
+SUB_HTTP_WORKERS = int(os.getenv('SUB_HTTP_WORKERS', 1))
+SUB_HTTP_THREADS = int(os.getenv('SUB_HTTP_THREADS', 32))
+SUB_KEEPALIVE_TIMEOUT = int(os.getenv('SUB_KEEPALIVE_TIMEOUT', 75))
+
+# Админ панель: период полного пересчёта снимка статистики (секунды)
+STATS_REFRESH_INTERVAL = int(os.getenv('STATS_REFRESH_INTERVAL', 300))
+
+# Subscription server: режим чтения БД (rw / ro / snapshot / sharded / static_map)
+SUB_READ_MODE = os.getenv('SUB_READ_MODE', 'rw')
+# Снимок token -> payload, который выгружает бот (0 = не выгружать)
+SUB_SNAPSHOT_FILE = os.getenv('SUB_SNAPSHOT_FILE', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sub_snapshot.db'))
+SUB_SNAPSHOT_INTERVAL = int(os.getenv('SUB_SNAPSHOT_INTERVAL', 0))
+# Если снимок старше этого значения (секунды), сервер читает из vpn.db
+SUB_SNAPSHOT_MAX_STALENESS = int(os.getenv('SUB_SNAPSHOT_MAX_STALENESS', 120))
+
+# Статическая карта token -> payload (mmap), которую ведёт бот: для scripts/serve_static_map.py
+# и SUB_READ_MODE=static_map (общая для всех воркеров), пусто = выключено
+STATIC_MAP_BASE = os.getenv('STATIC_MAP_BASE', '')
+
+# Шардирование (SUB_READ_MODE=sharded): кольцо шардов name=url, локальные шарды name=path
+SHARDS = os.getenv('SHARDS', '')
+SHARD_LOCAL = os.getenv('SHARD_LOCAL', '')
+SHARD_SECRET = os.getenv('SHARD_SECRET', '')
+
+# Размещение подписок: all - все серверы (как раньше), load_aware - с учётом нагрузки
+PLACEMENT_STRATEGY = os.getenv('PLACEMENT_STRATEGY', 'all')
+# Сколько серверов выдавать в одной подписке при load_aware (0 = все подходящие)
+PLACEMENT_SERVERS_PER_SUB = int(os.getenv('PLACEMENT_SERVERS_PER_SUB', 0))
+# load_aware: за сколько последних секунд трафика серверов считать загрузку канала
+# (нужен сбор трафика TRAFFIC_COLLECT_INTERVAL > 0, иначе канал не учитывается)
+PLACEMENT_BANDWIDTH_WINDOW = int(os.getenv('PLACEMENT_BANDWIDTH_WINDOW', 900))
+# Как часто (секунды) процесс сверяет версию каталога серверов в памяти с БД
+SERVER_CATALOG_INTERVAL = float(os.getenv('SERVER_CATALOG_INTERVAL', 2))
+
+# Проверка доступности серверов: период (секунды, 0 = выключено), режим tcp / tls, таймаут
+HEALTH_PROBE_INTERVAL = int(os.getenv('HEALTH_PROBE_INTERVAL', 0))
+HEALTH_PROBE_MODE = os.getenv('HEALTH_PROBE_MODE', 'tcp')
+HEALTH_PROBE_TIMEOUT = float(os.getenv('HEALTH_PROBE_TIMEOUT', 3))
+
+# Учёт трафика: период сбора с узлов (секунды, 0 = выключено) и команда Xray stats API на узле
+TRAFFIC_COLLECT_INTERVAL = int(os.getenv('TRAFFIC_COLLECT_INTERVAL', 0))
+TRAFFIC_STATS_COMMAND = os.getenv(
+    'TRAFFIC_STATS_COMMAND',
+    "xray api statsquery --server=127.0.0.1:10085 -pattern 'user>>>' -reset"
+)
+# Subscription server: период обновления кэша трафика для Subscription-Userinfo
+TRAFFIC_CACHE_INTERVAL = int(os.getenv('TRAFFIC_CACHE_INTERVAL', 60))
+
+# Временные ряды трафика (api/usage_store.py) - отдельный файл рядом с vpn.db
+USAGE_DB_FILE = os.getenv('USAGE_DB_FILE', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'usage.db'))
+
+# Напоминания об окончании подписки: период прохода (секунды, 0 = выключено)
+# и лимиты Telegram (сообщений в секунду: всего / в один чат)
+REMINDER_INTERVAL = int(os.getenv('REMINDER_INTERVAL', 0))
+REMINDER_GLOBAL_RATE = float(os.getenv('REMINDER_GLOBAL_RATE', 25))
+REMINDER_PER_CHAT_RATE = float(os.getenv('REMINDER_PER_CHAT_RATE', 1))
+
+# Платежи: провайдер (none - без оплаты, подписка сразу; fake - scripts/fake_payment_provider.py),
+# его адрес и секрет подписи webhook'ов (webhook принимает subscription сервер: /payments/webhook)
+PAYMENT_PROVIDER = os.getenv('PAYMENT_PROVIDER', 'none')
+PAYMENT_PROVIDER_URL = os.getenv('PAYMENT_PROVIDER_URL', 'http://127.0.0.1:8090')
+PAYMENT_WEBHOOK_SECRET = os.getenv('PAYMENT_WEBHOOK_SECRET', '')
+# Выдача подписок по оплаченным платежам: период опроса outbox (секунды) и размер пачки
+PAYMENT_WORKER_INTERVAL = float(os.getenv('PAYMENT_WORKER_INTERVAL', 2))
+PAYMENT_WORKER_BATCH = int(os.getenv('PAYMENT_WORKER_BATCH', 100))
+
+# Групповой коммит записей бота (api/write_queue.py): сколько ждать (секунды)
+# параллельные записи перед общим COMMIT, 0 = каждая запись своим коммитом
+WRITE_QUEUE_DELAY = float(os.getenv('WRITE_QUEUE_DELAY', 0.005))
+
+# Резервные копии vpn.db (api/backup.py, scripts/backup.sh): каталог, бэкапов в цепочке
+# до нового полного, сколько полных цепочек хранить, шаг копирования (страниц) и пауза
+# между шагами (секунды) - чем меньше шаг и больше пауза, тем меньше задержка записей бота
+BACKUP_DIR = os.getenv('BACKUP_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'backups'))
+BACKUP_FULL_EVERY = int(os.getenv('BACKUP_FULL_EVERY', 24))
+BACKUP_KEEP_FULL = int(os.getenv('BACKUP_KEEP_FULL', 7))
+BACKUP_STEP_PAGES = int(os.getenv('BACKUP_STEP_PAGES', 64))
+BACKUP_STEP_SLEEP = float(os.getenv('BACKUP_STEP_SLEEP', 0.005))
+
+# Профилирование по запросу (api/profiler.py): каталог файлов .folded, длительность
+# по кнопке в админ панели и максимум для /internal/profile (секунды), период сэмплов
+# (секунды) и секрет заголовка X-Profile-Secret subscription сервера (пусто = маршрут выключен)
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'profiles'))
+PROFILE_SECONDS = int(os.getenv('PROFILE_SECONDS', 30))
+PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', 300))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+PROFILE_SECRET = os.getenv('PROFILE_SECRET', '')
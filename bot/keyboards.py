@@ -32,7 +32,8 @@ def admin_menu():
     keyboard = [
         [InlineKeyboardButton("Статистика", callback_data="admin_stats")],
         [InlineKeyboardButton("Сервера", callback_data="admin_servers")],
-        [InlineKeyboardButton("Проверить просроченные", callback_data="admin_check_expired")]
+        [InlineKeyboardButton("Проверить просроченные", callback_data="admin_check_expired")],
+        [InlineKeyboardButton("Профилирование", callback_data="admin_profile")]
     ]
     return InlineKeyboardMarkup(keyboard)
 
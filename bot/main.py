@@ -1,8 +1,10 @@
+import asyncio
 import logging
 import sys
 import os
+import time
 from datetime import datetime
-from telegram import Update
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -14,10 +16,21 @@ from telegram.ext import (
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from bot.config import TELEGRAM_BOT_TOKEN, ADMIN_TELEGRAM_ID, SUBSCRIPTION_URL_BASE
+from bot.config import (
+    TELEGRAM_BOT_TOKEN, ADMIN_TELEGRAM_ID, SUBSCRIPTION_URL_BASE, STATS_REFRESH_INTERVAL,
+    DB_FILE, DATABASE_URL, SUB_SNAPSHOT_FILE, SUB_SNAPSHOT_INTERVAL, STATIC_MAP_BASE,
+    SHARDS, SHARD_SECRET, HEALTH_PROBE_INTERVAL, HEALTH_PROBE_MODE, HEALTH_PROBE_TIMEOUT,
+    TRAFFIC_COLLECT_INTERVAL, TRAFFIC_STATS_COMMAND, USAGE_DB_FILE,
+    PLACEMENT_STRATEGY, PLACEMENT_BANDWIDTH_WINDOW,
+    REMINDER_INTERVAL, REMINDER_GLOBAL_RATE, REMINDER_PER_CHAT_RATE,
+    PRICES, PLAN_DAYS, PAYMENT_PROVIDER, PAYMENT_PROVIDER_URL, PAYMENT_WEBHOOK_SECRET,
+    PAYMENT_WORKER_INTERVAL, PAYMENT_WORKER_BATCH, WRITE_QUEUE_DELAY,
+    PROFILE_DIR, PROFILE_SECONDS, PROFILE_INTERVAL
+)
 from bot.keyboards import main_menu, buy_subscription_menu, admin_menu, servers_menu
 from api.vpn_manager import VPNManager
 from api.database import init_database
+from api.repository import sqlite_path
 
 # Настройка логирования
 logging.basicConfig(
@@ -26,8 +39,82 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Инициализация
-vpn_manager = VPNManager()
+# Инициализация: хранилище DATABASE_URL, групповой коммит - только для SQLite
+write_queue = None
+if WRITE_QUEUE_DELAY > 0 and sqlite_path(DATABASE_URL):
+    from api.write_queue import WriteQueue
+    write_queue = WriteQueue(sqlite_path(DATABASE_URL), max_delay=WRITE_QUEUE_DELAY)
+vpn_manager = VPNManager(write_queue=write_queue)
+if PLACEMENT_STRATEGY == 'load_aware' and TRAFFIC_COLLECT_INTERVAL > 0:
+    # Загрузка канала для размещения - из рядов трафика серверов, которые собирает бот
+    from api.placement import BandwidthMeter
+    vpn_manager.bandwidth = BandwidthMeter(lambda: get_usage_store(), PLACEMENT_BANDWIDTH_WINDOW)
+# Снимок статистики (api/stats.py) и платежи (api/payments.py) создаёт post_init:
+# их модули импортируются при запуске бота, а не при импорте bot.main
+stats_snapshot = None
+_usage_store = None
+
+# Платежи: журнал, провайдер и выдача подписок по outbox
+payment_ledger = None
+payment_provider = None
+provisioning_worker = None
+payments_changed = asyncio.Event()
+
+# Профилирование по кнопке админа: создаётся при первом нажатии, до запуска потоков и хуков нет
+_profiler = None
+
+
+def get_usage_store():
+    """
+    Хранилище трафика открывается при первом обращении, а не при импорте.
+    None, если сбор трафика выключен (TRAFFIC_COLLECT_INTERVAL = 0): usage.db не создаётся
+    """
+    global _usage_store
+    if _usage_store is None and TRAFFIC_COLLECT_INTERVAL > 0:
+        from api.usage_store import UsageStore
+        _usage_store = UsageStore(USAGE_DB_FILE)
+    return _usage_store
+
+
+def subscription_traffic(subscription_id):
+    """(байт за 24 часа, байт за 30 дней) или None без учёта трафика. Читает usage.db - из потока"""
+    usage_store = get_usage_store()
+    if usage_store is None:
+        return None
+    from api.usage_store import KIND_SUBSCRIPTION
+
+    now = time.time()
+    return (sum(usage_store.total(KIND_SUBSCRIPTION, subscription_id, now - 86400, now)),
+            sum(usage_store.total(KIND_SUBSCRIPTION, subscription_id, now - 30 * 86400, now)))
+
+
+def servers_traffic(server_ids):
+    """{server_id: байт за 24 часа} или None без учёта трафика. Читает usage.db - из потока"""
+    usage_store = get_usage_store()
+    if usage_store is None:
+        return None
+    from api.usage_store import KIND_SERVER
+
+    now = time.time()
+    return {server_id: sum(usage_store.total(KIND_SERVER, server_id, now - 86400, now))
+            for server_id in server_ids}
+
+
+def get_profiler():
+    global _profiler
+    if _profiler is None:
+        from api.profiler import SamplingProfiler
+        _profiler = SamplingProfiler('bot', PROFILE_DIR, PROFILE_INTERVAL)
+    return _profiler
+
+
+def format_bytes(value):
+    """Байты в читаемый вид"""
+    for unit in ('Б', 'КБ', 'МБ', 'ГБ'):
+        if value < 1024:
+            return f"{value:.0f} {unit}" if unit == 'Б' else f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} ТБ"
 
 
 # ============== КОМАНДЫ ==============
@@ -166,13 +253,18 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     days_left = max(0, (expires_at - datetime.now()).days)
     days_used = (datetime.now() - created_at).days
 
+    traffic = await asyncio.to_thread(subscription_traffic, subscription['id'])
+    traffic_text = (f"\n\nТрафик за 24 часа: {format_bytes(traffic[0])}\n"
+                    f"Трафик за 30 дней: {format_bytes(traffic[1])}") if traffic else ""
+
     await update.message.reply_text(
         f"Ваша статистика:\n\n"
         f"Статус: Активна\n"
         f"Сервер: {subscription.get('server_name', 'N/A')}\n"
         f"Подписка до: {expires_at.strftime('%d.%m.%Y')}\n"
         f"Осталось дней: {days_left}\n"
-        f"Использовано дней: {days_used}",
+        f"Использовано дней: {days_used}"
+        f"{traffic_text}",
         reply_markup=main_menu()
     )
 
@@ -203,76 +295,69 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Покупка подписки
     if data.startswith("buy_"):
+        from api.payments import InstantProvider, PENDING
+
         plan = data.replace("buy_", "")
         username = query.from_user.username
+        if plan not in PLAN_DAYS:
+            return
+
+        # Повторное нажатие на то же меню (или повторная доставка callback)
+        # даёт тот же ключ и тот же платёж
+        idempotency_key = f"buy:{telegram_id}:{query.message.message_id}:{plan}"
+        payment = await asyncio.to_thread(
+            payment_ledger.create, idempotency_key, telegram_id, username,
+            plan, PRICES[plan], PLAN_DAYS[plan], payment_provider.name
+        )
+        if payment['status'] != PENDING:
+            return
 
-        plan_days = {
-            "1_month": 30,
-            "3_months": 90,
-            "6_months": 180,
-            "12_months": 365
-        }
-
-        days = plan_days.get(plan, 30)
-
-        await query.edit_message_text("Создаю подписку...")
-
-        result = vpn_manager.create_subscription(telegram_id, username, days)
-
-        if result:
-            expires_date = datetime.strptime(result['expires_at'], '%Y-%m-%d %H:%M:%S')
-            subscription_url = f"{SUBSCRIPTION_URL_BASE}/{result['subscription_token']}"
-
-            message = (
-                f"✅ <b>Подписка активирована!</b>\n\n"
-                f"📦 Тариф: {get_plan_name(plan)}\n"
-                f"📡 Серверы: {result.get('server_name', 'N/A')}\n"
-                f"📅 Действует до: {expires_date.strftime('%d.%m.%Y %H:%M')}\n\n"
-                f"<b>🔗 Subscription URL (рекомендуется):</b>\n"
-                f"<code>{subscription_url}</code>\n\n"
-                f"Этот URL автоматически добавит ВСЕ серверы в ваше приложение.\n"
-                f"Вы сможете переключаться между ними в один клик!\n\n"
-                f"<b>Как использовать:</b>\n"
-                f"1. Скопируйте ссылку выше\n"
-                f"2. В приложении (v2rayTUN/Happ/v2rayNG) нажмите +\n"
-                f"3. Выберите 'Import from clipboard' или вставьте URL\n"
-                f"4. Готово! Все серверы добавлены\n\n"
-                f"📖 Подробная инструкция: /start -> Инструкция"
-            )
-
-            # Добавляем отдельные ключи для ручного добавления
-            if result.get('config_links'):
-                message += "\n\n<b>Или добавьте серверы вручную:</b>\n"
-                for i, (link, name) in enumerate(zip(result['config_links'], result['server_names']), 1):
-                    message += f"\n{i}. {name}:\n<code>{link}</code>\n"
-
-            await query.edit_message_text(message, parse_mode='HTML')
-        else:
-            await query.edit_message_text(
-                "Ошибка создания подписки.\n\n"
-                "Возможно нет доступных серверов.\n"
-                "Обратитесь в поддержку."
-            )
+        if payment_provider.name == InstantProvider.name:
+            await query.edit_message_text("Создаю подписку...")
+            await asyncio.to_thread(payment_ledger.confirm, payment['id'])
+            payments_changed.set()
+            return
+
+        try:
+            provider_payment_id, pay_url = await asyncio.to_thread(payment_provider.create_checkout, payment)
+            await asyncio.to_thread(payment_ledger.attach_provider_id, payment['id'], provider_payment_id)
+        except Exception as e:
+            logger.error(f"Ошибка создания платежа {payment['id']}: {e}")
+            await query.edit_message_text("Платёжная система недоступна, попробуйте позже.")
+            return
+
+        await query.edit_message_text(
+            f"Тариф: {get_plan_name(plan)}\n"
+            f"К оплате: {payment['amount']} руб\n\n"
+            f"После оплаты подписка придёт отдельным сообщением.",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Оплатить", url=pay_url)]])
+        )
 
     # Админ команды
     elif data == "admin_stats":
         if telegram_id != ADMIN_TELEGRAM_ID:
             return
 
-        stats = vpn_manager.get_stats()
-        servers = vpn_manager.get_all_servers()
+        stats = await asyncio.to_thread(stats_snapshot.get)
+        traffic = await asyncio.to_thread(servers_traffic, [s['id'] for s in stats['servers']])
 
         servers_info = "\n".join([
-            f"  {s['name']}: {s['current_users']}/{s['max_users']}"
-            for s in servers
+            f"  {s['name']}: {s['current_users']}/{s['max_users']}, "
+            f"пул {s['pool_free']}/{s['pool_total']}"
+            + (f", 24ч {format_bytes(traffic[s['id']])}" if traffic is not None else "")
+            for s in stats['servers']
         ]) or "  Нет серверов"
 
         await query.edit_message_text(
             f"Статистика:\n\n"
             f"Всего пользователей: {stats['total_users']}\n"
             f"Активных подписок: {stats['active_subscriptions']}\n"
-            f"Серверов: {stats['active_servers']}\n\n"
-            f"Сервера:\n{servers_info}",
+            f"Истекают за 24ч: {stats['expiring_24h']}\n"
+            f"Истекают за 7д: {stats['expiring_7d']}\n"
+            f"Серверов: {stats['active_servers']}\n"
+            f"Свободных UUID: {stats['free_uuids']}\n\n"
+            f"Сервера:\n{servers_info}\n\n"
+            f"Обновлено: {stats['updated_at']}",
             reply_markup=admin_menu()
         )
 
@@ -297,6 +382,20 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=admin_menu()
         )
 
+    elif data == "admin_profile":
+        if telegram_id != ADMIN_TELEGRAM_ID:
+            return
+
+        if get_profiler().running:
+            await query.edit_message_text("Профилирование уже идёт", reply_markup=admin_menu())
+            return
+        await query.edit_message_text(
+            f"Профилирование бота: {PROFILE_SECONDS}с, результат придёт отдельным сообщением",
+            reply_markup=admin_menu()
+        )
+        # Обработчик не ждёт: обновления обрабатываются по одному
+        context.application.create_task(send_profile(context.bot, telegram_id))
+
     elif data == "back_to_menu":
         await query.message.delete()
 
@@ -307,6 +406,61 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+async def send_profile(bot, chat_id):
+    """Профилирует процесс бота PROFILE_SECONDS секунд и отправляет сводку и файл .folded"""
+    try:
+        from api.profiler import format_summary
+
+        result = await asyncio.to_thread(get_profiler().profile, PROFILE_SECONDS)
+        if result is None:
+            return
+        await bot.send_message(chat_id, f"Профилирование бота\n\n{format_summary(result)}")
+        with open(result['file'], 'rb') as f:
+            await bot.send_document(chat_id, f, filename=os.path.basename(result['file']))
+    except Exception as e:
+        logger.error(f"Ошибка профилирования: {e}")
+
+
+def subscription_message(result, plan):
+    """Сообщение о выданной подписке"""
+    expires_date = datetime.strptime(result['expires_at'], '%Y-%m-%d %H:%M:%S')
+    subscription_url = f"{SUBSCRIPTION_URL_BASE}/{result['subscription_token']}"
+
+    if result.get('extended'):
+        # Токен и ссылки прежние - в приложении ничего менять не нужно
+        return (
+            f"✅ <b>Подписка продлена!</b>\n\n"
+            f"📦 Тариф: {get_plan_name(plan)}\n"
+            f"📅 Действует до: {expires_date.strftime('%d.%m.%Y %H:%M')}\n\n"
+            f"Ссылка подписки прежняя, в приложении ничего менять не нужно:\n"
+            f"<code>{subscription_url}</code>"
+        )
+
+    message = (
+        f"✅ <b>Подписка активирована!</b>\n\n"
+        f"📦 Тариф: {get_plan_name(plan)}\n"
+        f"📡 Серверы: {result.get('server_name', 'N/A')}\n"
+        f"📅 Действует до: {expires_date.strftime('%d.%m.%Y %H:%M')}\n\n"
+        f"<b>🔗 Subscription URL (рекомендуется):</b>\n"
+        f"<code>{subscription_url}</code>\n\n"
+        f"Этот URL автоматически добавит ВСЕ серверы в ваше приложение.\n"
+        f"Вы сможете переключаться между ними в один клик!\n\n"
+        f"<b>Как использовать:</b>\n"
+        f"1. Скопируйте ссылку выше\n"
+        f"2. В приложении (v2rayTUN/Happ/v2rayNG) нажмите +\n"
+        f"3. Выберите 'Import from clipboard' или вставьте URL\n"
+        f"4. Готово! Все серверы добавлены\n\n"
+        f"📖 Подробная инструкция: /start -> Инструкция"
+    )
+
+    # Добавляем отдельные ключи для ручного добавления
+    if result.get('config_links'):
+        message += "\n\n<b>Или добавьте серверы вручную:</b>\n"
+        for i, (link, name) in enumerate(zip(result['config_links'], result['server_names']), 1):
+            message += f"\n{i}. {name}:\n<code>{link}</code>\n"
+    return message
+
+
 def get_plan_name(plan):
     """Получить название тарифа"""
     names = {
@@ -337,8 +491,234 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handler(update, context)
 
 
+# ============== ФОНОВЫЕ ЗАДАЧИ ==============
+
+async def refresh_stats_loop():
+    """Периодически пересчитывает снимок статистики для админ панели"""
+    while True:
+        try:
+            await asyncio.to_thread(stats_snapshot.refresh)
+        except Exception as e:
+            logger.error(f"Ошибка обновления статистики: {e}")
+        await asyncio.sleep(STATS_REFRESH_INTERVAL)
+
+
+async def export_snapshot_loop():
+    """
+    Выгружает снимок token -> payload для subscription сервера.
+    После создания/деактивации подписки снимок выгружается сразу,
+    иначе раз в SUB_SNAPSHOT_INTERVAL секунд.
+    """
+    from api.sub_snapshot import export_snapshot
+
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+
+    def on_subscription_event(event, data):
+        loop.call_soon_threadsafe(changed.set)
+
+    vpn_manager.add_listener(on_subscription_event)
+
+    while True:
+        changed.clear()
+        try:
+            await asyncio.to_thread(export_snapshot, DB_FILE, SUB_SNAPSHOT_FILE)
+        except Exception as e:
+            logger.error(f"Ошибка выгрузки снимка подписок: {e}")
+        try:
+            await asyncio.wait_for(changed.wait(), timeout=SUB_SNAPSHOT_INTERVAL)
+            # Даём накопиться пачке изменений
+            await asyncio.sleep(1)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def start_static_map():
+    """
+    Полная выгрузка статической карты при старте,
+    дальше - инкрементальные обновления по событиям подписок
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from api.static_map import export_static_map
+
+    loop = asyncio.get_running_loop()
+    # Записи с fsync уводим из event loop в один поток: обновления и полная
+    # перевыгрузка после ошибки применяются к карте по очереди
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='static-map')
+    state = {
+        'writer': await loop.run_in_executor(executor, export_static_map, DB_FILE, STATIC_MAP_BASE),
+        'reexport': False
+    }
+
+    def reexport():
+        old_writer = state['writer']
+        state['writer'] = export_static_map(DB_FILE, STATIC_MAP_BASE)
+        old_writer.close()
+
+    def on_reexported(future):
+        state['reexport'] = False
+        if future.exception() is not None:
+            logger.error(f"Ошибка выгрузки статической карты: {future.exception()}, повтор через 30с")
+            loop.call_later(30, request_reexport)
+
+    def request_reexport():
+        # Обновления, поставленные до перевыгрузки, она и так покрывает
+        if not state['reexport']:
+            state['reexport'] = True
+            loop.run_in_executor(executor, reexport).add_done_callback(on_reexported)
+
+    def on_updated(future):
+        # Карта осталась без изменения подписки - выгружаем её заново целиком
+        if future.exception() is not None:
+            logger.error(f"Ошибка обновления статической карты: {future.exception()}, выгружаю заново")
+            request_reexport()
+
+    def apply(event, data):
+        state['writer'].on_subscription_event(event, data)
+
+    def schedule(event, data):
+        loop.run_in_executor(executor, apply, event, data).add_done_callback(on_updated)
+
+    def on_subscription_event(event, data):
+        loop.call_soon_threadsafe(schedule, event, data)
+
+    vpn_manager.add_listener(on_subscription_event)
+
+
+async def shard_writer_loop():
+    """
+    Каждая изменившаяся подписка отправляется владельцу шарда;
+    недоставленные повторяются с нарастающей паузой (api/sharding.py ShardOutbox)
+    """
+    from api.sharding import ShardClient, ShardOutbox, parse_shards
+
+    loop = asyncio.get_running_loop()
+    outbox = ShardOutbox(ShardClient(parse_shards(SHARDS), SHARD_SECRET, db_file=DB_FILE))
+    wakeup = asyncio.Event()
+
+    def on_subscription_event(event, data):
+        for token in data['subscription_tokens'] if event == 'servers_changed' else [data['subscription_token']]:
+            outbox.add(token)
+        loop.call_soon_threadsafe(wakeup.set)
+
+    vpn_manager.add_listener(on_subscription_event)
+    while True:
+        wakeup.clear()
+        delay = await asyncio.to_thread(outbox.flush)
+        try:
+            await asyncio.wait_for(wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def collect_traffic_loop():
+    """Периодически собирает счётчики трафика со всех узлов"""
+    from api.traffic import TrafficCollector
+
+    usage_store = get_usage_store()
+    collector = TrafficCollector(vpn_manager, TRAFFIC_STATS_COMMAND, usage_store=usage_store)
+    retention_at = 0
+    while True:
+        try:
+            count = await asyncio.to_thread(collector.collect)
+            logger.info(f"Трафик обновлён для {count} подписок")
+            if time.time() - retention_at > 3600:
+                await asyncio.to_thread(usage_store.apply_retention)
+                retention_at = time.time()
+        except Exception as e:
+            logger.error(f"Ошибка сбора трафика: {e}")
+        await asyncio.sleep(TRAFFIC_COLLECT_INTERVAL)
+
+
+async def provision_payments_loop(bot):
+    """
+    Выдаёт подписки по оплаченным платежам из outbox и сообщает пользователям.
+    Платёж из бота будит цикл сразу, webhook'и (subscription сервер) -
+    через PAYMENT_WORKER_INTERVAL секунд
+    """
+    while True:
+        payments_changed.clear()
+        try:
+            results = await asyncio.to_thread(provisioning_worker.run_once)
+        except Exception as e:
+            logger.error(f"Ошибка выдачи подписок по платежам: {e}")
+            results = []
+
+        for payment, result in results:
+            try:
+                if result:
+                    await bot.send_message(
+                        payment['telegram_id'], subscription_message(result, payment['plan']), parse_mode='HTML'
+                    )
+                else:
+                    await bot.send_message(
+                        payment['telegram_id'],
+                        "Ошибка создания подписки.\n\n"
+                        "Возможно нет доступных серверов.\n"
+                        "Обратитесь в поддержку."
+                    )
+            except Exception as e:
+                logger.error(f"Не удалось отправить подписку {payment['telegram_id']}: {e}")
+
+        try:
+            await asyncio.wait_for(payments_changed.wait(), timeout=PAYMENT_WORKER_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def post_init(application: Application):
+    """
+    Запуск фоновых задач после инициализации бота.
+    Модули выключенных задач не импортируются
+    """
+    global stats_snapshot, payment_ledger, payment_provider, provisioning_worker
+
+    from api.stats import StatsSnapshot
+    stats_snapshot = StatsSnapshot(vpn_manager, max_age=STATS_REFRESH_INTERVAL * 2)
+    vpn_manager.add_listener(stats_snapshot.on_subscription_event)
+    application.create_task(refresh_stats_loop())
+
+    from api.payments import PaymentLedger, ProvisioningWorker, get_payment_provider
+    payment_ledger = PaymentLedger(vpn_manager.repository)
+    payment_provider = get_payment_provider(PAYMENT_PROVIDER, PAYMENT_PROVIDER_URL, PAYMENT_WEBHOOK_SECRET)
+    provisioning_worker = ProvisioningWorker(payment_ledger, vpn_manager, PAYMENT_WORKER_BATCH)
+    application.create_task(provision_payments_loop(application.bot))
+    if SUB_SNAPSHOT_INTERVAL > 0:
+        application.create_task(export_snapshot_loop())
+    if STATIC_MAP_BASE:
+        await start_static_map()
+    if SHARDS:
+        application.create_task(shard_writer_loop())
+    if HEALTH_PROBE_INTERVAL > 0:
+        from api.health import HealthProber
+        prober = HealthProber(vpn_manager, HEALTH_PROBE_MODE, HEALTH_PROBE_TIMEOUT)
+        application.create_task(prober.run(HEALTH_PROBE_INTERVAL))
+    if TRAFFIC_COLLECT_INTERVAL > 0:
+        application.create_task(collect_traffic_loop())
+    if REMINDER_INTERVAL > 0:
+        from bot.reminders import ReminderBroadcaster
+        broadcaster = ReminderBroadcaster(
+            application.bot, vpn_manager, REMINDER_GLOBAL_RATE, REMINDER_PER_CHAT_RATE
+        )
+        application.create_task(broadcaster.run(REMINDER_INTERVAL))
+
+
 # ============== MAIN ==============
 
+def build_application(builder):
+    """
+    Приложение с обработчиками бота. builder - Application.builder() с токеном;
+    нагрузочный прогон (scripts/bench_bot.py) передаёт свой base_url и request
+    """
+    application = builder.post_init(post_init).build()
+
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("admin", admin_panel))
+    application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
+    return application
+
+
 def main():
     """Запуск бота"""
     if not TELEGRAM_BOT_TOKEN:
@@ -348,14 +728,7 @@ def main():
     # Инициализируем БД
     init_database()
 
-    # Создаем приложение
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-
-    # Регистрируем обработчики
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("admin", admin_panel))
-    application.add_handler(CallbackQueryHandler(button_handler))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
+    application = build_application(Application.builder().token(TELEGRAM_BOT_TOKEN))
 
     # Запускаем бота
     logger.info("Бот запущен!")
@@ -0,0 +1,152 @@
+"""
+Рассылка напоминаний об окончании подписки.
+
+Подписки, истекающие в ближайшее окно, выбираются по индексу
+(is_active, expires_at). Сообщения уходят через token bucket с глобальным
+лимитом и лимитом на чат, на 429 бот ждёт retry_after, на сетевые
+ошибки - экспоненциальная пауза. Каждая отправка фиксируется
+в reminders_sent до вызова API, поэтому после перезапуска
+уже обработанные напоминания не отправляются повторно.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from telegram.error import Forbidden, BadRequest, RetryAfter, TimedOut, NetworkError
+
+from api.rate_limit import RateLimiter, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# вид напоминания -> окно (от, до) времени до окончания подписки
+REMINDER_WINDOWS = {
+    '3d': (timedelta(days=1), timedelta(days=3)),
+    '1d': (timedelta(0), timedelta(days=1)),
+}
+
+
+def days_left_text(expires, now=None):
+    """Когда заканчивается подписка, по календарным дням: сегодня / завтра / через N дней"""
+    days = (expires.date() - (now or datetime.now()).date()).days
+    if days <= 0:
+        return "сегодня"
+    if days == 1:
+        return "завтра"
+    if days % 10 == 1 and days % 100 != 11:
+        word = "день"
+    elif 2 <= days % 10 <= 4 and not 12 <= days % 100 <= 14:
+        word = "дня"
+    else:
+        word = "дней"
+    return f"через {days} {word}"
+
+
+def reminder_text(kind, expires_at, now=None):
+    # Окно '3d' - от 1 до 3 суток до окончания: срок в тексте считается, а не берётся из вида
+    expires = datetime.strptime(expires_at, DATE_FORMAT)
+    when = days_left_text(expires, now)
+    return (
+        f"⏰ Ваша подписка VPN заканчивается {when} "
+        f"({expires.strftime('%d.%m.%Y %H:%M')}).\n\n"
+        f"Чтобы не потерять доступ, продлите её: кнопка 'Купить подписку'."
+    )
+
+
+class ReminderBroadcaster:
+    def __init__(self, bot, vpn_manager, global_rate=25, per_chat_rate=1.0,
+                 workers=8, max_attempts=5):
+        self.bot = bot
+        self.vpn_manager = vpn_manager
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_limiter = RateLimiter(per_chat_rate, 1)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.stats = {'sent': 0, 'failed': 0, 'retry_after': 0, 'retries': 0}
+
+    def select_due(self, kind, limit=5000):
+        """Подписки, которым пора отправить напоминание kind и которые его ещё не получали"""
+        now = datetime.now()
+        window_from, window_to = REMINDER_WINDOWS[kind]
+        return self.vpn_manager.repository.due_reminders(
+            kind,
+            (now + window_from).strftime(DATE_FORMAT),
+            (now + window_to).strftime(DATE_FORMAT),
+            limit
+        )
+
+    def _mark(self, subscription_id, kind, status):
+        self.vpn_manager.repository.mark_reminder(subscription_id, kind, status)
+
+    async def _acquire(self, chat_id):
+        """Ждёт, пока разрешат и глобальный лимит, и лимит чата"""
+        while not self.chat_limiter.allow(chat_id):
+            await asyncio.sleep(self.chat_limiter.retry_after(chat_id))
+        while not self.global_bucket.consume():
+            await asyncio.sleep(max(self.global_bucket.wait_time(), 0.005))
+
+    async def _send(self, item, kind):
+        # Фиксируем до отправки: после перезапуска повторов не будет
+        await asyncio.to_thread(self._mark, item['id'], kind, 'sending')
+
+        delay = 1.0
+        for attempt in range(1, self.max_attempts + 1):
+            await self._acquire(item['telegram_id'])
+            try:
+                await self.bot.send_message(item['telegram_id'], reminder_text(kind, item['expires_at']))
+                self.stats['sent'] += 1
+                await asyncio.to_thread(self._mark, item['id'], kind, 'sent')
+                return
+            except RetryAfter as e:
+                self.stats['retry_after'] += 1
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                logger.warning(f"Flood control, ждём {retry_after}с")
+                # Останавливаем весь поток, а не только этот чат
+                self.global_bucket.tokens = -retry_after * self.global_bucket.rate
+                await asyncio.sleep(retry_after)
+            except (Forbidden, BadRequest) as e:
+                # Пользователь заблокировал бота или чат недоступен - повторять бессмысленно
+                logger.info(f"Напоминание {item['telegram_id']} не доставлено: {e}")
+                break
+            except (TimedOut, NetworkError) as e:
+                logger.warning(f"Сетевая ошибка при отправке {item['telegram_id']}: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+            self.stats['retries'] += 1
+
+        self.stats['failed'] += 1
+        await asyncio.to_thread(self._mark, item['id'], kind, 'failed')
+
+    async def run_once(self):
+        """Один проход по всем видам напоминаний. Возвращает статистику"""
+        started = time.monotonic()
+        for kind in REMINDER_WINDOWS:
+            while True:
+                due = await asyncio.to_thread(self.select_due, kind)
+                if not due:
+                    break
+
+                queue = asyncio.Queue()
+                for item in due:
+                    queue.put_nowait(item)
+
+                async def worker():
+                    while not queue.empty():
+                        await self._send(queue.get_nowait(), kind)
+
+                await asyncio.gather(*(worker() for _ in range(self.workers)))
+
+        result = dict(self.stats, seconds=round(time.monotonic() - started, 2))
+        if self.stats['sent'] or self.stats['failed']:
+            logger.info(f"Напоминания: {result}")
+        return result
+
+    async def run(self, interval):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка рассылки напоминаний: {e}")
+            await asyncio.sleep(interval)
@@ -1,49 +1,48 @@
 #!/bin/bash
+set -e
 
 # Deploy script for VPS
 VPS_IP="85.239.48.88"
 VPS_USER="root"
 PROJECT_PATH="/root/vpn_project"
+# systemd units of the bot and the subscription server on the VPS
+BOT_SERVICE="${BOT_SERVICE:-vpn-bot}"
+SUB_SERVICE="${SUB_SERVICE:-vpn-subscription}"
 
 echo "Deploying to VPS..."
 
-# Copy new files
-scp api/subscription_server.py ${VPS_USER}@${VPS_IP}:${PROJECT_PATH}/api/
-scp scripts/migrate_multiserver.py ${VPS_USER}@${VPS_IP}:${PROJECT_PATH}/scripts/
-scp api/database.py ${VPS_USER}@${VPS_IP}:${PROJECT_PATH}/api/
-scp api/vpn_manager.py ${VPS_USER}@${VPS_IP}:${PROJECT_PATH}/api/
-scp bot/main.py ${VPS_USER}@${VPS_IP}:${PROJECT_PATH}/bot/
-scp bot/config.py ${VPS_USER}@${VPS_IP}:${PROJECT_PATH}/bot/
-scp requirements.txt ${VPS_USER}@${VPS_IP}:${PROJECT_PATH}/
+# Copy the whole code trees: modules import each other (api/repository.py,
+# api/uuid_blob.py, bot/reminders.py, ...), a partial copy fails with ImportError
+rsync -az --exclude '__pycache__' api bot scripts requirements.txt ${VPS_USER}@${VPS_IP}:${PROJECT_PATH}/
 
 echo "Files copied. Now run setup on VPS..."
 
 # Run setup on VPS
-ssh ${VPS_USER}@${VPS_IP} << 'ENDSSH'
+ssh ${VPS_USER}@${VPS_IP} BOT_SERVICE="${BOT_SERVICE}" SUB_SERVICE="${SUB_SERVICE}" bash -s << 'ENDSSH'
+set -e
 cd /root/vpn_project
 
-# Install Flask
 source venv/bin/activate
-pip install flask==3.0.0
-
-# Update database
-sqlite3 vpn.db << 'ENDSQL'
-CREATE TABLE IF NOT EXISTS subscription_servers (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    subscription_id INTEGER NOT NULL,
-    server_id INTEGER NOT NULL,
-    config_link TEXT NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (subscription_id) REFERENCES subscriptions(id),
-    FOREIGN KEY (server_id) REFERENCES servers(id),
-    UNIQUE(subscription_id, server_id)
-);
-
-ALTER TABLE subscriptions ADD COLUMN subscription_token TEXT;
-ENDSQL
+pip install -r requirements.txt
+
+# Старые процессы читают токены как TEXT, а миграция 7 хранит их BLOB'ами:
+# останавливаем бота и сервер до миграции и запускаем уже новый код
+systemctl stop "${BOT_SERVICE}" "${SUB_SERVICE}"
+
+# Бэкап перед миграцией (scripts/backup.py), при ошибке миграции - restore из него
+python3 scripts/backup.py create --full
+
+# Update database (миграции по PRAGMA user_version)
+if ! python3 scripts/migrate.py; then
+    echo "Миграция не прошла: сервисы остановлены, восстановление - scripts/backup.py restore"
+    exit 1
+fi
 
 # Update .env
-echo "SUBSCRIPTION_URL_BASE=https://syntax-vpn.tech/sub" >> .env
+grep -q '^SUBSCRIPTION_URL_BASE=' .env || echo "SUBSCRIPTION_URL_BASE=https://syntax-vpn.tech/sub" >> .env
+
+systemctl start "${BOT_SERVICE}" "${SUB_SERVICE}"
+systemctl --no-pager status "${BOT_SERVICE}" "${SUB_SERVICE}" | grep -E 'Loaded|Active'
 
 echo "Setup complete!"
 ENDSSH
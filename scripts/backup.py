@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Резервные копии vpn.db на работающей БД (api/backup.py).
+
+Использование:
+    python3 backup.py create [--full]        - бэкап (incr к последнему или full)
+    python3 backup.py list                   - бэкапы и их цепочки
+    python3 backup.py verify [NAME]          - восстановить во временный файл и проверить
+                                               (по умолчанию последний)
+    python3 backup.py restore NAME DEST      - собрать БД бэкапа в файл DEST
+    python3 backup.py prune [--keep 7]       - удалить цепочки старше keep последних full
+
+Каталог - BACKUP_DIR (--dir). Восстановление поверх vpn.db - только
+при остановленных боте и subscription сервере:
+    python3 backup.py restore vpn-...-incr /root/vpn_project/vpn.db
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.config import (DB_FILE, BACKUP_DIR, BACKUP_FULL_EVERY, BACKUP_KEEP_FULL,
+                        BACKUP_STEP_PAGES, BACKUP_STEP_SLEEP)
+from api.backup import create_backup, list_backups, prune, restore, verify
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Резервные копии vpn.db")
+    parser.add_argument('--dir', default=BACKUP_DIR)
+    parser.add_argument('--db', default=DB_FILE)
+    commands = parser.add_subparsers(dest='command', required=True)
+    create = commands.add_parser('create')
+    create.add_argument('--full', action='store_true', help="Начать новую цепочку")
+    create.add_argument('--step-pages', type=int, default=BACKUP_STEP_PAGES)
+    create.add_argument('--step-sleep', type=float, default=BACKUP_STEP_SLEEP)
+    commands.add_parser('list')
+    verify_cmd = commands.add_parser('verify')
+    verify_cmd.add_argument('name', nargs='?')
+    restore_cmd = commands.add_parser('restore')
+    restore_cmd.add_argument('name')
+    restore_cmd.add_argument('dest')
+    prune_cmd = commands.add_parser('prune')
+    prune_cmd.add_argument('--keep', type=int, default=BACKUP_KEEP_FULL)
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        manifest = create_backup(args.db, args.dir, full_every=0 if args.full else BACKUP_FULL_EVERY,
+                                 step_pages=args.step_pages, step_sleep=args.step_sleep)
+        copy = manifest['copy']
+        print(f"{manifest['name']}: {manifest['pages_written']} из {manifest['page_count']} страниц, "
+              f"{manifest['bytes'] / 2**20:.2f} МБ, копия {copy['seconds']:.2f}с "
+              f"({copy['steps']} шагов, перезапусков {copy['restarts']})")
+
+    elif args.command == 'list':
+        for manifest in list_backups(args.dir):
+            print(f"{manifest['name']}  {manifest['created_at']}  {manifest['kind']:>4}  "
+                  f"страниц {manifest['pages_written']}/{manifest['page_count']}  "
+                  f"{manifest['bytes'] / 2**20:.2f} МБ")
+
+    elif args.command == 'verify':
+        backups = list_backups(args.dir)
+        if not backups:
+            print(f"Нет бэкапов в {args.dir}")
+            sys.exit(1)
+        try:
+            result = verify(args.dir, args.name or backups[-1]['name'])
+        except (OSError, ValueError) as e:
+            print(f"Ошибка проверки: {e}")
+            sys.exit(1)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        sys.exit(0 if result['ok'] else 1)
+
+    elif args.command == 'restore':
+        manifest = restore(args.dir, args.name, args.dest)
+        print(f"{args.dest}: восстановлен {manifest['name']}, {manifest['page_count']} страниц, sha256 совпал")
+
+    elif args.command == 'prune':
+        for name in prune(args.dir, args.keep):
+            print(f"Удалён {name}")
+
+
+if __name__ == "__main__":
+    main()
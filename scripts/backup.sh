@@ -0,0 +1,16 @@
+#!/bin/bash
+# Резервная копия vpn.db по расписанию (scripts/backup.py, api/backup.py):
+# бэкап без остановки бота, проверка восстановлением, удаление старых цепочек.
+# Настройки - BACKUP_* в .env. Пример для cron (каждый час):
+#   0 * * * * bash /root/vpn_project/scripts/backup.sh >> /var/log/vpn-backup.log 2>&1
+set -e
+
+cd "$(dirname "$0")/.."
+if [ -f venv/bin/activate ]; then
+    source venv/bin/activate
+fi
+
+echo "$(date '+%Y-%m-%d %H:%M:%S') бэкап vpn.db"
+python3 scripts/backup.py create "$@"
+python3 scripts/backup.py verify > /dev/null || { echo "Проверка бэкапа не прошла"; exit 1; }
+python3 scripts/backup.py prune
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Задержка записи покупок во время бэкапа vpn.db и размер бэкапов.
+
+Использование:
+    python3 bench_backup.py [--subscriptions 50000] [--pool 100000] [--writers 4]
+
+Во временной БД создаются 10 серверов с пулами по pool UUID и
+subscriptions подписок. writers потоков непрерывно выполняют транзакцию
+выдачи подписки (VPNManager._create_subscription_tx через очередь
+с групповым коммитом, как в боте; чтение кандидатов размещения
+бэкап не блокирует и в замер не входит). Для каждого способа копирования
+меряются p50/p99/max записи покупки, пока идёт копирование, длительность
+и целостность копии:
+    cp файла           - копия файла как есть (то, от чего защищает backup API)
+    backup API, 1 шаг  - вся БД под одной блокировкой чтения
+    backup.py full/incr - api/backup.py, шаги step_pages с паузой
+Затем то же в режиме WAL и проверка восстановления (verify).
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+workdir = tempfile.mkdtemp()
+os.environ['DB_FILE'] = os.path.join(workdir, 'bench.db')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import logging
+
+from bot.config import DB_FILE
+from api.backup import create_backup, online_copy, verify
+from api.database import init_database, add_server
+from api.placement import AllServersPlacement
+from api.uuid_blob import to_db
+from api.vpn_manager import VPNManager
+from api.write_queue import WriteQueue
+
+
+def seed(subscriptions, pool):
+    init_database()
+    server_ids = [add_server(f"Server {i}", f"203.0.113.{i + 1}", 443, f"pk{i}", max_users=10 ** 6)
+                  for i in range(10)]
+    conn = sqlite3.connect(DB_FILE)
+    for server_id in server_ids:
+        conn.executemany("INSERT INTO uuid_pool (uuid, email, server_id, is_used) VALUES (?, ?, ?, ?)", [
+            (to_db(str(uuid.uuid4())), f"s{server_id}_{j}", server_id, int(j < subscriptions // 5))
+            for j in range(pool)
+        ])
+    conn.executemany("INSERT INTO users (telegram_id) VALUES (?)", [(10 ** 6 + i,) for i in range(subscriptions)])
+    conn.executemany("""
+        INSERT INTO subscriptions (user_id, uuid, subscription_token, expires_at)
+        VALUES (?, ?, ?, '2030-01-01 00:00:00')
+    """, [(i + 1, to_db(str(uuid.uuid4())), to_db(str(uuid.uuid4()))) for i in range(subscriptions)])
+    conn.executemany("""
+        INSERT INTO subscription_servers (subscription_id, server_id, config_link, uuid) VALUES (?, ?, ?, ?)
+    """, [(i + 1, server_ids[(i + k) % 10], 'vless://' + 'x' * 200, to_db(str(uuid.uuid4())))
+          for i in range(subscriptions) for k in range(2)])
+    conn.commit()
+    conn.close()
+
+
+class Purchases:
+    """Потоки, непрерывно пишущие покупки; задержки с отметкой времени окончания"""
+
+    def __init__(self, manager, writers):
+        self.manager = manager
+        self.samples = []
+        self.stop = threading.Event()
+        servers = manager.placement.select(manager.get_placement_candidates())[:2]
+        self.threads = [threading.Thread(target=self._run, args=(n, servers)) for n in range(writers)]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self, n, servers):
+        telegram_id = 5 * 10 ** 6 + n * 10 ** 6
+        while not self.stop.is_set():
+            telegram_id += 1
+            started = time.perf_counter()
+            self.manager.repository.transaction(
+                lambda conn: self.manager._create_subscription_tx(conn, servers, telegram_id, None, 30, None))
+            finished = time.perf_counter()
+            self.samples.append((finished, finished - started))
+            time.sleep(0.002)
+
+    def window(self, start, end):
+        latencies = sorted(latency for finished, latency in self.samples if start <= finished <= end)
+        if not latencies:
+            return None
+        return (latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.99)] * 1e3,
+                latencies[-1] * 1e3, len(latencies))
+
+    def close(self):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+
+def integrity(path):
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return conn.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        return str(e)
+
+
+def report(name, purchases, run):
+    time.sleep(0.5)
+    start = time.perf_counter()
+    detail = run()
+    end = time.perf_counter()
+    stats = purchases.window(start, end)
+    latency = (f"p50 {stats[0]:5.1f} мс, p99 {stats[1]:6.1f} мс, max {stats[2]:6.1f} мс ({stats[3]} покупок)"
+               if stats else "покупок не было")
+    print(f"{name:>24}: {end - start:5.2f}с, запись покупки {latency}; {detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бэкап vpn.db под нагрузкой покупок")
+    parser.add_argument('--subscriptions', type=int, default=50000)
+    parser.add_argument('--pool', type=int, default=100000)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--step-pages', type=int, default=64)
+    parser.add_argument('--step-sleep', type=float, default=0.005)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    seed(args.subscriptions, args.pool)
+    backup_dir = os.path.join(workdir, 'backups')
+    copy_path = os.path.join(workdir, 'copy.db')
+
+    for journal_mode in ('delete', 'wal'):
+        conn = sqlite3.connect(DB_FILE)
+        conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+        conn.close()
+        shutil.rmtree(backup_dir, ignore_errors=True)
+        print(f"== journal_mode={journal_mode}, БД {os.path.getsize(DB_FILE) / 2**20:.0f} МБ, "
+              f"{args.writers} потоков покупок ==")
+
+        write_queue = WriteQueue(DB_FILE)
+        purchases = Purchases(VPNManager(placement=AllServersPlacement(), write_queue=write_queue), args.writers)
+
+        report('без бэкапа', purchases, lambda: time.sleep(2) or '')
+
+        if journal_mode == 'delete':
+            def file_copy():
+                shutil.copyfile(DB_FILE, copy_path)
+                return f"целостность копии: {integrity(copy_path)}"
+            report('cp файла', purchases, file_copy)
+
+        def one_step():
+            stats = online_copy(DB_FILE, copy_path, step_pages=-1, step_sleep=0)
+            return f"перезапусков {stats['restarts']}, целостность: {integrity(copy_path)}"
+        report('backup API, 1 шаг', purchases, one_step)
+
+        def backup():
+            manifest = create_backup(DB_FILE, backup_dir, step_pages=args.step_pages, step_sleep=args.step_sleep)
+            copy = manifest['copy']
+            return (f"{manifest['pages_written']}/{manifest['page_count']} страниц, "
+                    f"{manifest['bytes'] / 2**20:.2f} МБ, копия {copy['seconds']:.2f}с, шагов {copy['steps']}, "
+                    f"перезапусков {copy['restarts']}")
+        # Первый бэкап - full, второй - incr к нему
+        report('backup.py full', purchases, backup)
+        report('backup.py incr', purchases, backup)
+
+        purchases.close()
+        write_queue.close()
+
+        started = time.perf_counter()
+        names = sorted(entry[:-5] for entry in os.listdir(backup_dir) if entry.endswith('.json'))
+        result = verify(backup_dir, names[-1])
+        print(f"{'verify':>24}: {time.perf_counter() - started:.2f}с, цепочка {len(result['chain'])}, "
+              f"integrity {result['integrity']}, строк {result['rows']}")
+
+
+if __name__ == "__main__":
+    main()
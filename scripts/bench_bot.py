@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный прогон бота (bot/main.py) синтетическими пользователями Telegram.
+
+Использование:
+    python3 bench_bot.py [--users 1000] [--rate 10] [--buy 0.5] [--think 2]
+                         [--api-rate 30] [--chat-rate 1] [--concurrent-updates 0]
+
+Всё работает без сети: временная БД с servers серверами и пулами UUID,
+scripts/fake_bot_api.py вместо Telegram (429 при превышении лимитов, как
+настоящий Bot API; в отдельном процессе, чтобы не делить GIL с ботом) и
+настоящее Application из bot/main.py (build_application) с теми же
+обработчиками и фоновыми задачами. Update кладутся в application.update_queue,
+как их кладёт polling; --concurrent-updates показывает, что даст
+параллельная обработка обновлений.
+
+Пользователи приходят пуассоновским потоком rate в секунду. Сценарий:
+/start -> "Купить подписку" -> кнопка buy_<тариф> -> ожидание сообщения
+с подпиской -> "Мой ключ"; доля 1 - buy только смотрит /start и
+"Мой ключ". Между шагами - пауза 1 + exp(think) секунд.
+
+Отчёт:
+    задержки обработчиков  - от постановки Update в очередь до конца обработки
+                             (p50/p95/p99/max по шагам) и из них ожидание в очереди
+    выдача подписки        - от нажатия buy_ до сообщения с подпиской в Bot API
+    event loop             - запаздывание таймера (синхронные вызовы в обработчиках)
+    блокировки БД          - время BEGIN IMMEDIATE и COMMIT по всем соединениям
+                             sqlite3 процесса, ошибки database is locked
+    исчерпание пулов       - пул HTTP соединений бота (Pool timeout), потоки
+                             asyncio.to_thread (задача ждала свободный поток),
+                             UUID (подписка не выдана)
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+workdir = tempfile.mkdtemp()
+os.environ.update({
+    'DB_FILE': os.path.join(workdir, 'vpn.db'),
+    'USAGE_DB_FILE': os.path.join(workdir, 'usage.db'),
+    'SUB_SNAPSHOT_FILE': os.path.join(workdir, 'sub_snapshot.db'),
+    'TELEGRAM_BOT_TOKEN': '123456:TEST',
+    'PAYMENT_PROVIDER': 'none',
+})
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+
+from telegram import Update
+from telegram.error import TimedOut
+from telegram.ext import Application, TypeHandler
+from telegram.request import HTTPXRequest
+
+from api.database import init_database, add_server, import_uuid_pool
+from scripts.fake_bot_api import FakeBotAPI
+
+PLANS = ['1_month', '3_months', '6_months', '12_months']
+
+
+class Recorder:
+    """Замеры (секунды) и счётчики событий из любых потоков"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.samples[name].append(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def line(self, name):
+        values = sorted(self.samples.get(name, []))
+        if not values:
+            return f"{name:>28}: нет замеров"
+
+        def pct(p):
+            return values[min(len(values) - 1, int(len(values) * p))] * 1e3
+
+        return (f"{name:>28}: p50 {pct(0.5):7.1f} мс, p95 {pct(0.95):7.1f} мс, p99 {pct(0.99):7.1f} мс, "
+                f"max {values[-1] * 1e3:7.1f} мс ({len(values)})")
+
+
+recorder = Recorder()
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение sqlite3, которое меряет захват блокировки записи и COMMIT"""
+
+    def execute(self, sql, *args):
+        statement = sql.lstrip()[:15].upper()
+        timed = statement.startswith(('BEGIN IMMEDIATE', 'COMMIT'))
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        except sqlite3.OperationalError as e:
+            if 'locked' in str(e):
+                recorder.count('database is locked')
+            raise
+        finally:
+            if timed:
+                recorder.add('BEGIN IMMEDIATE' if statement.startswith('BEGIN') else 'COMMIT',
+                             time.perf_counter() - started)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            recorder.add('COMMIT', time.perf_counter() - started)
+
+
+_sqlite_connect = sqlite3.connect
+
+
+def timed_connect(*args, **kwargs):
+    kwargs.setdefault('factory', TimedConnection)
+    return _sqlite_connect(*args, **kwargs)
+
+
+class TimedExecutor(ThreadPoolExecutor):
+    """Пул asyncio.to_thread: сколько задача ждала свободный поток"""
+
+    def __init__(self, max_workers):
+        super().__init__(max_workers=max_workers)
+        self.workers = max_workers
+        self.busy = 0
+        self._busy_lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        submitted = time.perf_counter()
+        with self._busy_lock:
+            if self.busy >= self.workers:
+                recorder.count('потоки to_thread заняты')
+            self.busy += 1
+
+        def run():
+            recorder.add('ожидание потока to_thread', time.perf_counter() - submitted)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._busy_lock:
+                    self.busy -= 1
+
+        return super().submit(run)
+
+
+class TimedRequest(HTTPXRequest):
+    """HTTP клиент бота: время вызовов Bot API, 429 и исчерпание пула соединений"""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            if code == 429:
+                recorder.count(f"Bot API 429 ({url.rsplit('/', 1)[-1]})")
+            return code, payload
+        except TimedOut as e:
+            if 'Pool timeout' in str(e):
+                recorder.count('пул HTTP соединений исчерпан')
+            else:
+                recorder.count('таймаут Bot API')
+            raise
+        finally:
+            recorder.add('вызов Bot API', time.perf_counter() - started)
+
+
+def serve_api(args, pipe, deliveries):
+    """
+    Фейковый Bot API в отдельном процессе, чтобы его потоки не делили GIL
+    с ботом. Сообщения с подпиской (или ошибкой выдачи) -> deliveries
+    """
+    def on_message(method, chat_id, text):
+        if method == 'sendMessage' and text and ('Подписка активирована' in text or 'Ошибка создания подписки' in text):
+            deliveries.put((int(chat_id), 'Ошибка' not in text))
+
+    api = FakeBotAPI(global_rate=args.api_rate, per_chat_rate=args.chat_rate, latency=args.api_latency,
+                     on_message=on_message).start()
+    pipe.send(api.base_url)
+    pipe.recv()
+    api.stop()
+    pipe.send({'calls': sum(api.calls.values()), 'rejected': api.rejected})
+
+
+def seed(servers, pool):
+    init_database()
+    for i in range(servers):
+        server_id = add_server(f"Bench {i}", f"10.0.0.{i + 1}", 443, 'pk', max_users=pool)
+        import_uuid_pool([{'uuid': str(uuid.uuid4()), 'email': f"pool_{i}_{j:06d}"} for j in range(pool)], server_id)
+
+
+class Harness:
+    """Синтетические Update в очередь приложения и ожидание их обработки"""
+
+    def __init__(self, application):
+        self.application = application
+        self.update_id = 0
+        self.message_id = 0
+        self.pending = {}
+        self.deliveries = {}
+        # Обработчики бота - в группе 0; группы -1 и 1 отмечают начало и конец обработки
+        application.add_handler(TypeHandler(Update, self._started), group=-1)
+        application.add_handler(TypeHandler(Update, self._finished), group=1)
+        application.add_error_handler(self._error)
+
+    async def _started(self, update, context):
+        entry = self.pending.get(update.update_id)
+        if entry:
+            entry['started'] = time.perf_counter()
+
+    async def _finished(self, update, context):
+        entry = self.pending.pop(update.update_id, None)
+        if entry:
+            finished = time.perf_counter()
+            recorder.add(entry['step'], finished - entry['queued'])
+            recorder.add('ожидание в очереди', entry.get('started', finished) - entry['queued'])
+            entry['done'].set_result(None)
+
+    async def _error(self, update, context):
+        recorder.count(f"ошибка обработчика {type(context.error).__name__}")
+
+    def delivered(self, chat_id, ok):
+        future = self.deliveries.pop(chat_id, None)
+        if future and not future.done():
+            future.set_result(ok)
+
+    def _user(self, telegram_id):
+        return {'id': telegram_id, 'is_bot': False, 'first_name': f"User{telegram_id}",
+                'username': f"user{telegram_id}"}
+
+    def _message(self, telegram_id, text, command=False):
+        self.message_id += 1
+        message = {'message_id': self.message_id, 'date': int(time.time()),
+                   'chat': {'id': telegram_id, 'type': 'private'}, 'from': self._user(telegram_id), 'text': text}
+        if command:
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        return message
+
+    async def send(self, step, payload):
+        """Кладёт Update в очередь приложения и ждёт конца его обработки"""
+        self.update_id += 1
+        update = Update.de_json(dict(payload, update_id=self.update_id), self.application.bot)
+        done = asyncio.get_running_loop().create_future()
+        self.pending[self.update_id] = {'step': step, 'queued': time.perf_counter(), 'done': done}
+        await self.application.update_queue.put(update)
+        await done
+
+    async def text(self, step, telegram_id, text, command=False):
+        await self.send(step, {'message': self._message(telegram_id, text, command)})
+
+    async def callback(self, step, telegram_id, data):
+        message = self._message(telegram_id, 'Выберите тариф')
+        query = {'id': str(message['message_id']), 'from': self._user(telegram_id), 'chat_instance': str(telegram_id),
+                 'data': data, 'message': message}
+        await self.send(step, {'callback_query': query})
+
+    async def user(self, telegram_id, buyer, think, rng, delivery_timeout):
+        async def pause():
+            await asyncio.sleep(1 + rng.expovariate(1 / think) if think else 0)
+
+        await self.text('/start', telegram_id, '/start', command=True)
+        if buyer:
+            await pause()
+            await self.text('Купить подписку', telegram_id, 'Купить подписку')
+            await pause()
+            delivery = asyncio.get_running_loop().create_future()
+            self.deliveries[telegram_id] = delivery
+            clicked = time.perf_counter()
+            await self.callback('buy_', telegram_id, f"buy_{rng.choice(PLANS)}")
+            try:
+                ok = await asyncio.wait_for(delivery, delivery_timeout)
+                recorder.add('выдача подписки', time.perf_counter() - clicked)
+                recorder.count('подписка выдана' if ok else 'подписка не выдана (пул UUID)')
+            except asyncio.TimeoutError:
+                self.deliveries.pop(telegram_id, None)
+                recorder.count('подписка не дошла до пользователя')
+        await pause()
+        await self.text('Мой ключ', telegram_id, 'Мой ключ')
+
+
+async def loop_lag(stop, interval=0.01):
+    """Насколько позже срабатывает таймер event loop"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        recorder.add('запаздывание event loop', time.perf_counter() - started - interval)
+
+
+async def run(args):
+    # fork до запуска потоков бота
+    context = multiprocessing.get_context('fork')
+    pipe, child_pipe = context.Pipe()
+    deliveries = context.Queue()
+    api_process = context.Process(target=serve_api, args=(args, child_pipe, deliveries), daemon=True)
+    api_process.start()
+    base_url = pipe.recv()
+
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(TimedExecutor(min(32, (os.cpu_count() or 1) + 4)))
+    rng = random.Random(args.seed)
+
+    from bot import main as bot_main
+
+    builder = (Application.builder().token(os.environ['TELEGRAM_BOT_TOKEN']).base_url(base_url)
+               .request(TimedRequest(connection_pool_size=args.pool_size)).updater(None))
+    if args.concurrent_updates:
+        builder = builder.concurrent_updates(args.concurrent_updates)
+    application = bot_main.build_application(builder)
+    harness = Harness(application)
+
+    def pump():
+        for item in iter(deliveries.get, None):
+            loop.call_soon_threadsafe(harness.delivered, *item)
+
+    threading.Thread(target=pump, daemon=True).start()
+
+    stop = asyncio.Event()
+    await application.initialize()
+    await application.start()
+    before = asyncio.all_tasks()
+    await application.post_init(application)
+    # Фоновые циклы бота бесконечны - application.stop() ждал бы их вечно
+    background = asyncio.all_tasks() - before
+    lag_task = asyncio.create_task(loop_lag(stop))
+
+    started = time.perf_counter()
+    users = []
+    arrival = 0.0
+    for i in range(args.users):
+        users.append(asyncio.create_task(
+            harness.user(10 ** 6 + i, rng.random() < args.buy, args.think, random.Random(rng.random()),
+                         args.delivery_timeout)))
+        # Время прихода считается от начала: занятый event loop не снижает поток пользователей
+        arrival += rng.expovariate(args.rate)
+        await asyncio.sleep(max(0.0, arrival - (time.perf_counter() - started)))
+    arrivals = time.perf_counter() - started
+    await asyncio.gather(*users)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await lag_task
+    for task in background:
+        task.cancel()
+    await application.stop()
+    await application.shutdown()
+    pipe.send('stop')
+    api_stats = pipe.recv()
+    api_process.join()
+    deliveries.put(None)
+    if bot_main.write_queue is not None:
+        bot_main.write_queue.close()
+        write_stats = bot_main.write_queue.stats
+    else:
+        write_stats = None
+
+    print(f"Пользователей: {args.users} ({args.rate}/с, приход за {arrivals:.1f}с), покупают {args.buy:.0%}, "
+          f"обработка обновлений: {args.concurrent_updates or 'последовательно'}; прогон {elapsed:.1f}с")
+    print(f"Bot API: лимит {args.api_rate}/с всего, {args.chat_rate}/с в чат; вызовов {api_stats['calls']}, "
+          f"отклонено 429: {api_stats['rejected']}")
+    print("\nЗадержки обработчиков (от постановки в очередь):")
+    for name in ('/start', 'Купить подписку', 'buy_', 'Мой ключ', 'ожидание в очереди', 'выдача подписки'):
+        print(recorder.line(name))
+    print("\nEvent loop и Bot API:")
+    for name in ('запаздывание event loop', 'вызов Bot API', 'ожидание потока to_thread'):
+        print(recorder.line(name))
+    print("\nБлокировки БД:")
+    for name in ('BEGIN IMMEDIATE', 'COMMIT'):
+        print(recorder.line(name))
+    if write_stats:
+        print(f"{'очередь записи':>28}: {write_stats['operations']} операций за {write_stats['commits']} коммитов")
+    print("\nСобытия:")
+    for name, count in sorted(recorder.counters.items()):
+        print(f"{name:>40}: {count}")
+
+    conn = _sqlite_connect(os.environ['DB_FILE'])
+    subscriptions = conn.execute("SELECT COUNT(*) FROM subscriptions").fetchone()[0]
+    conn.close()
+    print(f"\nПодписок в БД: {subscriptions}; {datetime.now():%H:%M:%S}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=10, help="Новых пользователей в секунду")
+    parser.add_argument('--buy', type=float, default=0.5, help="Доля покупающих")
+    parser.add_argument('--think', type=float, default=2, help="Средняя пауза между шагами сверх 1с")
+    parser.add_argument('--servers', type=int, default=3)
+    parser.add_argument('--pool', type=int, default=0, help="UUID на сервер (0 - на всех покупателей)")
+    parser.add_argument('--api-rate', type=float, default=30, help="Лимит Bot API, сообщений/с всего")
+    parser.add_argument('--chat-rate', type=float, default=1, help="Лимит Bot API, сообщений/с в чат")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="Задержка ответа Bot API, секунды")
+    parser.add_argument('--pool-size', type=int, default=256, help="Соединений HTTP у бота (как в Application)")
+    parser.add_argument('--concurrent-updates', type=int, default=0,
+                        help="Параллельная обработка обновлений (0 - последовательно, как в bot/main.py)")
+    parser.add_argument('--delivery-timeout', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    # Ошибки отправки (429 и т.п.) считает отчёт
+    logging.disable(logging.ERROR)
+    seed(args.servers, args.pool or args.users + 100)
+    sqlite3.connect = timed_connect
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
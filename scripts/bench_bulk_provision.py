@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Массовый импорт подписок: scripts/bulk_provision.py против цикла
+create_subscription.
+
+Использование:
+    python3 bench_bulk_provision.py [--rows 100000] [--servers 10] [--per-sub 2] [--single 2000]
+
+Во временной БД создаются servers серверов с пулами UUID на все строки,
+размещение - load_aware по per-sub серверов на подписку. Импорт rows строк
+NDJSON запускается как отдельный процесс (как в работе), затем повторно
+(все строки - status=exists). Для сравнения single подписок создаются
+по одной через create_subscription.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+workdir = tempfile.mkdtemp()
+os.environ['DB_FILE'] = os.path.join(workdir, 'bench.db')
+os.environ['PLACEMENT_STRATEGY'] = 'load_aware'
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import logging
+
+from bot.config import DB_FILE
+from api.database import init_database, add_server
+from api.placement import LoadAwarePlacement
+from api.uuid_blob import to_db
+from api.vpn_manager import VPNManager
+
+
+def seed(servers, pool_size):
+    init_database()
+    server_ids = [add_server(f"Server {i:02d}", f"203.0.113.{i + 1}", 443, f"pk{i}", max_users=pool_size)
+                  for i in range(servers)]
+    conn = sqlite3.connect(DB_FILE)
+    conn.executemany("INSERT INTO uuid_pool (uuid, email, server_id) VALUES (?, ?, ?)", [
+        (to_db(str(uuid.uuid4())), f"s{server_id}_{j}", server_id)
+        for server_id in server_ids for j in range(pool_size)
+    ])
+    conn.commit()
+    conn.close()
+
+
+def run_import(path, per_sub):
+    env = dict(os.environ, PLACEMENT_SERVERS_PER_SUB=str(per_sub))
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, os.path.join(ROOT, 'scripts', 'bulk_provision.py'), path],
+                             env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    statuses = {}
+    for line in process.stdout.splitlines():
+        status = json.loads(line)['status']
+        statuses[status] = statuses.get(status, 0) + 1
+    return elapsed, statuses, process.stderr.strip().splitlines()[-1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовый импорт подписок")
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--servers', type=int, default=10)
+    parser.add_argument('--per-sub', type=int, default=2)
+    parser.add_argument('--single', type=int, default=2000)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    total = args.rows + args.single
+    seed(args.servers, total * args.per_sub // args.servers + 100)
+
+    path = os.path.join(workdir, 'clients.ndjson')
+    rng = random.Random(1)
+    with open(path, 'w') as f:
+        for i in range(args.rows):
+            f.write(json.dumps({'telegram_id': 10 ** 6 + i, 'username': f"user{i}",
+                                'days': rng.choice((30, 90, 365))}) + '\n')
+
+    print(f"{args.rows} строк, {args.servers} серверов, {args.per_sub} сервера на подписку")
+    for name in ('импорт', 'повторный запуск'):
+        elapsed, statuses, summary = run_import(path, args.per_sub)
+        print(f"{name:>18}: {elapsed:.1f}с ({args.rows / elapsed:.0f} строк/с), статусы {statuses}")
+
+    conn = sqlite3.connect(DB_FILE)
+    links, used = conn.execute("""
+        SELECT (SELECT COUNT(*) FROM subscription_servers), (SELECT COUNT(*) FROM uuid_pool WHERE is_used = 1)
+    """).fetchone()
+    duplicates = conn.execute("""
+        SELECT COUNT(*) FROM (SELECT uuid, server_id FROM subscription_servers
+                              GROUP BY uuid, server_id HAVING COUNT(*) > 1)
+    """).fetchone()[0]
+    conn.close()
+    print(f"{'':>18}  связей {links}, UUID занято {used}, дублей UUID {duplicates}")
+
+    manager = VPNManager(placement=LoadAwarePlacement(args.per_sub))
+    started = time.perf_counter()
+    for i in range(args.single):
+        manager.create_subscription(2 * 10 ** 6 + i, f"single{i}", 30)
+    elapsed = time.perf_counter() - started
+    print(f"{'create_subscription':>18}: {args.single} за {elapsed:.1f}с ({args.single / elapsed:.0f}/с), "
+          f"на {args.rows} строк ~{args.rows / args.single * elapsed:.0f}с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Трафик и CPU subscription сервера на 10k запросов /sub/<token>:
+без сжатия, gzip/br из кэша сжатых вариантов, сжатие на каждый запрос,
+повторный опрос с If-None-Match (304), форматы Clash/sing-box из кэша
+и без него, keep-alive против нового соединения.
+
+Использование:
+    python3 bench_compression.py [--servers 20] [--subscriptions 200] [--requests 10000]
+
+Во временной БД создаются подписки на servers серверах (payload растёт
+с числом серверов). Запросы к Flask приложению идут через test client
+(CPU - время процесса на запрос, без сети); keep-alive меряется на
+api/subscription_server.py, запущенном отдельным процессом на 127.0.0.1
+(SUB_HTTP_SERVER=werkzeug и gunicorn, если он установлен).
+"""
+import argparse
+import http.client
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+workdir = tempfile.mkdtemp()
+os.environ['DB_FILE'] = os.path.join(workdir, 'bench.db')
+os.environ['RATE_LIMIT_IP_RATE'] = '0'
+os.environ['RATE_LIMIT_TOKEN_RATE'] = '0'
+os.environ['TRAFFIC_CACHE_INTERVAL'] = '0'
+os.environ['SUB_READ_MODE'] = 'rw'
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import logging
+
+from api import subscription_server
+from api.compression import ENCODINGS, CompressedPayloads
+from api.database import init_database, add_server, import_uuid_pool
+from api.placement import AllServersPlacement
+from api.vpn_manager import VPNManager
+
+
+def seed(servers, subscriptions):
+    init_database()
+    for i in range(servers):
+        server_id = add_server(f"Server {i:02d} Frankfurt", f"203.0.113.{i + 1}", 443,
+                               'xZ0pK8mE3rQ1vT7yU5wI9oP2aS4dF6gH8jK0lZ2xC4v', max_users=subscriptions * 2)
+        import_uuid_pool([{'uuid': str(uuid.uuid4()), 'email': f"s{i}_{j:05d}"} for j in range(subscriptions)],
+                         server_id)
+    manager = VPNManager(placement=AllServersPlacement())
+    return [manager.create_subscription(100000 + i, f"user{i}", 30)['subscription_token']
+            for i in range(subscriptions)]
+
+
+def run(client, tokens, requests, headers_for):
+    """(байт тела, мкс CPU на запрос, статусы)"""
+    rng = random.Random(1)
+    body_bytes = 0
+    statuses = {}
+    started = time.process_time()
+    for _ in range(requests):
+        token = rng.choice(tokens)
+        response = client.get(f"/sub/{token}", headers=headers_for(token))
+        body_bytes += len(response.get_data())
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    cpu = time.process_time() - started
+    return body_bytes, cpu / requests * 1e6, statuses
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(http_server):
+    """api/subscription_server.py отдельным процессом (как в работе), ждёт /health"""
+    port = free_port()
+    env = dict(os.environ, SUB_HTTP_SERVER=http_server, SUBSCRIPTION_HOST='127.0.0.1',
+               SUBSCRIPTION_PORT=str(port))
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'api', 'subscription_server.py')],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/health')
+            conn.getresponse().read()
+            conn.close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Сервер {http_server} не запустился")
+
+
+def server_cpu(pid):
+    """CPU процесса и его потомков (воркер gunicorn), секунды"""
+    total = 0.0
+    ticks = os.sysconf('SC_CLK_TCK')
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # fields[1] - ppid, [11], [12] - utime, stime
+        if int(entry) == pid or int(fields[1]) == pid:
+            total += (int(fields[11]) + int(fields[12])) / ticks
+    return total
+
+
+def keep_alive(tokens, requests, http_server, reuse):
+    """(запросов/с, мкс CPU сервера на запрос, соединений): одно соединение на все запросы или новое на каждый"""
+    process, port = start_server(http_server)
+    rng = random.Random(1)
+    conn = None
+    connections = 0
+    cpu_started = server_cpu(process.pid)
+    started = time.perf_counter()
+    try:
+        for _ in range(requests):
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port)
+                connections += 1
+            conn.request('GET', f"/sub/{rng.choice(tokens)}", headers={'Accept-Encoding': 'gzip'})
+            response = conn.getresponse()
+            response.read()
+            if not reuse or response.will_close:
+                conn.close()
+                conn = None
+        elapsed = time.perf_counter() - started
+        cpu = server_cpu(process.pid) - cpu_started
+    finally:
+        if conn is not None:
+            conn.close()
+        process.terminate()
+        process.wait()
+    return requests / elapsed, cpu / requests * 1e6, connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сжатие и keep-alive subscription сервера")
+    parser.add_argument('--servers', type=int, default=20)
+    parser.add_argument('--subscriptions', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--http-requests', type=int, default=3000)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    tokens = seed(args.servers, args.subscriptions)
+    client = subscription_server.app.test_client()
+    payload = subscription_server.repository.load_subscription(tokens[0])['payload']
+    print(f"{args.subscriptions} подписок по {args.servers} серверов, payload {len(payload)} байт, "
+          f"{args.requests} запросов, сжатия: {', '.join(ENCODINGS)}")
+
+    etags = {}
+
+    def conditional(token):
+        if token not in etags:
+            etags[token] = client.get(f"/sub/{token}", headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+        return {'Accept-Encoding': 'gzip', 'If-None-Match': etags[token]}
+
+    cache = subscription_server.compressed_payloads
+    # (название, кэш, заголовки запроса, доля запросов) - br на каждый запрос
+    # меряется на части запросов: quality 11 стоит миллисекунды
+    modes = [
+        ('без сжатия', cache, lambda token: {}, 1),
+        ('gzip, сжатие на запрос', CompressedPayloads(max_size=0), lambda token: {'Accept-Encoding': 'gzip'}, 1),
+        ('gzip из кэша', cache, lambda token: {'Accept-Encoding': 'gzip'}, 1),
+    ]
+    if 'br' in ENCODINGS:
+        modes += [
+            ('br, сжатие на запрос', CompressedPayloads(max_size=0), lambda token: {'Accept-Encoding': 'br'}, 0.1),
+            ('br из кэша', cache, lambda token: {'Accept-Encoding': 'gzip, deflate, br'}, 1),
+        ]
+    modes.append(('304 (If-None-Match)', cache, conditional, 1))
+    # Форматы api/sub_formats.py: модель серверов и текст - раз на версию подписки
+    clash = {'User-Agent': 'clash.meta/1.18', 'Accept-Encoding': 'gzip'}
+    singbox = {'User-Agent': 'SFA/1.10.0', 'Accept-Encoding': 'gzip'}
+    modes += [
+        ('sing-box без кэша', CompressedPayloads(max_size=0, encodings=()), lambda token: singbox, 1),
+        ('sing-box из кэша, gzip', cache, lambda token: singbox, 1),
+        ('clash из кэша, gzip', cache, lambda token: clash, 1),
+    ]
+
+    # Кэш заполняется заранее: сжатие - раз на версию подписки, не на запрос
+    warmup = time.process_time()
+    for token in tokens:
+        for encoding in cache.encodings:
+            for fmt in ('base64', 'clash', 'singbox'):
+                client.get(f"/sub/{token}?format={fmt}", headers={'Accept-Encoding': encoding})
+    print(f"Заполнение кэша: {cache.stats['compressions']} сжатий, {cache.stats['renders']} форматов, "
+          f"{(time.process_time() - warmup) / len(tokens) * 1e3:.1f} мс CPU на подписку")
+
+    print(f"{'':>24}  тело на 10k запросов, CPU на запрос и на 10k")
+    baseline = None
+    for name, payloads, headers_for, share in modes:
+        subscription_server.compressed_payloads = payloads
+        requests = max(int(args.requests * share), 1)
+        body_bytes, cpu_us, statuses = run(client, tokens, requests, headers_for)
+        per_10k = body_bytes * 10000 / requests
+        baseline = baseline or per_10k
+        print(f"{name:>24}: {per_10k / 2**20:6.2f} МБ ({per_10k / baseline:6.1%}), "
+              f"CPU {cpu_us:6.0f} мкс = {cpu_us * 10000 / 1e6:6.2f} с, статусы {statuses}")
+    subscription_server.compressed_payloads = cache
+
+    print(f"== HTTP, {args.http_requests} запросов подряд одним клиентом ==")
+    for name, http_server, reuse in (
+        ('werkzeug (было)', 'werkzeug', True),
+        ('gunicorn, соединение на запрос', 'gunicorn', False),
+        ('gunicorn, keep-alive', 'gunicorn', True),
+    ):
+        try:
+            rate, cpu_us, connections = keep_alive(tokens, args.http_requests, http_server, reuse)
+        except RuntimeError as e:
+            print(f"{name:>32}: {e}")
+            continue
+        print(f"{name:>32}: {rate:.0f} запросов/с, CPU сервера {cpu_us:.0f} мкс/запрос, "
+              f"соединений {connections}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный прогон платежей (api/payments.py) с фейковым провайдером.
+
+Использование:
+    python3 bench_payments.py [--users 1000] [--double-click 0.3] [--duplicates 0.3] [--concurrency 16]
+
+Во временной БД: subscription сервер принимает webhook'и,
+scripts/fake_payment_provider.py "оплачивает" платежи сразу и часть
+webhook'ов доставляет дважды, пользователи часть кнопок нажимают дважды.
+Воркер выдаёт подписки из outbox. В конце проверяется, что на каждого
+пользователя выдана ровно одна подписка.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+SECRET = 'bench-secret'
+workdir = tempfile.mkdtemp()
+os.environ.update({
+    'DB_FILE': os.path.join(workdir, 'vpn.db'),
+    'SUB_READ_MODE': 'rw',
+    'TRAFFIC_CACHE_INTERVAL': '0',
+    'PAYMENT_PROVIDER': 'fake',
+    'PAYMENT_WEBHOOK_SECRET': SECRET,
+    'RATE_LIMIT_IP_RATE': '100000',
+    'RATE_LIMIT_IP_BURST': '100000',
+})
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+from werkzeug.serving import make_server
+
+from bot.config import DB_FILE, PRICES, PLAN_DAYS
+from api.database import init_database, add_server, import_uuid_pool
+from api.vpn_manager import VPNManager
+from api.repository import SQLiteRepository
+from api.payments import PaymentLedger, ProvisioningWorker, get_payment_provider, PENDING
+from scripts.fake_payment_provider import FakePaymentProvider
+
+
+def seed(users):
+    init_database()
+    for i in range(2):
+        server_id = add_server(f"Bench {i}", f"10.0.0.{i + 1}", 443, 'pk', max_users=users * 2)
+        import_uuid_pool([{'uuid': str(uuid.uuid4()), 'email': f"pool_{j:05d}"} for j in range(users * 2)], server_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон платежей")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--double-click', type=float, default=0.3)
+    parser.add_argument('--duplicates', type=float, default=0.3)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--batch', type=int, default=100)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    seed(args.users)
+
+    from api.subscription_server import app
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    webhook_url = f"http://127.0.0.1:{server.server_port}/payments/webhook"
+
+    provider_service = FakePaymentProvider(webhook_url, SECRET, auto_pay=True,
+                                           duplicate_rate=args.duplicates, seed=1).start()
+    provider = get_payment_provider('fake', provider_service.base_url, SECRET)
+    ledger = PaymentLedger(SQLiteRepository(DB_FILE))
+    worker = ProvisioningWorker(ledger, VPNManager(), batch_size=args.batch)
+    rng = random.Random(1)
+
+    def click(user, message_id, plan):
+        key = f"buy:{user}:{message_id}:{plan}"
+        payment = ledger.create(key, user, f"user{user}", plan, PRICES[plan], PLAN_DAYS[plan], provider.name)
+        if payment['status'] == PENDING:
+            provider_payment_id, _ = provider.create_checkout(payment)
+            ledger.attach_provider_id(payment['id'], provider_payment_id)
+
+    clicks = []
+    for user in range(1, args.users + 1):
+        plan = rng.choice(list(PLAN_DAYS))
+        clicks.append((user, 1000 + user, plan))
+        if rng.random() < args.double_click:
+            clicks.append((user, 1000 + user, plan))
+    rng.shuffle(clicks)
+
+    provisioned = []
+    stop = threading.Event()
+
+    def run_worker():
+        while not stop.is_set():
+            provisioned.extend(worker.run_once())
+            time.sleep(0.05)
+
+    worker_thread = threading.Thread(target=run_worker)
+    started = time.perf_counter()
+    worker_thread.start()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda c: click(*c), clicks))
+    provider_service.wait_idle()
+    while ledger.claim(1):
+        time.sleep(0.05)
+    stop.set()
+    worker_thread.join()
+    elapsed = time.perf_counter() - started
+
+    conn = sqlite3.connect(DB_FILE)
+    subscriptions = conn.execute("SELECT COUNT(*) FROM subscriptions").fetchone()[0]
+    per_user = conn.execute("""
+        SELECT MAX(cnt) FROM (
+            SELECT COUNT(*) cnt FROM subscriptions GROUP BY user_id
+        )
+    """).fetchone()[0]
+    statuses = dict(conn.execute("SELECT status, COUNT(*) FROM payments GROUP BY status").fetchall())
+    conn.close()
+
+    stats = provider_service.stats
+    print(f"Нажатий: {len(clicks)} ({len(clicks) - args.users} повторных), "
+          f"webhook'ов доставлено: {stats['webhooks']} ({stats['duplicates']} дублей)")
+    print(f"Платежи: {statuses}")
+    print(f"Подписок: {subscriptions}, максимум на пользователя: {per_user}, выдано воркером: {len(provisioned)}")
+    print(f"Время: {elapsed:.2f}с ({args.users / elapsed:.0f} оплат/с)")
+    ok = subscriptions == args.users and per_user == 1
+    print("OK: двойных выдач нет" if ok else "ОШИБКА: число подписок не совпадает с числом оплат")
+
+    provider_service.stop()
+    server.shutdown()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Прогон рассылки напоминаний (bot/reminders.py) против фейкового Bot API.
+
+Использование:
+    python3 bench_reminders.py [--users 500] [--global-rate 25] [--api-rate 30] [--workers 8]
+
+Создаёт временную БД с users подписками, истекающими в ближайшие сутки,
+отправляет напоминания через scripts/fake_bot_api.py (который отвечает 429
+при превышении лимитов, как Telegram) и печатает время, число отправок
+и полученных 429. Второй проход проверяет, что повторных отправок нет.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+os.environ['DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'vpn.db')
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from bot.config import DB_FILE
+from api.database import init_database
+from api.vpn_manager import VPNManager
+from bot.reminders import ReminderBroadcaster
+from scripts.fake_bot_api import FakeBotAPI
+
+
+def seed(vpn_manager, users):
+    conn = sqlite3.connect(DB_FILE)
+    now = datetime.now()
+    try:
+        for i in range(users):
+            cursor = conn.execute("INSERT INTO users (telegram_id, username) VALUES (?, ?)",
+                                  (100000 + i, f"user{i}"))
+            expires_at = now + timedelta(minutes=10 + i % (23 * 60))
+            conn.execute("""
+                INSERT INTO subscriptions (user_id, uuid, subscription_token, expires_at, is_active)
+                VALUES (?, ?, ?, ?, 1)
+            """, (cursor.lastrowid, str(uuid.uuid4()), f"token{i}", expires_at.strftime('%Y-%m-%d %H:%M:%S')))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+async def run(args):
+    init_database()
+    vpn_manager = VPNManager()
+    seed(vpn_manager, args.users)
+
+    api = FakeBotAPI(global_rate=args.api_rate, per_chat_rate=1).start()
+    bot = Bot('123456:TEST', base_url=api.base_url,
+              request=HTTPXRequest(connection_pool_size=args.workers))
+    async with bot:
+        broadcaster = ReminderBroadcaster(bot, vpn_manager, global_rate=args.global_rate,
+                                          workers=args.workers)
+        first = await broadcaster.run_once()
+        print(f"Первый проход: {first['sent']} отправлено, {first['failed']} ошибок, "
+              f"{first['retry_after']} ответов 429 за {first['seconds']}с "
+              f"({first['sent'] / max(first['seconds'], 0.001):.1f} сообщ/с)")
+
+        # Новый экземпляр - как после перезапуска бота
+        restarted = ReminderBroadcaster(bot, vpn_manager, global_rate=args.global_rate,
+                                        workers=args.workers)
+        second = await restarted.run_once()
+        print(f"Повторный проход: {second['sent']} отправлено")
+
+    print(f"Фейковый API: {api.calls['sendMessage']} вызовов sendMessage, {api.rejected} отклонено по лимиту")
+    api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Прогон рассылки напоминаний")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--global-rate', type=float, default=25)
+    parser.add_argument('--api-rate', type=int, default=30)
+    parser.add_argument('--workers', type=int, default=8)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
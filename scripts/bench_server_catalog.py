@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Стоимость чтения серверов через VPNManager и задержка, с которой
+сервер, добавленный другим процессом (scripts/add_server.py), становится
+виден работающему процессу.
+
+Использование:
+    python3 bench_server_catalog.py [--servers 50] [--subscriptions 20000] [--calls 2000]
+
+Во временной БД создаются servers серверов с пулами UUID и subscriptions
+активных подписок (по 3 сервера на подписку), затем меряется время
+вызова get_server_by_id, get_available_servers, get_all_servers,
+get_pool_stats и get_placement_candidates.
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+workdir = tempfile.mkdtemp()
+os.environ['DB_FILE'] = os.path.join(workdir, 'bench.db')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import logging
+import sqlite3
+
+from bot.config import DB_FILE
+from api.database import init_database, add_server
+from api.uuid_blob import to_db
+from api.vpn_manager import VPNManager
+
+
+def seed(servers, subscriptions):
+    init_database()
+    server_ids = [add_server(f"Server {i:02d}", f"203.0.113.{i + 1}", 443, f"pk{i}", max_users=subscriptions)
+                  for i in range(servers)]
+    rng = random.Random(1)
+    conn = sqlite3.connect(DB_FILE)
+    conn.executemany("INSERT INTO uuid_pool (uuid, email, server_id, is_used) VALUES (?, ?, ?, ?)", [
+        (to_db(str(uuid.uuid4())), f"s{server_id}_{j}", server_id, int(j < subscriptions // 10))
+        for server_id in server_ids for j in range(500)
+    ])
+    conn.executemany("INSERT INTO users (telegram_id) VALUES (?)", [(100000 + i,) for i in range(subscriptions)])
+    conn.executemany("""
+        INSERT INTO subscriptions (user_id, uuid, subscription_token, expires_at)
+        VALUES (?, ?, ?, '2030-01-01 00:00:00')
+    """, [(i + 1, to_db(str(uuid.uuid4())), to_db(str(uuid.uuid4()))) for i in range(subscriptions)])
+    conn.executemany("""
+        INSERT INTO subscription_servers (subscription_id, server_id, config_link) VALUES (?, ?, 'vless://x')
+    """, [(i + 1, server_id) for i in range(subscriptions) for server_id in rng.sample(server_ids, 3)])
+    conn.commit()
+    conn.close()
+    return server_ids
+
+
+def measure(fn, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Каталог серверов: чтения и распространение изменений")
+    parser.add_argument('--servers', type=int, default=50)
+    parser.add_argument('--subscriptions', type=int, default=20000)
+    parser.add_argument('--calls', type=int, default=2000)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    server_ids = seed(args.servers, args.subscriptions)
+    manager = VPNManager()
+    rng = random.Random(2)
+
+    print(f"{args.servers} серверов, {args.subscriptions} подписок, {args.calls} вызовов")
+    for name, fn, calls in (
+        ('get_server_by_id', lambda: manager.get_server_by_id(rng.choice(server_ids)), args.calls * 10),
+        ('get_available_servers', manager.get_available_servers, args.calls),
+        ('get_all_servers', manager.get_all_servers, args.calls),
+        ('get_pool_stats', manager.get_pool_stats, args.calls),
+        ('get_placement_candidates', manager.get_placement_candidates, args.calls),
+    ):
+        fn()
+        print(f"{name:>26}: {measure(fn, calls):8.1f} мкс")
+
+    # Сервер добавляет другой процесс - через сколько его видит этот
+    before = {s['id'] for s in manager.get_all_servers()}
+    started = time.monotonic()
+    subprocess.run([sys.executable, os.path.join(ROOT, 'scripts', 'add_server.py'),
+                    'New server', '198.51.100.1', '443', 'pk-new'],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    added = time.monotonic()
+    while not {s['id'] for s in manager.get_all_servers()} - before:
+        if time.monotonic() - added > 60:
+            print("Новый сервер не появился за 60с")
+            sys.exit(1)
+        time.sleep(0.05)
+    print(f"Сервер из add_server.py виден через {time.monotonic() - added:.2f}с после его завершения "
+          f"(сам скрипт {added - started:.2f}с)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк холодного старта бота и subscription сервера.
+
+Использование:
+    python3 bench_startup.py [--runs 5] [--top 10] [module ...]
+
+Для каждого модуля (по умолчанию api.subscription_server и bot.main)
+запускает `python -X importtime -c "import <module>"` в отдельном процессе
+и печатает медиану времени импорта, вклад модулей проекта и самые тяжёлые
+импорты. Затем сравнивает init_database() на новой и на уже
+инициализированной БД (проверка версии схемы вместо DDL).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = ['api.subscription_server', 'bot.main']
+PROJECT_PACKAGES = ('api', 'bot')
+
+
+def parse_importtime(stderr):
+    """Вывод -X importtime -> [(module, self_us, cumulative_us, depth)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def measure(module, env):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return wall, parse_importtime(result.stderr)
+
+
+def bench_module(module, runs, top, env):
+    walls, imports, own = [], [], []
+    rows = []
+    for _ in range(runs):
+        wall, rows = measure(module, env)
+        walls.append(wall * 1000)
+        imports.append(next(r[2] for r in rows if r[0] == module) / 1000)
+        own.append(sum(r[1] for r in rows if r[0].split('.')[0] in PROJECT_PACKAGES) / 1000)
+
+    print(f"{module}: процесс {statistics.median(walls):.0f} мс, "
+          f"импорт {statistics.median(imports):.0f} мс, "
+          f"из них модули проекта {statistics.median(own):.1f} мс, "
+          f"всего модулей {len(rows)}")
+
+    # Самые тяжёлые импорты верхнего уровня последнего прогона
+    heavy = sorted((r for r in rows if r[3] <= 1 and r[0] != module), key=lambda r: -r[2])
+    for name, _, cumulative_us, _ in heavy[:top]:
+        print(f"    {cumulative_us / 1000:8.1f} мс  {name}")
+
+
+def bench_init_database(env):
+    """init_database() на новой БД и повторный вызов на готовой"""
+    code = (
+        "import time\n"
+        "t = time.perf_counter()\n"
+        "from api.database import init_database\n"
+        "init_database()\n"
+        "print((time.perf_counter() - t) * 1000)\n"
+    )
+    timings = []
+    for _ in range(2):
+        result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                                capture_output=True, text=True, check=True)
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    print(f"init_database: новая БД {timings[0]:.1f} мс, готовая БД {timings[1]:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк холодного старта")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, DB_FILE=os.path.join(workdir, 'vpn.db'),
+               USAGE_DB_FILE=os.path.join(workdir, 'usage.db'))
+
+    bench_init_database(env)
+    for module in args.modules:
+        bench_module(module, args.runs, args.top, env)
+
+
+if __name__ == "__main__":
+    main()
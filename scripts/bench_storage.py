@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Проверка совместимости и бенчмарк реализаций хранилища (api/repository.py).
+
+Использование:
+    python3 bench_storage.py [--dsn postgresql://user@127.0.0.1/vpn] [--purchases 2000] [--concurrency 32]
+
+Один и тот же сценарий прогоняется на каждой реализации: SQLite (временный
+файл; в бенчмарке - с очередью группового коммита и без) и, если задан --dsn,
+PostgreSQL (во временной схеме, которая удаляется в конце). Сначала
+проверки поведения через VPNManager - создание, продление, повторная выдача
+по одному платежу, истечение, статистика, /sub/<token>; затем параллельные
+покупки и чтения подписок с проверкой, что UUID пула не выдан дважды.
+
+Локальный PostgreSQL для прогона, например:
+    docker run --rm -p 5432:5432 -e POSTGRES_HOST_AUTH_METHOD=trust postgres:16
+    python3 bench_storage.py --dsn postgresql://postgres@127.0.0.1/postgres
+"""
+import argparse
+import base64
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+
+from api.placement import AllServersPlacement
+from api.repository import SQLiteRepository, get_repository, DATE_FORMAT
+from api.vpn_manager import VPNManager
+from api.write_queue import WriteQueue
+
+
+def make_pool(count, prefix):
+    return [{'uuid': str(uuid.uuid4()), 'email': f"{prefix}_{j:06d}"} for j in range(count)]
+
+
+def seed(repo, pool_size, max_users):
+    server_ids = [repo.add_server(f"Bench {i}", f"10.0.0.{i + 1}", 443, f"pk{i}", max_users=max_users)
+                  for i in range(2)]
+    for server_id in server_ids:
+        repo.import_uuid_pool(make_pool(pool_size, f"s{server_id}"), server_id)
+    return server_ids
+
+
+def insert_payment(repo, key, telegram_id):
+    return repo.transaction(lambda conn: repo._insert(conn, """
+        INSERT INTO payments (idempotency_key, telegram_id, plan, amount, duration_days, provider, status)
+        VALUES (?, ?, '1_month', 100, 30, 'none', 'confirmed')
+    """, (key, telegram_id)))
+
+
+def conformance(repo):
+    """[(проверка, прошла ли, подробности)]"""
+    checks = []
+
+    def check(name, ok, detail=''):
+        checks.append((name, bool(ok), detail))
+
+    check("init_schema: первая инициализация", repo.init_schema(log=lambda *_: None))
+    check("init_schema: повторно ничего не меняет", not repo.init_schema(log=lambda *_: None))
+
+    server_ids = seed(repo, 5, 60)
+    check("add_server: разные id", len(set(server_ids)) == 2, server_ids)
+    check("get_server", (repo.get_server(server_ids[0]) or {}).get('name') == "Bench 0")
+    check("get_server: нет такого", repo.get_server(10 ** 6) is None)
+    duplicate = repo.import_uuid_pool([{'uuid': make_pool(1, 'x')[0]['uuid'], 'email': 'x'}] * 2, server_ids[0])
+    check("import_uuid_pool: дубликаты пропускаются", duplicate == 1, duplicate)
+
+    manager = VPNManager(placement=AllServersPlacement(), repository=repo)
+    events = []
+    manager.add_listener(lambda event, data: events.append(event))
+
+    check("available_servers", [s['current_users'] for s in manager.get_available_servers()] == [0, 0])
+    check("placement_candidates: пул",
+          sorted(s['pool_free'] for s in manager.get_placement_candidates()) == [5, 6])
+
+    created = manager.create_subscription(1001, 'alice', 30)
+    check("create_subscription", created and len(created['config_links']) == 2, created and created['server_name'])
+    check("create_subscription: событие", events == ['created'], events)
+    check("pool_stats: UUID заняты", sorted(s['free'] for s in manager.get_pool_stats()) == [4, 5])
+    check("all_servers: current_users", [s['current_users'] for s in manager.get_all_servers()] == [1, 1])
+
+    active = manager.get_active_subscription(1001)
+    check("get_active_subscription",
+          active and active['subscription_token'] == created['subscription_token']
+          and active['config_links'] == created['config_links'])
+    check("get_active_subscription: нет подписки", manager.get_active_subscription(999) is None)
+
+    loaded = repo.load_subscription(created['subscription_token'])
+    links = base64.b64decode(loaded['payload']).decode('utf-8').split('\n') if loaded else []
+    check("load_subscription", loaded and loaded['is_active'] and loaded['servers'] == 2
+          and sorted(links) == sorted(created['config_links']))
+    check("load_subscription: нет токена", repo.load_subscription('missing') is None)
+    servers = repo.load_servers(created['subscription_token'])
+    check("load_servers: модель серверов",
+          [s['name'] for s in servers] == ["Bench 0", "Bench 1"]
+          and all(f"vless://{s['uuid']}@{s['ip']}:{s['port']}" in ' '.join(created['config_links']) for s in servers),
+          servers)
+
+    repo.transaction(lambda conn: conn.execute(
+        "INSERT INTO reminders_sent (subscription_id, kind, status) VALUES (?, '3d', 'sent')", (created['id'],)
+    ))
+    extended = manager.extend_subscription(created['id'], 10)
+    expected = (datetime.strptime(created['expires_at'], DATE_FORMAT) + timedelta(days=10)).strftime(DATE_FORMAT)
+    check("extend_subscription: срок от текущего окончания",
+          extended and extended['expires_at'] == expected, extended and extended['expires_at'])
+    check("extend_subscription: токен прежний",
+          extended and extended['subscription_token'] == created['subscription_token'])
+    reminders = repo._one("SELECT COUNT(*) as n FROM reminders_sent WHERE subscription_id = ?", (created['id'],))
+    check("extend_subscription: напоминания сброшены", reminders['n'] == 0)
+    check("extend_subscription: нет подписки", manager.extend_subscription(10 ** 6, 10) is None)
+
+    payment_id = insert_payment(repo, 'conformance-1', 1002)
+    paid = manager.create_subscription(1002, 'bob', 30, payment_id=payment_id)
+    free_after = sorted(s['free'] for s in manager.get_pool_stats())
+    again = manager.create_subscription(1002, 'bob', 30, payment_id=payment_id)
+    check("create_subscription: по платежу", paid is not None)
+    check("create_subscription: платёж не выдаётся дважды",
+          again is None and sorted(s['free'] for s in manager.get_pool_stats()) == free_after)
+    check("extend_subscription: платёж не выдаётся дважды",
+          manager.extend_subscription(paid['id'], 30, payment_id=payment_id) is None)
+
+    past = (datetime.now(timezone.utc) - timedelta(days=1)).strftime(DATE_FORMAT)
+    repo.transaction(lambda conn: repo.set_expires_at(conn, paid['id'], past))
+    check("check_expired_subscriptions", manager.check_expired_subscriptions() == 1)
+    # В пул возвращается UUID клиента каждого сервера подписки
+    check("deactivate: UUID возвращён в пул", sorted(s['free'] for s in manager.get_pool_stats()) == [4, 5])
+    expired = repo.load_subscription(paid['subscription_token'])
+    check("load_subscription: неактивная", expired and not expired['is_active'] and expired['payload'] is None)
+    check("deactivate_subscription: нет подписки", manager.deactivate_subscription(10 ** 6) is False)
+
+    stats = manager.get_stats()
+    check("get_stats", stats == {'total_users': 2, 'active_subscriptions': 1, 'active_servers': 2,
+                                 'free_uuids': 9}, stats)
+    check("события", events == ['created', 'extended', 'created', 'deactivated'], events)
+    return checks
+
+
+def benchmark(repo, purchases, concurrency, lookups):
+    repo.init_schema(log=lambda *_: None)
+    seed(repo, purchases, purchases * 2)
+    manager = VPNManager(placement=AllServersPlacement(), repository=repo)
+
+    def buy(user):
+        return manager.create_subscription(100000 + user, f"user{user}", 30)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = [r for r in pool.map(buy, range(purchases)) if r]
+    buy_elapsed = time.perf_counter() - started
+
+    duplicates = repo._one("""
+        SELECT COUNT(*) as n FROM (
+            SELECT uuid FROM subscriptions GROUP BY uuid HAVING COUNT(*) > 1
+        ) d
+    """)['n']
+    used = repo._one("SELECT COUNT(*) as n FROM uuid_pool WHERE is_used = 1")['n']
+    links = repo._one("SELECT COUNT(*) as n FROM subscription_servers")['n']
+
+    rng = random.Random(1)
+    tokens = [rng.choice(results)['subscription_token'] for _ in range(lookups)] if results else []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        found = sum(1 for r in pool.map(repo.load_subscription, tokens) if r)
+    lookup_elapsed = time.perf_counter() - started
+
+    return {
+        'purchases': len(results),
+        'buy_rate': len(results) / buy_elapsed,
+        'lookup_rate': found / lookup_elapsed if lookup_elapsed else 0,
+        'ok': duplicates == 0 and used == links and len(results) == purchases and found == len(tokens),
+        'detail': f"дублей UUID {duplicates}, UUID занято {used} / связей {links}"
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Совместимость и бенчмарк хранилищ")
+    parser.add_argument('--dsn', help="PostgreSQL, например postgresql://postgres@127.0.0.1/postgres")
+    parser.add_argument('--purchases', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    workdir = tempfile.mkdtemp()
+    schemas = []
+
+    def backends(name):
+        """(название, фабрика хранилища, закрытие)"""
+        db_file = os.path.join(workdir, f"{name}.db")
+        yield 'sqlite', lambda: SQLiteRepository(db_file), None
+        if name == 'bench':
+            queue = WriteQueue(f"{db_file}.queue", max_delay=0.005)
+            yield 'sqlite+queue', lambda: SQLiteRepository(f"{db_file}.queue", queue), queue.close
+        if args.dsn:
+            schema = f"{name}_{os.getpid()}"
+            schemas.append(schema)
+            repo = get_repository(args.dsn, pool_size=args.concurrency, schema=schema)
+            yield 'postgresql', lambda: repo, repo.close
+
+    failed = 0
+    print("== Совместимость ==")
+    for backend, factory, close in backends('conformance'):
+        checks = conformance(factory())
+        bad = [c for c in checks if not c[1]]
+        failed += len(bad)
+        print(f"{backend:>13}: {len(checks) - len(bad)}/{len(checks)} проверок")
+        for name, _, detail in bad:
+            print(f"{'':>15}ОШИБКА {name}: {detail}")
+        if close:
+            close()
+
+    print(f"== Бенчмарк: {args.purchases} покупок, {args.lookups} чтений, {args.concurrency} потоков ==")
+    for backend, factory, close in backends('bench'):
+        repo = factory()
+        if backend == 'sqlite+queue':
+            SQLiteRepository(repo.db_file).init_schema(log=lambda *_: None)
+        result = benchmark(repo, args.purchases, args.concurrency, args.lookups)
+        failed += 0 if result['ok'] else 1
+        print(f"{backend:>13}: покупок {result['buy_rate']:.0f}/с, чтений /sub {result['lookup_rate']:.0f}/с, "
+              f"{result['detail']}{'' if result['ok'] else ' - ОШИБКА'}")
+        if close:
+            close()
+
+    if schemas:
+        repo = get_repository(args.dsn, pool_size=1)
+        for schema in schemas:
+            repo.transaction(lambda conn: conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        repo.close()
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Размер индексов и задержка поиска подписки по токену: TEXT против 16-байтного BLOB.
+
+Использование:
+    python3 bench_token_index.py [--rows 1000000] [--lookups 100000]
+
+Для каждого варианта строится таблица subscriptions на rows строк
+(схема vpn.db) и меряются:
+    размер таблицы и индексов (dbstat), размер файла;
+    задержка запроса /sub/<token> (как sub_snapshot.load_subscription)
+    для существующих и несуществующих токенов, p50/p99, отдельно - цена
+    преобразования токена в BLOB на краю API, и запросов/с с ним.
+
+Варианты:
+    text     - 36-символьные строки (до миграции 7)
+    blob     - 16 байт (api/uuid_blob.py, после миграции 7)
+    int_hash - 16 байт + INTEGER ключ из первых 8 байт токена с обычным
+               индексом вместо UNIQUE индекса по токену
+    migrated - text, переведённый миграцией 7 на месте (без VACUUM)
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.migrations import Migrator, m007_uuid_blobs
+from api.uuid_blob import to_db
+
+DDL = """
+    CREATE TABLE subscriptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        uuid {type} UNIQUE NOT NULL,
+        subscription_token {type} UNIQUE NOT NULL,
+        is_active INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP NOT NULL
+    )
+"""
+
+INT_HASH_DDL = """
+    CREATE TABLE subscriptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        uuid BLOB UNIQUE NOT NULL,
+        subscription_token BLOB NOT NULL,
+        token_key INTEGER NOT NULL,
+        is_active INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP NOT NULL
+    );
+    CREATE INDEX idx_subscriptions_token_key ON subscriptions (token_key)
+"""
+
+
+def token_key(token_bytes):
+    return int.from_bytes(token_bytes[:8], 'big', signed=True)
+
+
+def build(path, variant, tokens, uuids):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    if variant == 'int_hash':
+        conn.executescript(INT_HASH_DDL)
+    else:
+        conn.execute(DDL.format(type='BLOB' if variant == 'blob' else 'TEXT'))
+    if variant == 'migrated':
+        conn.execute("CREATE TABLE uuid_pool (id INTEGER PRIMARY KEY, uuid TEXT NOT NULL)")
+
+    expires = '2030-01-01 00:00:00'
+    batch = []
+    for i, (token, client_uuid) in enumerate(zip(tokens, uuids)):
+        if variant == 'int_hash':
+            raw = to_db(token)
+            batch.append((i, to_db(client_uuid), raw, token_key(raw), expires))
+        elif variant == 'blob':
+            batch.append((i, to_db(client_uuid), to_db(token), expires))
+        else:
+            batch.append((i, client_uuid, token, expires))
+        if len(batch) >= 50000:
+            insert(conn, variant, batch)
+            batch = []
+    if batch:
+        insert(conn, variant, batch)
+    conn.commit()
+
+    if variant == 'migrated':
+        m007_uuid_blobs(Migrator(conn, pause=0, log=lambda *_: None))
+        conn.commit()
+    conn.close()
+
+
+def insert(conn, variant, batch):
+    if variant == 'int_hash':
+        conn.executemany("""
+            INSERT INTO subscriptions (user_id, uuid, subscription_token, token_key, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, batch)
+    else:
+        conn.executemany("""
+            INSERT INTO subscriptions (user_id, uuid, subscription_token, expires_at)
+            VALUES (?, ?, ?, ?)
+        """, batch)
+
+
+def sizes(path):
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("""
+            SELECT name, SUM(pgsize) FROM dbstat
+            WHERE name NOT LIKE 'sqlite_%' OR name LIKE 'sqlite_autoindex_%'
+            GROUP BY name
+        """).fetchall()
+    finally:
+        conn.close()
+    table = sum(size for name, size in rows if name == 'subscriptions')
+    indexes = {name: size for name, size in rows if name != 'subscriptions'}
+    return table, indexes, os.path.getsize(path)
+
+
+def lookup_query(variant):
+    if variant == 'int_hash':
+        return ("SELECT id, is_active, expires_at FROM subscriptions "
+                "WHERE token_key = ? AND subscription_token = ?")
+    return "SELECT id, is_active, expires_at FROM subscriptions WHERE subscription_token = ?"
+
+
+def measure(path, variant, probes):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    query = lookup_query(variant)
+    latencies = []
+    conversions = []
+    found = 0
+    for token in probes:
+        started = time.perf_counter()
+        if variant == 'text':
+            params = (token,)
+        else:
+            value = to_db(token)
+            params = (token_key(value), value) if variant == 'int_hash' else (value,)
+        converted = time.perf_counter()
+        row = conn.execute(query, params).fetchone()
+        latencies.append(time.perf_counter() - converted)
+        conversions.append(converted - started)
+        found += row is not None
+    conn.close()
+    latencies.sort()
+    return {
+        'found': found,
+        'p50': latencies[len(latencies) // 2] * 1e6,
+        'p99': latencies[int(len(latencies) * 0.99)] * 1e6,
+        'rate': len(latencies) / (sum(latencies) + sum(conversions)),
+        'convert': statistics.mean(conversions) * 1e6
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TEXT против BLOB для токенов подписок")
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--variants', default='text,blob,int_hash,migrated')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    tokens = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(args.rows)]
+    uuids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(args.rows)]
+    hits = [rng.choice(tokens) for _ in range(args.lookups // 2)]
+    misses = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(args.lookups // 2)]
+    probes = hits + misses
+    rng.shuffle(probes)
+
+    workdir = tempfile.mkdtemp()
+    print(f"{args.rows} строк, {len(probes)} поисков (половина - несуществующие токены)")
+    for variant in args.variants.split(','):
+        path = os.path.join(workdir, f"{variant}.db")
+        started = time.perf_counter()
+        build(path, variant, tokens, uuids)
+        build_time = time.perf_counter() - started
+
+        table, indexes, file_size = sizes(path)
+        result = measure(path, variant, probes)
+        index_total = sum(indexes.values())
+        print(f"{variant:>9}: файл {file_size / 2**20:.0f} МБ, таблица {table / 2**20:.0f} МБ, "
+              f"индексы {index_total / 2**20:.0f} МБ, построение {build_time:.1f}с")
+        for name, size in sorted(indexes.items()):
+            print(f"{'':>11}{name}: {size / 2**20:.1f} МБ")
+        print(f"{'':>11}запрос: p50 {result['p50']:.1f} мкс, p99 {result['p99']:.1f} мкс, "
+              f"преобразование токена {result['convert']:.2f} мкс, "
+              f"всего {result['rate']:.0f}/с, найдено {result['found']}/{len(hits)}")
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк хранилища трафика (api/usage_store.py): скорость записи и задержка запросов.
+
+Использование:
+    python3 bench_usage_store.py [--series 2000] [--hours 48] [--step 300]
+
+Пишет series рядов подписок с отсчётом каждые step секунд за hours часов
+(как сборщик с TRAFFIC_COLLECT_INTERVAL=step), затем меряет запросы
+за 24 часа и 30 дней, размер файла и количество чанков.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.usage_store import UsageStore, KIND_SUBSCRIPTION
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк хранилища трафика")
+    parser.add_argument('--series', type=int, default=2000)
+    parser.add_argument('--hours', type=int, default=48)
+    parser.add_argument('--step', type=int, default=300)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(), 'usage.db')
+    store = UsageStore(db_file)
+    rng = random.Random(1)
+
+    now = int(time.time())
+    start = now - args.hours * 3600
+    samples = 0
+    started = time.perf_counter()
+    for ts in range(start, now, args.step):
+        for key in range(args.series):
+            store.add(KIND_SUBSCRIPTION, key, ts, rng.randint(0, 10 ** 6), rng.randint(0, 10 ** 7))
+        samples += store.flush()
+    ingest = time.perf_counter() - started
+
+    print(f"Запись: {samples} отсчётов за {ingest:.2f}с ({samples / ingest:,.0f} отсчётов/с, "
+          f"{args.series} рядов, шаг {args.step}с)")
+
+    for label, length in (('24 часа', 86400), ('30 дней', 30 * 86400)):
+        latencies = []
+        for _ in range(args.queries):
+            key = rng.randrange(args.series)
+            t0 = time.perf_counter()
+            store.total(KIND_SUBSCRIPTION, key, now - length, now)
+            latencies.append((time.perf_counter() - t0) * 1000)
+        latencies.sort()
+        print(f"Запрос {label}: p50 {statistics.median(latencies):.3f} мс, "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.3f} мс")
+
+    conn = store._connect()
+    chunks = conn.execute("SELECT COUNT(*) FROM usage_chunks").fetchone()[0]
+    conn.close()
+    size = sum(os.path.getsize(db_file + suffix) for suffix in ('', '-wal') if os.path.exists(db_file + suffix))
+    print(f"Чанков: {chunks}, размер: {size / 1024 / 1024:.1f} МБ ({size / samples:.1f} байт/отсчёт)")
+
+
+if __name__ == "__main__":
+    main()
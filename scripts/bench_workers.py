@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Пропускная способность subscription сервера от числа процессов-воркеров
+gunicorn (SUB_HTTP_WORKERS): от 1 до числа ядер.
+
+Использование:
+    python3 bench_workers.py [--subscriptions 1000] [--servers 5] [--seconds 5] [--max-workers N]
+
+Во временной БД создаются подписки, бот (здесь - этот процесс) выгружает
+статическую карту и ведёт её по событиям VPNManager. Для каждого числа
+воркеров api/subscription_server.py запускается отдельным процессом в двух
+режимах чтения:
+    rw         - каждый воркер читает подписку из SQLite сам
+    static_map - все воркеры читают одну mmap карту (SUB_READ_MODE=static_map)
+Нагрузку дают clients процессов по connections keep-alive соединений
+(случайные токены, Accept-Encoding: gzip). Печатаются запросы/с,
+ускорение относительно одного воркера и CPU сервера на запрос.
+В конце - проверка единственного писателя: продление и деактивация
+подписки видны всем воркерам через check_interval читателя.
+
+Клиенты делят ядра с воркерами: на машине с C ядрами при W воркерах
+нагрузке достаётся C - W ядер, поэтому рост к W = C упирается в клиентов.
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+workdir = tempfile.mkdtemp()
+os.environ['DB_FILE'] = os.path.join(workdir, 'bench.db')
+os.environ['STATIC_MAP_BASE'] = os.path.join(workdir, 'static_map')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import logging
+
+from bot.config import DB_FILE, STATIC_MAP_BASE
+from api.database import init_database, add_server, import_uuid_pool
+from api.placement import AllServersPlacement
+from api.static_map import export_static_map
+from api.vpn_manager import VPNManager
+
+
+def seed(manager, servers, subscriptions):
+    init_database()
+    for i in range(servers):
+        server_id = add_server(f"Server {i:02d} Frankfurt", f"203.0.113.{i + 1}", 443,
+                               'xZ0pK8mE3rQ1vT7yU5wI9oP2aS4dF6gH8jK0lZ2xC4v', max_users=subscriptions * 2)
+        import_uuid_pool([{'uuid': str(uuid.uuid4()), 'email': f"s{i}_{j:05d}"} for j in range(subscriptions)],
+                         server_id)
+    return [manager.create_subscription(100000 + i, f"user{i}", 30) for i in range(subscriptions)]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, read_mode):
+    """api/subscription_server.py под gunicorn отдельным процессом, ждёт /health"""
+    port = free_port()
+    env = dict(os.environ, SUB_HTTP_SERVER='gunicorn', SUB_HTTP_WORKERS=str(workers), SUB_READ_MODE=read_mode,
+               SUBSCRIPTION_HOST='127.0.0.1', SUBSCRIPTION_PORT=str(port),
+               RATE_LIMIT_IP_RATE='0', RATE_LIMIT_TOKEN_RATE='0', TRAFFIC_CACHE_INTERVAL='0')
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'api', 'subscription_server.py')],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/health')
+            conn.getresponse().read()
+            conn.close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Сервер не запустился (pip install gunicorn)")
+
+
+def server_cpu(pid):
+    """CPU процесса и его потомков (воркеры gunicorn), секунды"""
+    total = 0.0
+    ticks = os.sysconf('SC_CLK_TCK')
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # fields[1] - ppid, [11], [12] - utime, stime
+        if int(entry) == pid or int(fields[1]) == pid:
+            total += (int(fields[11]) + int(fields[12])) / ticks
+    return total
+
+
+def client(port, tokens, connections, start_at, stop_at, seed_value, results):
+    """Процесс нагрузки: connections потоков, у каждого своё keep-alive соединение"""
+    counts = []
+
+    def run(n):
+        rng = random.Random(seed_value * 1000 + n)
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        done = errors = 0
+        while time.time() < start_at:
+            time.sleep(0.001)
+        while time.time() < stop_at:
+            conn.request('GET', f"/sub/{rng.choice(tokens)}", headers={'Accept-Encoding': 'gzip'})
+            response = conn.getresponse()
+            response.read()
+            if response.status == 200:
+                done += 1
+            else:
+                errors += 1
+            if response.will_close:
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.close()
+        counts.append((done, errors))
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((sum(c[0] for c in counts), sum(c[1] for c in counts)))
+
+
+def measure(workers, read_mode, tokens, args):
+    """(запросов/с, ошибок, мкс CPU сервера на запрос)"""
+    process, port = start_server(workers, read_mode)
+    try:
+        # Прогрев: каждый воркер открывает БД / mmap и заполняет кэш сжатия
+        warmup = time.time() + 1
+        start_at = warmup + 1.0
+        stop_at = start_at + args.seconds
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client, args=(port, tokens, args.connections, warmup,
+                                                                 start_at, n, results))
+                   for n in range(args.clients)]
+        for p in clients:
+            p.start()
+        for p in clients:
+            p.join()
+        for _ in clients:
+            results.get()
+
+        clients = [multiprocessing.Process(target=client, args=(port, tokens, args.connections, start_at,
+                                                                 stop_at, n, results))
+                   for n in range(args.clients)]
+        for p in clients:
+            p.start()
+        while time.time() < start_at:
+            time.sleep(0.001)
+        cpu_started = server_cpu(process.pid)
+        for p in clients:
+            p.join()
+        cpu = server_cpu(process.pid) - cpu_started
+        done = errors = 0
+        for _ in clients:
+            d, e = results.get()
+            done += d
+            errors += e
+    finally:
+        process.terminate()
+        process.wait()
+    return done / args.seconds, errors, cpu / max(done, 1) * 1e6
+
+
+def check_writer(manager, subscriptions, workers):
+    """Изменения единственного писателя (бот) видны во всех воркерах"""
+    process, port = start_server(workers, 'static_map')
+    try:
+        extended, deactivated = subscriptions[0], subscriptions[1]
+        manager.extend_subscription(extended['id'], 30)
+        manager.deactivate_subscription(deactivated['id'])
+        # Читатель сверяет индекс раз в check_interval (1 с)
+        time.sleep(1.5)
+        expires, statuses = set(), set()
+        for _ in range(workers * 20):
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            conn.request('GET', f"/sub/{extended['subscription_token']}")
+            response = conn.getresponse()
+            response.read()
+            expires.add(response.headers['Subscription-Userinfo'].rsplit('expire=', 1)[1])
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            conn.request('GET', f"/sub/{deactivated['subscription_token']}")
+            response = conn.getresponse()
+            response.read()
+            statuses.add(response.status)
+            conn.close()
+    finally:
+        process.terminate()
+        process.wait()
+    return expires, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Масштабирование subscription сервера по воркерам")
+    parser.add_argument('--subscriptions', type=int, default=1000)
+    parser.add_argument('--servers', type=int, default=5)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--clients', type=int, default=max(os.cpu_count() // 2, 1))
+    parser.add_argument('--connections', type=int, default=8)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    manager = VPNManager(placement=AllServersPlacement())
+    subscriptions = seed(manager, args.servers, args.subscriptions)
+    tokens = [s['subscription_token'] for s in subscriptions]
+
+    # Бот: полная выгрузка, дальше - обновления по событиям (как start_static_map)
+    writer = export_static_map(DB_FILE, STATIC_MAP_BASE)
+    manager.add_listener(writer.on_subscription_event)
+
+    print(f"{args.subscriptions} подписок по {args.servers} серверов, ядер {os.cpu_count()}, "
+          f"клиентов {args.clients} x {args.connections} соединений, {args.seconds:.0f}с на замер")
+    baseline = {}
+    for workers in range(1, args.max_workers + 1):
+        for read_mode in ('rw', 'static_map'):
+            rate, errors, cpu_us = measure(workers, read_mode, tokens, args)
+            baseline.setdefault(read_mode, rate)
+            print(f"воркеров {workers:2d}, {read_mode:>10}: {rate:7.0f} запросов/с "
+                  f"(x{rate / baseline[read_mode]:.2f} к одному воркеру), CPU сервера {cpu_us:5.0f} мкс/запрос"
+                  + (f", ошибок {errors}" if errors else ""))
+
+    expires, statuses = check_writer(manager, subscriptions, args.max_workers)
+    print(f"после продления и деактивации: expire {sorted(expires)}, деактивированная - статусы {sorted(statuses)}")
+    writer.close()
+    os.remove(DB_FILE)
+
+
+if __name__ == "__main__":
+    main()
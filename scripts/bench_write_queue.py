@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Пропускная способность покупок: коммит на каждую запись против группового
+коммита через очередь записи (api/write_queue.py).
+
+Использование:
+    python3 bench_write_queue.py [--purchases 2000] [--concurrency 32] [--delay 0.005]
+
+Во временной БД N потоков параллельно вызывают create_subscription
+(как ProvisioningWorker с очередью записи). Для каждого режима выводятся
+покупок/с, число COMMIT и проверка, что ни один UUID пула не выдан дважды.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+workdir = tempfile.mkdtemp()
+os.environ['DB_FILE'] = os.path.join(workdir, 'template.db')
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+
+from bot.config import DB_FILE
+from api.database import init_database, add_server, import_uuid_pool
+from api.vpn_manager import VPNManager
+from api.repository import SQLiteRepository
+from api.write_queue import WriteQueue
+
+
+def seed(purchases):
+    init_database()
+    for i in range(2):
+        server_id = add_server(f"Bench {i}", f"10.0.0.{i + 1}", 443, 'pk', max_users=purchases * 2)
+        import_uuid_pool([{'uuid': str(uuid.uuid4()), 'email': f"pool_{j:05d}"} for j in range(purchases)], server_id)
+
+
+def run(name, purchases, concurrency, delay):
+    db_file = os.path.join(workdir, f"{name}.db")
+    shutil.copy(DB_FILE, db_file)
+    write_queue = WriteQueue(db_file, max_delay=delay) if delay else None
+    manager = VPNManager(repository=SQLiteRepository(db_file, write_queue))
+
+    def buy(user):
+        return manager.create_subscription(100000 + user, f"user{user}", 30)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(buy, range(purchases)))
+    elapsed = time.perf_counter() - started
+    if write_queue:
+        write_queue.close()
+
+    conn = sqlite3.connect(db_file)
+    duplicates = conn.execute("""
+        SELECT COUNT(*) FROM (
+            SELECT uuid FROM subscriptions GROUP BY uuid HAVING COUNT(*) > 1
+        )
+    """).fetchone()[0]
+    used = conn.execute("SELECT COUNT(*) FROM uuid_pool WHERE is_used = 1").fetchone()[0]
+    links = conn.execute("SELECT COUNT(*) FROM subscription_servers").fetchone()[0]
+    conn.close()
+
+    ok = sum(1 for r in results if r)
+    commits = write_queue.stats['commits'] if write_queue else ok
+    print(f"{name:>8}: {ok}/{purchases} покупок за {elapsed:.2f}с ({ok / elapsed:.0f}/с), "
+          f"COMMIT: {commits}, UUID пула занято: {used} (связей {links}), дублей UUID: {duplicates}")
+    return ok / elapsed, duplicates == 0 and used == links
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Групповой коммит: покупки в секунду")
+    parser.add_argument('--purchases', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--delay', type=float, default=0.005, help="ожидание пачки очереди записи (секунды)")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    seed(args.purchases)
+
+    direct, direct_ok = run('direct', args.purchases, args.concurrency, 0)
+    grouped, grouped_ok = run('grouped', args.purchases, args.concurrency, args.delay)
+    print(f"Ускорение: x{grouped / direct:.1f}")
+
+    shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(0 if direct_ok and grouped_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Массовое создание подписок из NDJSON или CSV (перенос клиентов из другой панели).
+
+Использование:
+    python3 bulk_provision.py clients.ndjson > tokens.ndjson
+    python3 bulk_provision.py clients.csv --output tokens.csv
+    cat clients.ndjson | python3 bulk_provision.py - --format ndjson
+
+Строка входа - telegram_id, username (может быть пустым), days:
+    NDJSON: {"telegram_id": 123, "username": "ivan", "days": 30}
+    CSV:    telegram_id,username,days (заголовок необязателен)
+
+Вход читается потоком, подписки создаются пачками по --chunk-size строк
+в одной транзакции (VPNManager.bulk_create_subscriptions). На выходе - по
+строке на строку входа в том же формате: status (created / exists /
+error), subscription_token, subscription_url, expires_at, error.
+Пользователям, у которых уже есть активная подписка, новая не создаётся
+(status=exists и её токен), поэтому прерванный импорт можно просто
+запустить заново; --allow-duplicates отключает эту проверку.
+
+Запущенный бот узнаёт о новых подписках при следующей выгрузке снимка
+(SUB_SNAPSHOT_INTERVAL); статическую карту и шарды после импорта
+обновить перезапуском бота.
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.config import SUBSCRIPTION_URL_BASE
+from api.database import init_database
+from api.vpn_manager import VPNManager
+
+FIELDS = ['telegram_id', 'username', 'days']
+OUTPUT_FIELDS = ['telegram_id', 'username', 'days', 'status', 'subscription_token', 'subscription_url',
+                 'expires_at', 'error']
+
+
+def parse_row(line_number, data):
+    """dict(telegram_id, username, days, line) или с ключом error"""
+    row = {'line': line_number, 'telegram_id': data.get('telegram_id'),
+           'username': data.get('username') or None, 'days': data.get('days')}
+    try:
+        row['telegram_id'] = int(row['telegram_id'])
+        row['days'] = int(row['days'])
+        if row['days'] <= 0:
+            raise ValueError("days должно быть больше 0")
+    except (TypeError, ValueError) as e:
+        row['error'] = str(e)
+    return row
+
+
+def read_ndjson(stream):
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError("ожидается объект")
+        except ValueError as e:
+            yield {'line': line_number, 'telegram_id': None, 'username': None, 'days': None,
+                   'error': str(e)}
+            continue
+        yield parse_row(line_number, data)
+
+
+def read_csv(stream):
+    reader = csv.reader(stream)
+    columns = FIELDS
+    for line_number, values in enumerate(reader, 1):
+        if not values or not any(v.strip() for v in values):
+            continue
+        if line_number == 1 and not values[0].strip().lstrip('-').isdigit():
+            columns = [v.strip() for v in values]
+            continue
+        yield parse_row(line_number, dict(zip(columns, (v.strip() for v in values))))
+
+
+def detect_format(path, stream):
+    """По расширению файла, для stdin - по первому символу ('{' - NDJSON)"""
+    if path.endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    if path.endswith('.csv'):
+        return 'csv'
+    first = stream.buffer.peek(1)[:1] if hasattr(stream, 'buffer') else b''
+    return 'ndjson' if first == b'{' else 'csv'
+
+
+class Output:
+    def __init__(self, stream, fmt):
+        self.stream = stream
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(stream, OUTPUT_FIELDS, extrasaction='ignore')
+            self.writer.writeheader()
+
+    def write(self, result):
+        token = result.get('subscription_token')
+        result['subscription_url'] = f"{SUBSCRIPTION_URL_BASE}/{token}" if token else None
+        if self.fmt == 'csv':
+            self.writer.writerow(result)
+        else:
+            self.stream.write(json.dumps({key: result.get(key) for key in OUTPUT_FIELDS},
+                                         ensure_ascii=False) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовое создание подписок из NDJSON/CSV")
+    parser.add_argument('input', help="Файл NDJSON/CSV или - (stdin)")
+    parser.add_argument('--format', choices=['ndjson', 'csv'], help="По умолчанию - по расширению/содержимому")
+    parser.add_argument('--output', help="Файл результатов (по умолчанию stdout)")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="Строк в одной транзакции")
+    parser.add_argument('--allow-duplicates', action='store_true',
+                        help="Создавать подписку, даже если у пользователя уже есть активная")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+    # Сообщения миграций - в stderr, stdout занят результатами
+    with contextlib.redirect_stdout(sys.stderr):
+        init_database()
+
+    if args.input == '-':
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+    else:
+        stream = open(args.input, 'r', encoding='utf-8', newline='')
+    fmt = args.format or detect_format(args.input, stream)
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    output = Output(out, fmt)
+
+    rows = read_ndjson(stream) if fmt == 'ndjson' else read_csv(stream)
+    manager = VPNManager()
+    counts = {}
+    started = time.perf_counter()
+    try:
+        for result in manager.bulk_create_subscriptions(rows, args.chunk_size,
+                                                        skip_active=not args.allow_duplicates):
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+            if result['status'] == 'error':
+                print(f"Строка {result['line']}: {result['error']}", file=sys.stderr)
+            output.write(result)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    print(f"Строк: {total} за {elapsed:.1f}с ({total / elapsed if elapsed else 0:.0f}/с): "
+          + ', '.join(f"{status} {count}" for status, count in sorted(counts.items())), file=sys.stderr)
+    sys.exit(1 if counts.get('error') else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Сбор счётчиков трафика со всех VPN узлов (Xray stats API по SSH).
+
+Использование:
+    python3 collect_traffic.py
+
+Обычно сбор выполняет бот (TRAFFIC_COLLECT_INTERVAL > 0), скрипт - для cron.
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.config import TRAFFIC_STATS_COMMAND, USAGE_DB_FILE
+from api.database import init_database
+from api.vpn_manager import VPNManager
+from api.traffic import TrafficCollector
+from api.usage_store import UsageStore
+
+
+def main():
+    init_database()
+    usage_store = UsageStore(USAGE_DB_FILE)
+    count = TrafficCollector(VPNManager(), TRAFFIC_STATS_COMMAND, usage_store=usage_store).collect()
+    usage_store.apply_retention()
+    print(f"Трафик обновлён для {count} подписок")
+
+
+if __name__ == "__main__":
+    main()
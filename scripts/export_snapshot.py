@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Выгрузка снимка token -> payload для subscription сервера (SUB_READ_MODE=snapshot).
+
+Использование:
+    python3 export_snapshot.py [snapshot_file]
+
+Обычно снимок выгружает бот (SUB_SNAPSHOT_INTERVAL > 0),
+скрипт нужен для cron или первичной выгрузки.
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.config import DB_FILE, SUB_SNAPSHOT_FILE
+from api.sub_snapshot import export_snapshot
+
+
+def main():
+    snapshot_file = sys.argv[1] if len(sys.argv) > 1 else SUB_SNAPSHOT_FILE
+    count = export_snapshot(DB_FILE, snapshot_file)
+    print(f"Выгружено подписок: {count} -> {snapshot_file}")
+
+
+if __name__ == "__main__":
+    main()
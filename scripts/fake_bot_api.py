@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Локальный фейковый Telegram Bot API для тестов и нагрузочных прогонов.
+
+Понимает getMe, sendMessage, editMessageText, answerCallbackQuery,
+deleteMessage, getUpdates и отвечает 429 с retry_after при превышении
+лимитов (глобального и на чат), как настоящий Bot API.
+
+Использование:
+    python3 fake_bot_api.py [port] [--global-rate 30] [--per-chat-rate 1]
+
+Из кода:
+    api = FakeBotAPI(global_rate=30, per_chat_rate=1).start()
+    bot = Bot(token, base_url=api.base_url)
+"""
+import argparse
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class FakeBotAPI:
+    def __init__(self, host='127.0.0.1', port=0, global_rate=30, per_chat_rate=1, latency=0.0, on_message=None):
+        self.global_rate = global_rate
+        self.per_chat_rate = per_chat_rate
+        self.latency = latency
+        # on_message(method, chat_id, text) - из потока сервера на каждое принятое сообщение
+        self.on_message = on_message
+        self.calls = defaultdict(int)
+        self.messages = []
+        self.rejected = 0
+        self._global = deque()
+        self._chats = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _over_limit(self, chat_id):
+        """Скользящее окно в 1 секунду: глобально и для чата"""
+        now = time.monotonic()
+        with self._lock:
+            for window in (self._global, self._chats[chat_id]):
+                while window and now - window[0] > 1.0:
+                    window.popleft()
+            if len(self._global) >= self.global_rate or len(self._chats[chat_id]) >= self.per_chat_rate:
+                self.rejected += 1
+                return True
+            self._global.append(now)
+            self._chats[chat_id].append(now)
+            self._message_id += 1
+            return False
+
+    def _result(self, method, params):
+        now = int(time.time())
+        chat_id = params.get('chat_id')
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+        if method == 'getUpdates':
+            return []
+        if method in ('sendMessage', 'editMessageText'):
+            self.messages.append((method, chat_id, params.get('text')))
+            if self.on_message:
+                self.on_message(method, chat_id, params.get('text'))
+            return {
+                'message_id': self._message_id,
+                'date': now,
+                'chat': {'id': int(chat_id or 0), 'type': 'private'},
+                'text': params.get('text', '')
+            }
+        return True
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Заголовки и тело уходят разными write, без этого Nagle добавляет ~40мс на ответ
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _params(self):
+                length = int(self.headers.get('Content-Length', 0) or 0)
+                body = self.rfile.read(length) if length else b''
+                content_type = self.headers.get('Content-Type', '')
+                if 'json' in content_type:
+                    return json.loads(body or b'{}')
+                params = {k: v[0] for k, v in parse_qs(body.decode('utf-8')).items()}
+                # Вложенные значения python-telegram-bot передаёт как JSON строки
+                for key, value in params.items():
+                    if value[:1] in ('{', '['):
+                        try:
+                            params[key] = json.loads(value)
+                        except ValueError:
+                            pass
+                return params
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                method = self.path.rsplit('/', 1)[-1]
+                params = self._params()
+                api.calls[method] += 1
+                if api.latency:
+                    time.sleep(api.latency)
+
+                if method in ('sendMessage', 'editMessageText') and api._over_limit(params.get('chat_id')):
+                    self._reply(429, {
+                        'ok': False,
+                        'error_code': 429,
+                        'description': 'Too Many Requests: retry after 1',
+                        'parameters': {'retry_after': 1}
+                    })
+                    return
+
+                self._reply(200, {'ok': True, 'result': api._result(method, params)})
+
+            do_GET = do_POST
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый Telegram Bot API")
+    parser.add_argument('port', type=int, nargs='?', default=8999)
+    parser.add_argument('--global-rate', type=float, default=30)
+    parser.add_argument('--per-chat-rate', type=float, default=1)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(port=args.port, global_rate=args.global_rate, per_chat_rate=args.per_chat_rate)
+    print(f"Fake Bot API: {api.base_url}<token>/<method>")
+    api._server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Локальный фейковый платёжный провайдер для разработки и нагрузочных прогонов.
+
+    POST /payments   {order_id, amount, idempotency_key} -> {id, url}
+                     (тот же idempotency_key - тот же платёж)
+    GET  /pay/<id>   "оплатить" платёж (ссылка, которую бот показывает пользователю)
+
+После оплаты провайдер отправляет подписанный webhook
+(X-Payment-Signature = HMAC-SHA256 тела) на webhook_url, повторяет доставку
+при ошибках и, как настоящие провайдеры, иногда доставляет его повторно.
+
+Использование:
+    python3 fake_payment_provider.py [port]
+    (webhook_url и секрет - из SUBSCRIPTION_URL_BASE хоста и PAYMENT_WEBHOOK_SECRET)
+
+Из кода:
+    provider = FakePaymentProvider(webhook_url, secret, auto_pay=True).start()
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.payments import SIGNATURE_HEADER, sign
+
+
+class FakePaymentProvider:
+    def __init__(self, webhook_url, secret, host='127.0.0.1', port=0, auto_pay=False,
+                 pay_delay=0.0, duplicate_rate=0.2, max_deliveries=5, workers=8, seed=None):
+        self.webhook_url = webhook_url
+        self.secret = secret
+        self.auto_pay = auto_pay
+        self.pay_delay = pay_delay
+        self.duplicate_rate = duplicate_rate
+        self.max_deliveries = max_deliveries
+        self.payments = {}
+        self.by_key = {}
+        self.stats = {'created': 0, 'paid': 0, 'webhooks': 0, 'duplicates': 0, 'delivery_errors': 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._pending = 0
+        self._idle = threading.Condition(self._lock)
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._pool.shutdown(wait=False)
+
+    def wait_idle(self, timeout=60):
+        """Ждёт, пока все webhook'и доставлены"""
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def create(self, order_id, amount, idempotency_key):
+        with self._lock:
+            payment_id = self.by_key.get(idempotency_key)
+            created = payment_id is None
+            if created:
+                payment_id = uuid.uuid4().hex
+                self.by_key[idempotency_key] = payment_id
+                self.payments[payment_id] = {'order_id': order_id, 'amount': amount, 'status': 'pending'}
+                self.stats['created'] += 1
+        if created and self.auto_pay:
+            self._schedule(self._pay_later, payment_id)
+        return payment_id
+
+    def pay(self, payment_id):
+        with self._lock:
+            payment = self.payments.get(payment_id)
+            if payment is None or payment['status'] != 'pending':
+                return False
+            payment['status'] = 'succeeded'
+            self.stats['paid'] += 1
+            copies = 2 if self._rng.random() < self.duplicate_rate else 1
+            self.stats['duplicates'] += copies - 1
+        event = {'id': payment_id, 'order_id': payment['order_id'], 'amount': payment['amount'], 'status': 'succeeded'}
+        for _ in range(copies):
+            self._schedule(self._deliver, event)
+        return True
+
+    def _schedule(self, fn, *args):
+        with self._lock:
+            self._pending += 1
+        self._pool.submit(self._run, fn, *args)
+
+    def _run(self, fn, *args):
+        try:
+            fn(*args)
+        finally:
+            with self._idle:
+                self._pending -= 1
+                self._idle.notify_all()
+
+    def _pay_later(self, payment_id):
+        if self.pay_delay:
+            time.sleep(self.pay_delay)
+        self.pay(payment_id)
+
+    def _deliver(self, event):
+        body = json.dumps(event).encode('utf-8')
+        delay = 0.1
+        for _ in range(self.max_deliveries):
+            request = urllib.request.Request(self.webhook_url, data=body, method='POST', headers={
+                'Content-Type': 'application/json',
+                SIGNATURE_HEADER: sign(self.secret, body)
+            })
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    response.read()
+                with self._lock:
+                    self.stats['webhooks'] += 1
+                return
+            except Exception:
+                with self._lock:
+                    self.stats['delivery_errors'] += 1
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+
+    def _handler(self):
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, payload, content_type='application/json'):
+                body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if self.path != '/payments':
+                    self._reply(404, {'error': 'not found'})
+                    return
+                length = int(self.headers.get('Content-Length', 0) or 0)
+                data = json.loads(self.rfile.read(length) or b'{}')
+                payment_id = provider.create(data['order_id'], data['amount'], data['idempotency_key'])
+                self._reply(200, {'id': payment_id, 'url': f"{provider.base_url}/pay/{payment_id}"})
+
+            def do_GET(self):
+                if not self.path.startswith('/pay/'):
+                    self._reply(404, {'error': 'not found'})
+                    return
+                paid = provider.pay(self.path[len('/pay/'):])
+                text = "Оплачено" if paid else "Платёж не найден или уже оплачен"
+                self._reply(200, text.encode('utf-8'), 'text/plain; charset=utf-8')
+
+        return Handler
+
+
+def main():
+    from bot.config import PAYMENT_WEBHOOK_SECRET, SUBSCRIPTION_URL_BASE
+
+    parser = argparse.ArgumentParser(description="Фейковый платёжный провайдер")
+    parser.add_argument('port', type=int, nargs='?', default=8090)
+    args = parser.parse_args()
+
+    webhook_url = SUBSCRIPTION_URL_BASE.rsplit('/sub', 1)[0] + '/payments/webhook'
+    provider = FakePaymentProvider(webhook_url, PAYMENT_WEBHOOK_SECRET, port=args.port)
+    print(f"Fake payment provider: {provider.base_url}, webhook -> {webhook_url}")
+    provider._server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Проверка доступности VPN серверов.
+
+Использование:
+    python3 health_probe.py          - одна проверка всех серверов, вывод таблицы
+    python3 health_probe.py --loop   - проверять раз в HEALTH_PROBE_INTERVAL (или 60) секунд
+
+Обычно проверки выполняет бот (HEALTH_PROBE_INTERVAL > 0). Когда сервер
+выпадает или возвращается, payload'ы его подписок пересобираются: здесь -
+снимок (SUB_SNAPSHOT_INTERVAL > 0) и шарды (SHARDS). Статическую карту
+ведёт только бот (единственный писатель) - с ней проверяйте ботом.
+"""
+import asyncio
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+
+from bot.config import (
+    DB_FILE, HEALTH_PROBE_INTERVAL, HEALTH_PROBE_MODE, HEALTH_PROBE_TIMEOUT,
+    SUB_SNAPSHOT_FILE, SUB_SNAPSHOT_INTERVAL, STATIC_MAP_BASE, SHARDS, SHARD_SECRET
+)
+from api.database import init_database
+from api.vpn_manager import VPNManager
+from api.health import HealthProber
+
+logger = logging.getLogger(__name__)
+
+
+def rebuild_payloads(event, data):
+    """Пересборка производных хранилищ после смены доступности серверов"""
+    if event != 'servers_changed':
+        return
+    if SUB_SNAPSHOT_INTERVAL > 0:
+        from api.sub_snapshot import export_snapshot
+        export_snapshot(DB_FILE, SUB_SNAPSHOT_FILE)
+    if SHARDS:
+        from api.sharding import ShardClient, ShardOutbox, parse_shards
+        outbox = ShardOutbox(ShardClient(parse_shards(SHARDS), SHARD_SECRET, db_file=DB_FILE))
+        for token in data['subscription_tokens']:
+            outbox.add(token)
+        if outbox.flush() is not None:
+            logger.error(f"Шарды: {len(outbox)} подписок не отправлено, запустите scripts/shards.py sync")
+    if STATIC_MAP_BASE:
+        logger.warning("Статическую карту пересобирает только бот: её payload'ы обновятся, "
+                       "если проверки выполняет бот (HEALTH_PROBE_INTERVAL > 0), или при его перезапуске")
+
+
+async def check_once(prober):
+    servers = await asyncio.to_thread(prober._load_servers)
+    await prober.probe_all(servers)
+    for server in servers:
+        health = prober.stats[server['id']]
+        rtt = f"{health.rtt_ms:.1f} мс" if health.rtt_ms is not None else "-"
+        status = "OK" if health.results[-1] else "FAIL"
+        print(f"{server['name']:<20} {server['ip']}:{server['port']:<6} {status:<5} {rtt}")
+
+
+def main():
+    init_database()
+    vpn_manager = VPNManager()
+    vpn_manager.add_listener(rebuild_payloads)
+    prober = HealthProber(vpn_manager, HEALTH_PROBE_MODE, HEALTH_PROBE_TIMEOUT)
+
+    if '--loop' in sys.argv:
+        asyncio.run(prober.run(HEALTH_PROBE_INTERVAL or 60))
+    else:
+        asyncio.run(check_once(prober))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Применение миграций схемы vpn.db (api/migrations.py).
+
+Использование:
+    python3 migrate.py                 - применить все недостающие миграции
+    python3 migrate.py --status        - текущая версия и список недостающих
+    python3 migrate.py --target 3      - применить миграции до версии 3
+    python3 migrate.py --batch-size 2000 --pause 0.05
+    python3 migrate.py --check         - прогон миграций на временной БД старой
+                                         схемы (бывший scripts/init_db.sql)
+
+Миграции можно запускать на работающей БД: большие таблицы
+переписываются пачками, между пачками бот и subscription сервер
+получают доступ к БД. Чем меньше batch-size и больше pause,
+тем меньше задержки у них и дольше миграция.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.config import DB_FILE
+from api.migrations import SCHEMA_VERSION, migrate, pending_migrations, schema_version
+
+# Схема бывшего scripts/init_db.sql (БД до api/migrations.py)
+LEGACY_INIT_DB = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_id INTEGER UNIQUE NOT NULL,
+    username TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS subscriptions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    uuid TEXT UNIQUE NOT NULL,
+    config_link TEXT NOT NULL,
+    expires_at DATETIME NOT NULL,
+    is_active INTEGER DEFAULT 1,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+CREATE TABLE IF NOT EXISTS payments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    duration_days INTEGER NOT NULL,
+    payment_method TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+INSERT INTO users (telegram_id, username) VALUES (100, 'legacy');
+INSERT INTO subscriptions (user_id, uuid, config_link, expires_at)
+VALUES (1, 'b2c7e0a4-5d1f-4c3e-9a8b-1f2e3d4c5b6a', 'vless://b2c7e0a4-5d1f-4c3e-9a8b-1f2e3d4c5b6a@203.0.113.1:443', '2030-01-01 00:00:00');
+INSERT INTO payments (user_id, amount, duration_days, payment_method) VALUES (1, 199.0, 30, 'card');
+"""
+
+
+def check_legacy():
+    """
+    Миграции на БД старой схемы: с нуля и после миграций, прошедших
+    поверх старой payments (версия 11). Проверяется, что платёж
+    создаётся (api/payments.py), а старые платежи остались в payments_legacy
+    """
+    from api.payments import PaymentLedger
+    from api.repository import SQLiteRepository
+
+    ok = True
+    for name, version in (("init_db.sql, версия 0", 0), ("init_db.sql, версия 11", 11)):
+        db_file = os.path.join(tempfile.mkdtemp(), 'legacy.db')
+        conn = sqlite3.connect(db_file)
+        conn.executescript(LEGACY_INIT_DB)
+        conn.close()
+        if version:
+            # Как на БД, где миграции 1-11 прошли до исправления миграции 6
+            migrate(db_file, target=version, log=lambda message: None)
+            conn = sqlite3.connect(db_file)
+            conn.execute("PRAGMA legacy_alter_table = ON")
+            conn.execute("DROP TABLE payments")
+            conn.execute("ALTER TABLE payments_legacy RENAME TO payments")
+            conn.commit()
+            conn.close()
+        try:
+            migrate(db_file, log=lambda message: None)
+            payment = PaymentLedger(SQLiteRepository(db_file)).create('check', 100, 'legacy', '1_month', 199, 30, 'none')
+            conn = sqlite3.connect(db_file)
+            legacy = conn.execute("SELECT COUNT(*) FROM payments_legacy").fetchone()[0]
+            subscriptions = conn.execute("SELECT COUNT(*) FROM subscriptions").fetchone()[0]
+            current = schema_version(conn)
+            conn.close()
+            passed = (payment['status'] == 'pending' and legacy == 1 and subscriptions == 1
+                      and current == SCHEMA_VERSION)
+            print(f"{name}: {'OK' if passed else 'ОШИБКА'} (версия {current}, payments_legacy {legacy}, "
+                  f"подписок {subscriptions})")
+        except Exception as e:
+            passed = False
+            print(f"{name}: ОШИБКА {e}")
+        ok = ok and passed
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument('--status', action='store_true')
+    parser.add_argument('--target', type=int)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--pause', type=float, default=0.01)
+    parser.add_argument('--check', action='store_true')
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(0 if check_legacy() else 1)
+
+    conn = sqlite3.connect(DB_FILE)
+    current = schema_version(conn)
+    pending = pending_migrations(conn, args.target)
+    conn.close()
+
+    print(f"БД: {DB_FILE}")
+    print(f"Версия схемы: {current} (последняя {SCHEMA_VERSION})")
+    if args.status or not pending:
+        for version, description, _ in pending:
+            print(f"  ожидает {version}: {description}")
+        if not pending:
+            print("Схема актуальна")
+        return
+
+    applied = migrate(DB_FILE, args.target, args.batch_size, args.pause, log=print)
+
+    print("\nИтого:")
+    for version, description, seconds in applied:
+        print(f"  {version:>3}  {seconds:8.2f}с  {description}")
+    print(f"  всего {sum(s for _, _, s in applied):.2f}с")
+
+
+if __name__ == "__main__":
+    main()
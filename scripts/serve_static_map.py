@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Минимальный HTTP сервер /sub/<token> поверх статической карты (без Flask и SQLite).
+
+Использование:
+    python3 serve_static_map.py <base> [host] [port]
+
+base - путь карты без расширения (STATIC_MAP_BASE), карту ведёт бот.
+Тело ответа отдаётся прямо из mmap (memoryview), без копирования.
+"""
+import asyncio
+import struct
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.static_map import StaticMapReader
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 503: 'Service Unavailable'}
+
+
+def make_handler(reader):
+    async def handle(client_reader, client_writer):
+        try:
+            while True:
+                request_line = await client_reader.readline()
+                if not request_line:
+                    break
+                # Заголовки запроса не нужны, но их надо вычитать
+                keep_alive = True
+                while True:
+                    line = await client_reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    if line.lower().startswith(b'connection:') and b'close' in line.lower():
+                        keep_alive = False
+
+                parts = request_line.split()
+                path = parts[1].decode('latin-1') if len(parts) > 1 else ''
+                status, headers, body = 400, b'', b''
+                if path.startswith('/sub/'):
+                    try:
+                        found = reader.lookup(path[5:].split('?', 1)[0])
+                    except (OSError, ValueError, struct.error) as e:
+                        # Карта ещё не выгружена ботом или файл подменили между stat и open:
+                        # клиент повторит запрос, соединение остаётся рабочим
+                        print(f"Статическая карта недоступна: {e}", file=sys.stderr)
+                        found = False
+                    if found is False:
+                        status, headers = 503, b'Retry-After: 1'
+                    elif found is None:
+                        status = 404
+                    elif not found[0]:
+                        status = 403
+                    else:
+                        status, headers, body = 200, found[1], found[2]
+
+                head = (
+                    f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                ).encode('ascii')
+                client_writer.write(head)
+                if headers:
+                    client_writer.write(headers)
+                    client_writer.write(b'\r\n')
+                client_writer.write(b'\r\n')
+                if body:
+                    client_writer.write(body)
+                await client_writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            client_writer.close()
+
+    return handle
+
+
+async def serve(base, host, port):
+    reader = StaticMapReader(base)
+    server = await asyncio.start_server(make_handler(reader), host, port)
+    print(f"Статическая карта {base} на {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Использование: python3 serve_static_map.py <base> [host] [port]")
+        sys.exit(1)
+
+    base = sys.argv[1]
+    host = sys.argv[2] if len(sys.argv) > 2 else '0.0.0.0'
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else 8081
+    asyncio.run(serve(base, host, port))
+
+
+if __name__ == "__main__":
+    main()
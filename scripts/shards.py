@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Управление шардами subscription сервера.
+
+Использование:
+    python3 shards.py sync             - выгрузить все подписки из vpn.db владельцам шардов
+    python3 shards.py prune            - удалить из шардов токены, которые принадлежат другим
+    python3 shards.py local <N> [port] - запустить N шардов локально (для тестирования)
+
+Добавление шарда:
+    1. Запустить новый экземпляр сервера с SHARD_LOCAL для нового шарда
+    2. Дописать шард в SHARDS и выполнить sync (перемещённые токены попадут к новому владельцу)
+    3. Перезапустить бота и серверы с новым SHARDS
+    4. Выполнить prune
+
+Кольцо и секрет берутся из SHARDS и SHARD_SECRET (.env).
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.config import DB_FILE, SHARDS, SHARD_SECRET
+from api.sharding import ShardClient, parse_shards
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api', 'subscription_server.py')
+
+
+def run_local(count, base_port):
+    """Поднимает count экземпляров сервера, по одному шарду на каждый, и заполняет их"""
+    workdir = tempfile.mkdtemp(prefix='vpn_shards_')
+    secret = SHARD_SECRET or 'local-shard-secret'
+    names = [f"s{i}" for i in range(count)]
+    shards = ','.join(f"{name}=http://127.0.0.1:{base_port + i}" for i, name in enumerate(names))
+
+    processes = []
+    for i, name in enumerate(names):
+        env = dict(
+            os.environ,
+            SUB_READ_MODE='sharded',
+            SHARDS=shards,
+            SHARD_LOCAL=f"{name}={os.path.join(workdir, name + '.db')}",
+            SHARD_SECRET=secret,
+            SUBSCRIPTION_HOST='127.0.0.1',
+            SUBSCRIPTION_PORT=str(base_port + i)
+        )
+        processes.append(subprocess.Popen([sys.executable, SERVER_SCRIPT], env=env))
+
+    time.sleep(2)
+    client = ShardClient(parse_shards(shards), secret)
+    print(f"Выгружено подписок: {client.sync_from_db(DB_FILE)}")
+    print(f"SHARDS={shards}")
+    print(f"SHARD_SECRET={secret}")
+    print(f"Шарды в {workdir}, Ctrl+C для остановки")
+
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('sync', 'prune', 'local'):
+        print(__doc__)
+        sys.exit(1)
+
+    command = sys.argv[1]
+
+    if command == 'local':
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+        base_port = int(sys.argv[3]) if len(sys.argv) > 3 else 8081
+        run_local(count, base_port)
+        return
+
+    if not SHARDS or not SHARD_SECRET:
+        print("SHARDS и SHARD_SECRET должны быть заданы")
+        sys.exit(1)
+
+    client = ShardClient(parse_shards(SHARDS), SHARD_SECRET)
+    if command == 'sync':
+        print(f"Выгружено подписок: {client.sync_from_db(DB_FILE)}")
+    else:
+        print(f"Удалено чужих токенов: {client.prune()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Симулятор размещения подписок: прогоняет месяцы покупок и истечений
+через стратегии из api/placement.py и печатает дисбаланс нагрузки.
+
+Использование:
+    python3 simulate_placement.py [--days 180] [--servers 6] [--rate 4] [--per-sub 2] [--seed 1]
+
+Модель: покупки - пуассоновский поток rate в день, тарифы 1/3/6/12 месяцев,
+серверы разной ёмкости и размера пула, случайные дневные сбои серверов.
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.placement import AllServersPlacement, LoadAwarePlacement
+
+PLANS = [(30, 0.6), (90, 0.25), (180, 0.1), (365, 0.05)]
+
+
+def poisson(rng, lam):
+    """Пуассоновская случайная величина (алгоритм Кнута, lam небольшие)"""
+    limit = math.exp(-lam)
+    k, p = 0, 1.0
+    while True:
+        p *= rng.random()
+        if p <= limit:
+            return k
+        k += 1
+
+
+def make_servers(rng, count):
+    servers = []
+    for i in range(count):
+        max_users = rng.choice([60, 60, 100, 150])
+        pool = int(max_users * rng.uniform(1.0, 1.6))
+        servers.append({
+            'id': i + 1,
+            'name': f"srv{i + 1}",
+            'max_users': max_users,
+            'current_users': 0,
+            'pool_total': pool,
+            'pool_free': pool,
+            'failure_rate': 0.0,
+            'bandwidth_util': 0.0,
+        })
+    return servers
+
+
+def simulate(strategy, args):
+    rng = random.Random(args.seed)
+    servers = make_servers(rng, args.servers)
+    by_id = {s['id']: s for s in servers}
+    expiries = {}
+    imbalance, spread, peaks = [], [], []
+    sold = rejected = assigned = 0
+
+    for day in range(args.days):
+        # Истечения: место и UUID возвращаются в пул
+        for server_ids in expiries.pop(day, []):
+            for server_id in server_ids:
+                by_id[server_id]['current_users'] -= 1
+                by_id[server_id]['pool_free'] += 1
+
+        # Сбои за день
+        for server in servers:
+            server['failure_rate'] = 1.0 if rng.random() < args.outage else 0.0
+
+        for _ in range(poisson(rng, args.rate)):
+            chosen = [s for s in strategy.select(servers) if s['pool_free'] > 0]
+            if not chosen:
+                rejected += 1
+                continue
+            duration = rng.choices([p for p, _ in PLANS], [w for _, w in PLANS])[0]
+            for server in chosen:
+                server['current_users'] += 1
+                server['pool_free'] -= 1
+            expiries.setdefault(day + duration, []).append([s['id'] for s in chosen])
+            sold += 1
+            assigned += len(chosen)
+
+        utilization = [s['current_users'] / s['max_users'] for s in servers]
+        imbalance.append(max(utilization) - min(utilization))
+        spread.append(statistics.pstdev(utilization))
+        peaks.append(max(utilization))
+
+    imbalance.sort()
+    return {
+        'sold': sold,
+        'rejected': rejected,
+        'servers_per_sub': assigned / sold if sold else 0,
+        'imbalance_mean': statistics.mean(imbalance),
+        'imbalance_p95': imbalance[int(len(imbalance) * 0.95) - 1],
+        'stdev_mean': statistics.mean(spread),
+        'peak_utilization': max(peaks),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Симуляция размещения подписок")
+    parser.add_argument('--days', type=int, default=180)
+    parser.add_argument('--servers', type=int, default=6)
+    parser.add_argument('--rate', type=float, default=4, help="покупок в день")
+    parser.add_argument('--per-sub', type=int, default=2, help="серверов на подписку для load_aware")
+    parser.add_argument('--outage', type=float, default=0.02, help="вероятность сбоя сервера за день")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    strategies = [
+        AllServersPlacement(),
+        LoadAwarePlacement(args.per_sub, rng=random.Random(args.seed)),
+    ]
+
+    print(f"{'стратегия':<12} {'продано':>8} {'отказов':>8} {'сер/подп':>9} "
+          f"{'дисб.ср':>8} {'дисб.p95':>9} {'σ.ср':>6} {'пик':>6}")
+    for strategy in strategies:
+        r = simulate(strategy, args)
+        print(f"{strategy.name:<12} {r['sold']:>8} {r['rejected']:>8} {r['servers_per_sub']:>9.2f} "
+              f"{r['imbalance_mean']:>8.3f} {r['imbalance_p95']:>9.3f} {r['stdev_mean']:>6.3f} "
+              f"{r['peak_utilization']:>6.2f}")
+
+
+if __name__ == "__main__":
+    main()